@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aboutconfig', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='datatype_id',
+            field=models.IntegerField(choices=[(1, 'text'), (2, 'integer'), (3, 'decimal'), (4, 'boolean'), (5, 'JSON'), (6, 'list of IPv4 networks')], default=1, verbose_name='data type'),
+        ),
+    ]
@@ -1,38 +1,123 @@
 # vim: set ts=8 sw=4 sts=4 et ai:
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import gettext_lazy as _
+from osso.core.cidr4 import cidr4
 from osso.core.models import Model, SafeCharField
 
 
 DATATYPE_TEXT = 1
+DATATYPE_INTEGER = 2
+DATATYPE_DECIMAL = 3
+DATATYPE_BOOLEAN = 4
+DATATYPE_JSON = 5
+DATATYPE_CIDR4_LIST = 6
 # DATATYPE_UNDEFINED = UNDEFINED
 
+DATATYPE_CHOICES = (
+    (DATATYPE_TEXT, _('text')),
+    (DATATYPE_INTEGER, _('integer')),
+    (DATATYPE_DECIMAL, _('decimal')),
+    (DATATYPE_BOOLEAN, _('boolean')),
+    (DATATYPE_JSON, _('JSON')),
+    (DATATYPE_CIDR4_LIST, _('list of IPv4 networks')),
+)
+
+BOOLEAN_VALUES = {
+    '1': True, 'true': True, 'yes': True, 'on': True,
+    '0': False, 'false': False, 'no': False, 'off': False,
+}
+
+
+def _parse_boolean(value):
+    try:
+        return BOOLEAN_VALUES[value.lower()]
+    except KeyError:
+        raise ValueError('Expected a boolean value, e.g. 1 or 0')
+
+
+def _parse_cidr4_list(value):
+    # Separated by whitespace and/or commas.
+    return [cidr4(i) for i in value.replace(',', ' ').split()]
+
+
+def _parse_decimal(value):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError('Expected a decimal value, e.g. 1.23')
+
+
+DATATYPE_PARSERS = {
+    DATATYPE_TEXT: str,
+    DATATYPE_INTEGER: int,
+    DATATYPE_DECIMAL: _parse_decimal,
+    DATATYPE_BOOLEAN: _parse_boolean,
+    DATATYPE_JSON: json.loads,
+    DATATYPE_CIDR4_LIST: _parse_cidr4_list,
+}
+
+
+def parse_value(datatype_id, value):
+    '''
+    Convert the stored value string to the Python value for the data
+    type. Raises ValueError if the value does not fit the data type.
+
+    >>> parse_value(DATATYPE_INTEGER, '42')
+    42
+    >>> parse_value(DATATYPE_BOOLEAN, 'Yes')
+    True
+    >>> parse_value(DATATYPE_CIDR4_LIST, '10.0.0.0/8, 192.168.1.1')
+    [cidr4("10.0.0.0/8"), cidr4("192.168.1.1")]
+    '''
+    try:
+        parser = DATATYPE_PARSERS[datatype_id]
+    except KeyError:
+        raise ValueError('Unknown data type %r' % (datatype_id,))
+    return parser(value)
+
 
 class Item(Model):
     '''
     Generic model to dynamically store various additional database fields.
 
-    The TEXT datatype strips excess spaces from the value at save time.
+    The value is stripped of excess spaces and checked against the
+    datatype at save time. The aboutconfig() utility function returns
+    the value converted to the datatype (see parse_value).
 
-    The datatype used to be a separate model, but (a) no other data types have
-    been defined since the inception of this app and (b) MongoDB does not like
-    the fact that it used integers as primary keys. At the time, the best fix
-    was to replace the 'datatype' foreign key with a 'datatype_id' integer.
-    This maintains backwards compatibility and fixes so stuff just works on
-    Mongo. As an added bonus, the save() is now quicker, because it doesn't
-    have to look up the PK for TEXT any more.
+    The datatype used to be a separate model, but (a) for a long time TEXT
+    was the only data type and (b) MongoDB does not like the fact that it
+    used integers as primary keys. At the time, the best fix was to replace
+    the 'datatype' foreign key with a 'datatype_id' integer. This maintains
+    backwards compatibility and fixes so stuff just works on Mongo. As an
+    added bonus, the save() is quicker, because it doesn't have to look up
+    a PK. The typed data types are listed in DATATYPE_CHOICES.
     '''
     # One of DATATYPE_TEXT, ...
-    datatype_id = models.IntegerField(verbose_name=_('data type'), default=1)
+    datatype_id = models.IntegerField(
+        verbose_name=_('data type'), choices=DATATYPE_CHOICES,
+        default=DATATYPE_TEXT)
     # Key can be something like "asterisk.management.username"
     key = SafeCharField(_('key'), max_length=63, primary_key=True)
-    # The value, stored in a text field. Other data types may at one point fix
-    # type casting when using the aboutconfig() utility function.
+    # The value, stored in a text field. The aboutconfig() utility function
+    # casts it to the datatype.
     value = models.TextField(_('value'), blank=True)
 
+    def clean(self):
+        try:
+            self.get_typed_value()
+        except ValueError as e:
+            raise ValidationError({'value': str(e)})
+
+    def get_typed_value(self):
+        return parse_value(self.datatype_id, self.value)
+
     def save(self, *args, **kwargs):
-        if self.datatype_id == DATATYPE_TEXT:
-            self.value = self.value.strip()
+        self.value = self.value.strip()
+        self.clean()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -0,0 +1,131 @@
+# vim: set ts=8 sw=4 sts=4 et ai:
+"""
+Change notification channels for the aboutconfig snapshot.
+
+Without a notifier, every process compares the version in the shared
+cache at most once every VERSION_CHECK_TIME seconds. With a notifier,
+changes are pushed to all processes, which drop their snapshot on the
+next lookup. Configure one in the settings, e.g.::
+
+    ABOUTCONFIG_NOTIFIER = {
+        'BACKEND': 'osso.aboutconfig.notify.FileNotifier',
+        'OPTIONS': {'path': '/run/myproject/aboutconfig.changed'},
+    }
+
+The snapshot is still reloaded after CACHE_TIME seconds, as a safety
+net; with a notifier that can be set much higher.
+"""
+import os
+import tempfile
+from uuid import uuid4
+
+from django.db import connections
+
+
+class BaseNotifier(object):
+    """
+    Notification channel interface.
+    """
+    def notify(self):
+        """
+        Tell all processes that an Item changed. Called after commit.
+        """
+        raise NotImplementedError()
+
+    def changed(self):
+        """
+        Return whether there was a notification since the previous call.
+        Called on every lookup, so it must be cheap.
+        """
+        raise NotImplementedError()
+
+
+class FileNotifier(BaseNotifier):
+    """
+    Local stand-in for processes on a single host: a notification
+    replaces the file at path, which the processes stat() on lookup.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._seen = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    def notify(self):
+        # Write a new file and move it in place, so the inode changes
+        # too, even on filesystems with a coarse mtime. The name of the
+        # new file is unique, also between threads.
+        fd, tmp_path = tempfile.mkstemp(
+            prefix='%s.' % (os.path.basename(self.path),), suffix='.tmp',
+            dir=os.path.dirname(self.path) or '.')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                fp.write(uuid4().hex)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def changed(self):
+        seen = self._stat()
+        changed, self._seen = (seen != self._seen), seen
+        return changed
+
+
+class PostgresNotifier(BaseNotifier):
+    """
+    PostgreSQL LISTEN/NOTIFY: every process keeps a separate listening
+    connection to the `using` database, which it polls without a round
+    trip on lookup. Requires psycopg2, or psycopg 3.2 or newer.
+    """
+    def __init__(self, using='default', channel='osso_aboutconfig'):
+        self.using = using
+        self.channel = channel
+        self._listener = None
+        self._pid = None
+
+    def _get_listener(self):
+        # Do not share the connection with forked children.
+        if self._listener is None or self._pid != os.getpid():
+            db = connections[self.using]
+            listener = db.get_new_connection(db.get_connection_params())
+            listener.autocommit = True
+            listener.cursor().execute('LISTEN %s' % (self.channel,))
+            self._listener, self._pid = listener, os.getpid()
+        return self._listener
+
+    def _close_listener(self):
+        # A connection inherited from the parent is not ours to close.
+        if self._listener is not None and self._pid == os.getpid():
+            try:
+                self._listener.close()
+            except Exception:
+                pass
+        self._listener = None
+
+    def notify(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('NOTIFY %s' % (self.channel,))
+
+    def changed(self):
+        try:
+            listener = self._get_listener()
+            if hasattr(listener, 'poll'):  # psycopg2
+                listener.poll()
+                changed = bool(listener.notifies)
+                del listener.notifies[:]
+            else:  # psycopg 3
+                changed = bool(list(listener.notifies(timeout=0)))
+        except Exception:
+            # Reconnect next time; we may have missed notifications.
+            self._close_listener()
+            return True
+        return changed
@@ -1,15 +1,46 @@
 # vim: set ts=8 sw=4 sts=4 et ai:
+import logging
+import time
+from collections import namedtuple
+from threading import Lock
+from uuid import uuid4
+
+from django.conf import settings
 from django.core.cache import cache
-from django.db.models.signals import post_save
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from osso.aboutconfig.models import Item, parse_value
+
 
-from osso.aboutconfig.models import Item
+logger = logging.getLogger(__name__)
 
 
-__all__ = ('CACHE_TIME', 'ConfigError', 'aboutconfig')
+__all__ = ('CACHE_TIME', 'ConfigError', 'aboutconfig', 'aboutconfig_many',
+           'aboutconfig_prefix')
 
-# TODO: add post_save signal on the Item to dirty the cache
+# All Items are kept in a process-local snapshot. Every change of an
+# Item stores a new version in the shared cache. Processes compare that
+# version to the version of their snapshot (at most once every
+# VERSION_CHECK_TIME seconds) and reload the snapshot when it differs,
+# or when it is older than CACHE_TIME seconds. With an
+# ABOUTCONFIG_NOTIFIER (see osso.aboutconfig.notify), changes are pushed
+# instead, and the shared cache is not consulted on lookup. Items that
+# are loaded inside a transaction are not kept in the snapshot.
 CACHE_TIME = 300
+VERSION_CACHE_KEY = 'osso.aboutconfig.version'
+VERSION_CHECK_TIME = 1
+
+_snapshot = {}
+_snapshot_lock = Lock()
+_notifier = None
+
+# Stored values that do not fit their datatype are kept as _Invalid, and
+# raise a ConfigError when looked up.
+_Invalid = namedtuple('_Invalid', 'value description')
 
 
 class ConfigError(ValueError):
@@ -36,9 +67,19 @@ class ConfigError(ValueError):
 
 def aboutconfig(key, default='', set=False):
     '''
-    Search for key in the AboutConfig dictionary and return the value.
-    Returns the empty string (or the supplied default value as unicode string)
-    if the key is not found.
+    Search for key in the AboutConfig dictionary and return the value,
+    converted to the datatype of the Item (a string for TEXT items; see
+    osso.aboutconfig.models.parse_value). Returns the empty string (or
+    the supplied default value as unicode string) if the key is not
+    found. Missing keys are answered from the snapshot too, so probing
+    an unset key costs no query; creating the Item invalidates the
+    snapshot like any other change.
+
+    The default is always returned as a string, also for keys that
+    would be typed: aboutconfig('x', 5) returns '5' while there is no
+    Item, and 5 once there is an integer Item. This keeps the old
+    behaviour for callers that rely on getting strings; convert the
+    result if you need the type either way.
 
     >>> getfixture('db')
     >>> def eq(a, b):
@@ -59,41 +100,183 @@ def aboutconfig(key, default='', set=False):
     >>> Item.objects.filter(key__in=('a.b.c.d.e', 'abc')).delete()
     (1, {'aboutconfig.Item': 1})
     '''
-    cache_key = 'osso.aboutconfig.%s' % key
-
     if set:
         default = default.strip()
-        cache.set(cache_key, default, CACHE_TIME)
         item, created = Item.objects.get_or_create(key=key,
                                                    defaults={'value': default})
         if not created and item.value != default:
+            item.value = default
+            item.clean()  # raises ValidationError for a bad typed value
             now = timezone.now()
             rows = Item.objects.filter(key=key).update(value=default,
                                                        modified=now)
             # backends that do not support matched/affected records
             # by update return None (pymongo)
             assert rows is None or rows == 1
+            # The update() does not send a post_save.
+            _flush_cache(item)
         return
 
-    value = cache.get(cache_key)
-    if value is not None:
-        return value
     try:
-        value = Item.objects.get(key=key).value
-        cache.set(cache_key, value, CACHE_TIME)
-    except Item.DoesNotExist:
-        value = str(default)
+        value = _get_items()[key]
+    except KeyError:
+        return str(default)
+    return _check(key, value)
+
+
+def aboutconfig_many(keys, defaults=None):
+    """
+    Look up several keys at once and return a dictionary of values.
+    The defaults dictionary holds the defaults per key; keys that are
+    not found and have no default get the empty string. Like with
+    aboutconfig(), the defaults are returned as strings.
+
+    >>> getfixture('db')
+    >>> from osso.aboutconfig.models import Item
+    >>> from osso.aboutconfig.utils import aboutconfig_many
+    >>> Item.objects.create(key='a.b', value='1')
+    <Item: a.b>
+    >>> aboutconfig_many(['a.b', 'a.c', 'a.d'], {'a.c': 2})
+    {'a.b': '1', 'a.c': '2', 'a.d': ''}
+    >>> Item.objects.filter(key='a.b').delete()
+    (1, {'aboutconfig.Item': 1})
+    """
+    items = _get_items()
+    defaults = defaults or {}
+    ret = {}
+    for key in keys:
+        try:
+            ret[key] = _check(key, items[key])
+        except KeyError:
+            ret[key] = str(defaults.get(key, ''))
+    return ret
+
+
+def aboutconfig_prefix(prefix):
+    """
+    Return a dictionary of all keys (and values) starting with prefix,
+    e.g. 'asterisk.management.'.
+
+    >>> getfixture('db')
+    >>> from osso.aboutconfig.models import Item
+    >>> from osso.aboutconfig.utils import aboutconfig_prefix
+    >>> Item.objects.create(key='a.b', value='1')
+    <Item: a.b>
+    >>> Item.objects.create(key='a.c', value='2')
+    <Item: a.c>
+    >>> aboutconfig_prefix('a.')
+    {'a.b': '1', 'a.c': '2'}
+    >>> Item.objects.filter(key__in=('a.b', 'a.c')).delete()
+    (2, {'aboutconfig.Item': 2})
+    """
+    items = _get_items()
+    return dict(sorted(
+        (key, _check(key, value)) for key, value in items.items()
+        if key.startswith(prefix)))
+
+
+def _check(key, value):
+    if isinstance(value, _Invalid):
+        raise ConfigError(key, value.value, value.description)
     return value
 
 
-def _flush_cache(instance, created, **kwargs):
-    # Still new? Do nothing..
-    if created:
-        return
+def _get_items():
+    """
+    Return the snapshot of all Item values, converted to their datatype,
+    as a dictionary. Do not modify the (JSON or list) values: they are
+    shared by all callers.
+    """
+    now = time.monotonic()
+    notifier = _get_notifier()
+    with _snapshot_lock:
+        items = _snapshot.get('items')
+        if notifier is not None:
+            # Check for notifications before loading the items, so a
+            # concurrent change causes a reload next time.
+            if (not notifier.changed() and items is not None and
+                    now - _snapshot['loaded'] < CACHE_TIME):
+                return items
+            version = None
+        elif items is not None and now - _snapshot['checked'] < (
+                VERSION_CHECK_TIME):
+            return items
+        else:
+            # Fetch the version before the items, so a concurrent change
+            # causes a reload next time, instead of going unnoticed.
+            version = cache.get(VERSION_CACHE_KEY)
+            if version is None:
+                cache.add(VERSION_CACHE_KEY, uuid4().hex, None)
+                version = cache.get(VERSION_CACHE_KEY)
+            elif (items is not None and version == _snapshot['version'] and
+                    now - _snapshot['loaded'] < CACHE_TIME):
+                _snapshot['checked'] = now
+                return items
+
+        items = {}
+        queryset = Item.objects.values_list('key', 'datatype_id', 'value')
+        for key, datatype_id, value in queryset:
+            try:
+                items[key] = parse_value(datatype_id, value)
+            except ValueError as e:
+                items[key] = _Invalid(value, str(e))
+        if connections[queryset.db].in_atomic_block:
+            # The items may hold changes that are rolled back later:
+            # keep them to this caller. The old snapshot is outdated
+            # (and a notification may be used up), so drop it.
+            _snapshot.clear()
+            return items
+        _snapshot.update(
+            items=items, version=version, loaded=now, checked=now)
+        return items
+
+
+def _get_notifier():
+    """
+    Return the notifier configured in ABOUTCONFIG_NOTIFIER, or None.
+    """
+    global _notifier
+    config = getattr(settings, 'ABOUTCONFIG_NOTIFIER', None)
+    if config is None:
+        return None
+    if _notifier is None:
+        _notifier = import_string(config['BACKEND'])(
+            **config.get('OPTIONS', {}))
+    return _notifier
+
+
+def _bump_version():
+    # A random version instead of a counter, so an evicted and
+    # recreated version can never match an old snapshot.
+    cache.set(VERSION_CACHE_KEY, uuid4().hex, None)
+    notifier = _get_notifier()
+    if notifier is not None:
+        # The commit is done: log the failure and go on. The other
+        # processes reload their snapshot after CACHE_TIME seconds.
+        try:
+            notifier.notify()
+        except Exception:
+            logger.exception('aboutconfig notifier failed')
+    with _snapshot_lock:
+        _snapshot.clear()
+
+
+def _flush_cache(instance, **kwargs):
+    # Drop our own snapshot right away, and tell the other processes
+    # once the change is visible to them.
+    with _snapshot_lock:
+        _snapshot.clear()
+    transaction.on_commit(_bump_version)
+
 
-    # Changed? Then we may need to flush the cache.
-    cache_key = 'osso.aboutconfig.%s' % instance.key
-    cache.delete(cache_key)
+def _reset_notifier(setting, **kwargs):
+    global _notifier
+    if setting == 'ABOUTCONFIG_NOTIFIER':
+        _notifier = None
+        with _snapshot_lock:
+            _snapshot.clear()
 
 
 post_save.connect(_flush_cache, sender=Item)
+post_delete.connect(_flush_cache, sender=Item)
+setting_changed.connect(_reset_notifier)
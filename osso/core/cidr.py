@@ -0,0 +1,347 @@
+# vim: set ts=8 sw=4 sts=4 et ai:
+from collections.abc import Sequence
+
+__all__ = ('BaseCidr', 'CidrRange')
+
+
+_setattr = object.__setattr__
+
+
+class BaseCidr(object):
+    """
+    The address family independent part of cidr4 and cidr6: a network
+    of an integer address and a netmask length (sigbits).
+
+    Subclasses set BITS, and implement _parse() to turn a string into
+    an (address, sigbits) tuple and _as_ip() to format an address.
+    """
+    __slots__ = ('address', 'sigbits')
+
+    BITS = None
+
+    @classmethod
+    def generate_list_from_start_end(cls, start, end_ex):
+        """
+        Generate the networks from start to end (exclusive), using the
+        largest blocks possible.
+        """
+        assert start <= end_ex, (start, end_ex)
+        bits = cls.BITS + 1
+        while start < end_ex:
+            # The largest block that fits, unless start is not aligned
+            # to it; then the largest block start is aligned to.
+            size = 1 << ((end_ex - start).bit_length() - 1)
+            if start & (size - 1):
+                size = start & -start
+            yield cls._from_valid(start, bits - size.bit_length())
+            start += size
+
+    @classmethod
+    def summarize_ranges(cls, ranges):
+        """
+        Generate the fewest networks covering the (first, last) address
+        ranges, both inclusive, which must be sorted by first address.
+        Overlapping and adjacent ranges are merged in a single pass.
+
+        >>> from osso.core.cidr4 import cidr4
+        >>> list(cidr4.summarize_ranges([(0, 3), (2, 5), (6, 7), (9, 9)]))
+        [cidr4("0.0.0.0/29"), cidr4("0.0.0.9")]
+        """
+        start = end_ex = None
+        for first, last in ranges:
+            if end_ex is not None and first <= end_ex:
+                if first < start:
+                    raise ValueError('Ranges are not sorted.')
+                if last >= end_ex:
+                    end_ex = last + 1
+                continue
+            if end_ex is not None:
+                yield from cls.generate_list_from_start_end(start, end_ex)
+            start, end_ex = first, last + 1
+        if end_ex is not None:
+            yield from cls.generate_list_from_start_end(start, end_ex)
+
+    @classmethod
+    def collapse(cls, networks, presorted=False):
+        """
+        Return the fewest networks covering the networks, like
+        ipaddress.collapse_addresses(). Pass presorted=True if they
+        are already sorted to skip the sort.
+
+        >>> from osso.core.cidr4 import cidr4
+        >>> cidr4.collapse([cidr4('10.0.1.0/24'), cidr4('10.0.0.0/24'),
+        ...                 cidr4('10.0.0.128/25'), cidr4('10.0.2.0/24')])
+        [cidr4("10.0.0.0/23"), cidr4("10.0.2.0/24")]
+        """
+        bits = cls.BITS
+        ranges = [
+            (i.address, i.address + (1 << (bits - i.sigbits)) - 1)
+            for i in networks]
+        if not presorted:
+            ranges.sort()
+        return list(cls.summarize_ranges(ranges))
+
+    @classmethod
+    def from_int(cls, address, sigbits=None):
+        """
+        Create a network from an integer address and netmask length
+        (default: a single address), without going through the string
+        parser.
+        """
+        bits = cls.BITS
+        if sigbits is None:
+            sigbits = bits
+        if (address < 0 or address >> bits or
+                sigbits < 0 or sigbits > bits):
+            raise ValueError('Not in %s notation.' % (cls.__name__.upper(),))
+        if address & ((1 << (bits - sigbits)) - 1):
+            raise ValueError('Found non-zero bit to the right of the netmask.')
+        return cls._from_valid(address, sigbits)
+
+    @classmethod
+    def _from_valid(cls, address, sigbits):
+        # Skip the validation and the __setattr__ guard.
+        ret = cls.__new__(cls)
+        _setattr(ret, 'address', address)
+        _setattr(ret, 'sigbits', sigbits)
+        return ret
+
+    @staticmethod
+    def _parse(value):
+        raise NotImplementedError()
+
+    def _as_ip(self, address):
+        raise NotImplementedError()
+
+    def __init__(self, value):
+        if isinstance(value, str):
+            address, sigbits = self._parse(value)
+        elif isinstance(value, type(self)):
+            address, sigbits = value.address, value.sigbits
+        elif (isinstance(value, tuple) and len(value) == 2 and
+                isinstance(value[0], int) and isinstance(value[1], int)):
+            address, sigbits = value
+            bits = self.BITS
+            if (address < 0 or address >> bits or
+                    sigbits < 0 or sigbits > bits):
+                raise ValueError('Not in %s notation.' % (
+                    type(self).__name__.upper(),))
+            if address & ((1 << (bits - sigbits)) - 1):
+                raise ValueError(
+                    'Found non-zero bit to the right of the netmask.')
+        else:
+            raise TypeError('Cannot convert %r to a %s type' % (
+                value, type(self).__name__))
+        _setattr(self, 'address', address)
+        _setattr(self, 'sigbits', sigbits)
+
+    def _coerce(self, other):
+        # Return other as our type, or None if it cannot be converted.
+        try:
+            return type(self)(other)
+        except (TypeError, ValueError):
+            return None
+
+    def __eq__(self, other):
+        if not isinstance(other, type(self)):
+            other = self._coerce(other)
+            if other is None:
+                return NotImplemented
+        return self.address == other.address and self.sigbits == other.sigbits
+
+    def __ne__(self, other):
+        if not isinstance(other, type(self)):
+            other = self._coerce(other)
+            if other is None:
+                return NotImplemented
+        return self.address != other.address or self.sigbits != other.sigbits
+
+    def __lt__(self, other):
+        if not isinstance(other, type(self)):
+            other = self._coerce(other)
+            if other is None:
+                return NotImplemented
+        return self.address < other.address or (
+            self.address == other.address and self.sigbits < other.sigbits)
+
+    def __le__(self, other):
+        if not isinstance(other, type(self)):
+            other = self._coerce(other)
+            if other is None:
+                return NotImplemented
+        return self.address < other.address or (
+            self.address == other.address and self.sigbits <= other.sigbits)
+
+    def __gt__(self, other):
+        if not isinstance(other, type(self)):
+            other = self._coerce(other)
+            if other is None:
+                return NotImplemented
+        return self.address > other.address or (
+            self.address == other.address and self.sigbits > other.sigbits)
+
+    def __ge__(self, other):
+        if not isinstance(other, type(self)):
+            other = self._coerce(other)
+            if other is None:
+                return NotImplemented
+        return self.address > other.address or (
+            self.address == other.address and self.sigbits >= other.sigbits)
+
+    def __cmp__(self, other):
+        other = self._coerce(other)
+        if other is None:
+            return NotImplemented
+        mine = (self.address, self.sigbits)
+        theirs = (other.address, other.sigbits)
+        return (mine > theirs) - (mine < theirs)
+
+    def __setattr__(self, key, value):
+        if key in BaseCidr.__slots__ and not hasattr(self, key):
+            _setattr(self, key, value)
+        else:
+            raise TypeError('immutable')
+
+    def __repr__(self):
+        return '%s("%s")' % (type(self).__name__, self.__str__())
+
+    def __str__(self):
+        return self.as_string(ip_as_net=False)
+
+    def __contains__(self, subset):
+        if not isinstance(subset, type(self)):
+            subset = type(self)(subset)
+
+        if self.sigbits > subset.sigbits:  # more bits is smaller
+            return False
+        return (subset.address >> (self.BITS - self.sigbits) ==
+                self.address >> (self.BITS - self.sigbits))
+
+    def next(self):
+        return type(self)((
+            self.address + (1 << (self.BITS - self.sigbits)),
+            self.sigbits))
+
+    def truncated(self, sigbits):
+        shift = self.BITS - sigbits
+        return self._from_valid(self.address >> shift << shift, sigbits)
+
+    def as_from_to(self):
+        first = self._as_ip(self.address)
+        if self.sigbits == self.BITS:
+            return first
+        last = self.address + (1 << (self.BITS - self.sigbits)) - 1
+        return '[%s - %s]' % (first, self._as_ip(last))
+
+    def as_list(self):
+        return list(self.hosts())
+
+    def hosts(self):
+        """
+        Return a lazy sequence of all addresses in the network, the
+        first and last included.
+
+        >>> from osso.core.cidr4 import cidr4
+        >>> hosts = cidr4('10.0.0.0/8').hosts()
+        >>> len(hosts), hosts[0], hosts[-1], hosts[256]
+        (16777216, cidr4("10.0.0.0"), cidr4("10.255.255.255"), \
+cidr4("10.0.1.0"))
+        >>> list(hosts[1000:1003])
+        [cidr4("10.0.3.232"), cidr4("10.0.3.233"), cidr4("10.0.3.234")]
+        >>> list(reversed(cidr4('10.0.0.0/31').hosts()))
+        [cidr4("10.0.0.1"), cidr4("10.0.0.0")]
+        >>> '10.1.2.3' in hosts, '10.1.2.0/24' in hosts
+        (True, False)
+        """
+        return self.subnets(self.BITS)
+
+    def subnets(self, sigbits):
+        """
+        Return a lazy sequence of the sub-networks with sigbits.
+
+        >>> from osso.core.cidr4 import cidr4
+        >>> subnets = cidr4('10.0.0.0/8').subnets(24)
+        >>> subnets
+        CidrRange(cidr4("10.0.0.0/24") .. cidr4("10.255.255.0/24"))
+        >>> len(subnets), subnets.index(cidr4('10.1.0.0/24'))
+        (65536, 256)
+        >>> subnets[10:16:2]
+        CidrRange(cidr4("10.0.10.0/24") .. cidr4("10.0.14.0/24"))
+        """
+        if sigbits < self.sigbits or sigbits > self.BITS:
+            raise ValueError('Cannot split a /%d into /%d networks.' % (
+                self.sigbits, sigbits))
+        # Not next(): that fails on the last network of the space.
+        return CidrRange(type(self), range(
+            self.address, self.address + (1 << (self.BITS - self.sigbits)),
+            1 << (self.BITS - sigbits)), sigbits)
+
+    def as_string(self, ip_as_net=True):
+        return '%s%s' % (
+            self._as_ip(self.address),
+            ('', '/%d' % self.sigbits)[
+                ip_as_net or self.sigbits != self.BITS])
+
+    def __hash__(self):
+        "You shouldn't mutate address/sigbits. If you do, this is wrong."
+        return hash((self.address, self.sigbits))
+
+    def __reduce__(self):
+        return (type(self), ((self.address, self.sigbits),))
+
+
+class CidrRange(Sequence):
+    """
+    A lazy sequence of networks of one size, like range(), which
+    creates the networks on access. See BaseCidr.hosts() and subnets().
+    Like range(), len() fails on more than sys.maxsize networks.
+    """
+    __slots__ = ('_cls', '_addresses', '_sigbits')
+
+    def __init__(self, cls, addresses, sigbits):
+        self._cls = cls
+        self._addresses = addresses
+        self._sigbits = sigbits
+
+    def __len__(self):
+        return len(self._addresses)
+
+    def __bool__(self):
+        return bool(self._addresses)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CidrRange(self._cls, self._addresses[index], self._sigbits)
+        return self._cls._from_valid(self._addresses[index], self._sigbits)
+
+    def __iter__(self):
+        from_valid, sigbits = self._cls._from_valid, self._sigbits
+        for address in self._addresses:
+            yield from_valid(address, sigbits)
+
+    def __reversed__(self):
+        from_valid, sigbits = self._cls._from_valid, self._sigbits
+        for address in reversed(self._addresses):
+            yield from_valid(address, sigbits)
+
+    def __contains__(self, value):
+        if not isinstance(value, self._cls):
+            try:
+                value = self._cls(value)
+            except (TypeError, ValueError):
+                return False
+        return (value.sigbits == self._sigbits and
+                value.address in self._addresses)
+
+    def index(self, value):
+        if value not in self:
+            raise ValueError('%r is not in range' % (value,))
+        return self._addresses.index(self._cls(value).address)
+
+    def count(self, value):
+        return int(value in self)
+
+    def __repr__(self):
+        if not self._addresses:
+            return 'CidrRange()'
+        return 'CidrRange(%r .. %r)' % (self[0], self[-1])
@@ -4,6 +4,9 @@
 # this check, because 0xffffffffL ('L') doesn't work anymore in
 # python3.
 from collections import namedtuple
+from functools import lru_cache
+
+from osso.core.cidr import BaseCidr
 
 if 0xffffffff == -1:
     raise NotImplementedError()
@@ -12,32 +15,54 @@ if 0xffffffff == -1:
 __all__ = ('cidr4',)
 
 
-class _ComparableMixin(object):
-    "Python3 does not do the __cmp__ method"
-    def __lt__(self, other):
-        return self.__cmp__(other) < 0
-
-    def __le__(self, other):
-        return self.__cmp__(other) <= 0
-
-    def __eq__(self, other):
-        return self.__cmp__(other) == 0
-
-    def __ge__(self, other):
-        return self.__cmp__(other) >= 0
+@lru_cache(maxsize=16384)
+def _parse_cidr4(value):
+    """
+    Parse a cidr4 string into an (address, sigbits) tuple. Raises
+    ValueError if it is not in CIDR4 notation.
+    """
+    value = value.strip()
+    if '/' not in value:
+        value += '/32'
+    host, sigbits = value.split('/', 2)
 
-    def __gt__(self, other):
-        return self.__cmp__(other) > 0
+    # 1.2.3.0/255.255.255.0 ?
+    if '.' in sigbits:
+        # may raise ValueError:
+        a, b, c, d = [int(byte) for byte in sigbits.split('.', 4)]
+        if (a < 0 or a > 255 or b < 0 or b > 255 or
+                c < 0 or c > 255 or d < 0 or d > 255):
+            raise ValueError('Invalid netmask.')
+
+        netmask = int(a) << 24 | int(b) << 16 | int(c) << 8 | int(d)
+        # http://gurmeetsingh.wordpress.com/2008/08/05/fast-bit-counting-routines/
+        tmp = (netmask -
+               ((netmask >> 1) & 0o33333333333) -
+               ((netmask >> 2) & 0o11111111111))
+        sigbits = ((tmp + (tmp >> 3)) & 0o30707070707) % 63
+
+        if netmask & ~(0xffffffff << (32 - sigbits)) != 0:
+            raise ValueError('Invalid netmask.')
+    # 1.2.3.0/24
+    else:
+        sigbits = int(sigbits)  # may raise ValueError
+        if sigbits < 0 or sigbits > 32:
+            raise ValueError('Not in CIDR4 notation.')
 
-    def __ne__(self, other):
-        return self.__cmp__(other) != 0
+    # may raise ValueError:
+    a, b, c, d = [int(byte) for byte in host.split('.', 4)]
+    if (a < 0 or a > 255 or b < 0 or b > 255 or
+            c < 0 or c > 255 or d < 0 or d > 255):
+        raise ValueError('Not in CIDR4 notation.')
+    address = a << 24 | b << 16 | c << 8 | d
+    netmask = (0xffffffff << (32 - sigbits)) & 0xffffffff
 
-    # Suppress py3 hash warning. Feel free to implement a hash method on
-    # your subclass though.
-    __hash__ = None
+    if (address & ~netmask) != 0:
+        raise ValueError('Found non-zero bit to the right of the netmask.')
+    return address, sigbits
 
 
-class cidr4(_ComparableMixin):
+class cidr4(BaseCidr):
     """
     An IPv4 CIDR block (or individual IP in the case of a /32 netmask).
 
@@ -79,6 +104,30 @@ class cidr4(_ComparableMixin):
     >>> try: cidr4(None)
     ... except TypeError: pass
     ... else: assert False
+    >>> try: cidr4((1 << 32, 32))
+    ... except ValueError: pass
+    ... else: assert False
+    >>> try: cidr4((-1, 32))
+    ... except ValueError: pass
+    ... else: assert False
+    >>> try: cidr4((0, 33))
+    ... except ValueError: pass
+    ... else: assert False
+
+    There is no network after the last one.
+
+    >>> cidr4('255.255.255.254').next()
+    cidr4("255.255.255.255")
+    >>> try: cidr4('255.255.255.255').next()
+    ... except ValueError: pass
+    ... else: assert False
+    >>> try: cidr4('0.0.0.0/0').next()
+    ... except ValueError: pass
+    ... else: assert False
+    >>> cidr4('255.255.255.0/24').as_from_to()
+    '[255.255.255.0 - 255.255.255.255]'
+    >>> cidr4('0.0.0.0/0').hosts()[-1]
+    cidr4("255.255.255.255")
 
     Test the new /255.255.255.0 notation.
 
@@ -122,7 +171,11 @@ class cidr4(_ComparableMixin):
     ... except TypeError: pass
     ... else: assert False
     """
-    __slots__ = ('address', 'sigbits')
+    __slots__ = ()
+
+    BITS = 32
+
+    _parse = staticmethod(_parse_cidr4)
 
     @classmethod
     def generate_cidr4_list_from_start_end(cls, start, end_ex):
@@ -134,134 +187,27 @@ class cidr4(_ComparableMixin):
         ...     cidr4('1.2.3.70').address,
         ...     cidr4('1.2.3.81').address))
         [cidr4("1.2.3.70/31"), cidr4("1.2.3.72/29"), cidr4("1.2.3.80")]
+        >>> list(cidr4.generate_cidr4_list_from_start_end(0, 1 << 32))
+        [cidr4("0.0.0.0/0")]
         """
-        assert start <= end_ex, (start, end_ex)
-        while start < end_ex:
-            freebits = 0
-            addr = start
-            while (addr & 1) == 0:
-                freebits += 1
-                addr >>= 1
-
-            maxaddr = ((start >> freebits) + 1) << freebits
-            if maxaddr <= end_ex:
-                c = cidr4((start, 32 - freebits))
-                start = maxaddr
-            else:
-                diff = end_ex - start
-                diffbits = 0
-                while diff > 0:
-                    diffbits += 1
-                    diff >>= 1
-                c = cidr4((start, 32 - diffbits + 1))
-                start = c.next().address
-
-            yield c
-
-    def __init__(self, value):
-        if (isinstance(value, tuple) and len(value) == 2 and
-                isinstance(value[0], int) and isinstance(value[1], int)):
-            netmask = (0xffffffff << (32 - value[1])) & 0xffffffff
-            if (value[0] & ~netmask) != 0:
-                raise ValueError(
-                    'Found non-zero bit to the right of the netmask.')
-            self.address, self.sigbits = value
-            return
-        if isinstance(value, cidr4):
-            self.address, self.sigbits = value.address, value.sigbits
-            return
-        if not isinstance(value, str):
-            raise TypeError('Cannot convert %r to a cidr4 type' % (value,))
-
-        value = str(value).strip()
-        if '/' not in value:
-            value += '/32'
-        host, sigbits = value.split('/', 2)
-
-        # 1.2.3.0/255.255.255.0 ?
-        if '.' in sigbits:
-            # may raise ValueError:
-            a, b, c, d = [int(byte) for byte in sigbits.split('.', 4)]
-            if (a < 0 or a > 255 or b < 0 or b > 255 or
-                    c < 0 or c > 255 or d < 0 or d > 255):
-                raise ValueError('Invalid netmask.')
-
-            netmask = int(a) << 24 | int(b) << 16 | int(c) << 8 | int(d)
-            # http://gurmeetsingh.wordpress.com/2008/08/05/fast-bit-counting-routines/
-            tmp = (netmask -
-                   ((netmask >> 1) & 0o33333333333) -
-                   ((netmask >> 2) & 0o11111111111))
-            sigbits = ((tmp + (tmp >> 3)) & 0o30707070707) % 63
-
-            if netmask & ~(0xffffffff << (32 - sigbits)) != 0:
-                raise ValueError('Invalid netmask.')
-        # 1.2.3.0/24
-        else:
-            sigbits = int(sigbits)  # may raise ValueError
-
-        # may raise ValueError:
-        a, b, c, d = [int(byte) for byte in host.split('.', 4)]
-        if (a < 0 or a > 255 or b < 0 or b > 255 or c < 0 or c > 255 or
-                d < 0 or d > 255 or sigbits < 0 or sigbits > 32):
-            raise ValueError('Not in CIDR4 notation.')
-        address = int(a) << 24 | int(b) << 16 | int(c) << 8 | int(d)
-        netmask = (0xffffffff << (32 - sigbits)) & 0xffffffff
-
-        if (address & ~netmask) != 0:
-            raise ValueError('Found non-zero bit to the right of the netmask.')
-
-        self.address = address
-        self.sigbits = sigbits
-
-    def __cmp__(self, other):
-        try:
-            other = cidr4(other)
-        except Exception:
-            return NotImplemented
-        try:
-            return (cmp(self.address, other.address) or
-                    cmp(self.sigbits, other.sigbits))
-        except NameError:  # no cmp() in python3
-            if self.address < other.address:
-                return -1
-            if self.address > other.address:
-                return 1
-            if self.sigbits < other.sigbits:
-                return -1
-            if self.sigbits > other.sigbits:
-                return 1
-            return 0
-
-    def __setattr__(self, key, value):
-        if key in self.__slots__ and not hasattr(self, key):
-            super(cidr4, self).__setattr__(key, value)
-        else:
-            raise TypeError('immutable')
-
-    def __repr__(self):
-        return 'cidr4("%s")' % self.__str__()
-
-    def __str__(self):
-        return self.as_string(ip_as_net=False)
+        return cls.generate_list_from_start_end(start, end_ex)
 
-    def __contains__(self, subset):
-        if not isinstance(subset, cidr4):
-            subset = cidr4(subset)
-
-        if self.sigbits > subset.sigbits:  # more bits is smaller
-            return False
-        netmask = (0xffffffff << (32 - self.sigbits)) & 0xffffffff
-        return (subset.address & netmask) == self.address
-
-    def next(self):
-        return cidr4((
-            self.address + (1 << (32 - self.sigbits)),
-            self.sigbits))
-
-    def truncated(self, sigbits):
-        return cidr4((
-            self.address & (0xffffffff << (32 - sigbits)),
-            sigbits))
+    @classmethod
+    def from_int(cls, address, sigbits=32):
+        """
+        Create a cidr4 from an integer address and netmask length,
+        without going through the string parser.
+
+        >>> cidr4.from_int(0x01020300, 24)
+        cidr4("1.2.3.0/24")
+        >>> try: cidr4.from_int(0x01020304, 24)
+        ... except ValueError: pass
+        ... else: assert False
+        >>> try: cidr4.from_int(1 << 32)
+        ... except ValueError: pass
+        ... else: assert False
+        """
+        return super(cidr4, cls).from_int(address, sigbits)
 
     def _as_ip(self, address):
         return '%d.%d.%d.%d' % (
@@ -270,21 +216,6 @@ class cidr4(_ComparableMixin):
             (address >> 8) & 0xff,
             (address) & 0xff)
 
-    def as_from_to(self):
-        first = self._as_ip(self.address)
-        if self.sigbits == 32:
-            return first
-        return '[%s - %s]' % (first, self._as_ip(self.next().address - 1))
-
-    def as_list(self):
-        return [
-            cidr4((i, 32)) for i in range(self.address, self.next().address)]
-
-    def as_string(self, ip_as_net=True):
-        return '%s%s' % (
-            self._as_ip(self.address),
-            ('', '/%d' % self.sigbits)[ip_as_net or self.sigbits != 32])
-
     def as_verbose_string(self, ip_as_net=True):
         if self.sigbits == 32 and not ip_as_net:
             return self.as_string(False)
@@ -292,18 +223,21 @@ class cidr4(_ComparableMixin):
         netmask = (0xffffffff << (32 - self.sigbits)) & 0xffffffff
         return '%s/%s' % (self._as_ip(self.address), self._as_ip(netmask))
 
-    def __hash__(self):
-        "You shouldn't mutate address/sigbits. If you do, this is wrong."
-        return hash((self.address, self.sigbits))
-
 
 cidr4_inuse = namedtuple('cidr4_inuse', 'cidr4 inuse')
 
 
-def convert_cidr4_list_to_contiguous_cidr4s(cidr4_inuse_list):
+def convert_cidr4_list_to_contiguous_cidr4s(cidr4_inuse_list, sigbits=24,
+                                            presorted=False):
     """
     Supply list of cidr4 IPs, get list of cidr_inuse blocks in return.
 
+    The output covers every supernet (of sigbits, default /24) that
+    contains an IP, and no block crosses a supernet boundary. The input
+    may hold networks of any size, which may overlap. If it is already
+    sorted, pass presorted=True to consume it (e.g. a generator) lazily:
+    the blocks are yielded as the input is read.
+
     >>> list(convert_cidr4_list_to_contiguous_cidr4s([
     ...     cidr4('1.2.3.10/32'),
     ...     cidr4('1.2.3.11/32'),
@@ -332,51 +266,88 @@ cidr4_inuse(cidr4=cidr4("1.2.3.24/29"), inuse=False), \
 cidr4_inuse(cidr4=cidr4("1.2.3.32/27"), inuse=False), \
 cidr4_inuse(cidr4=cidr4("1.2.3.64/26"), inuse=False), \
 cidr4_inuse(cidr4=cidr4("1.2.3.128/25"), inuse=False)]
+
+    Mixed network sizes in a /16 supernet, from a generator.
+
+    >>> used = (cidr4(i) for i in ('10.1.0.0/18', '10.1.64.0/24',
+    ...                            '10.1.64.128/25', '10.1.128.1'))
+    >>> for i in convert_cidr4_list_to_contiguous_cidr4s(
+    ...         used, sigbits=16, presorted=True):
+    ...     print(i.cidr4, i.inuse)
+    10.1.0.0/18 True
+    10.1.64.0/24 True
+    10.1.65.0/24 False
+    10.1.66.0/23 False
+    10.1.68.0/22 False
+    10.1.72.0/21 False
+    10.1.80.0/20 False
+    10.1.96.0/19 False
+    10.1.128.0 False
+    10.1.128.1 True
+    10.1.128.2/31 False
+    10.1.128.4/30 False
+    10.1.128.8/29 False
+    10.1.128.16/28 False
+    10.1.128.32/27 False
+    10.1.128.64/26 False
+    10.1.128.128/25 False
+    10.1.129.0/24 False
+    10.1.130.0/23 False
+    10.1.132.0/22 False
+    10.1.136.0/21 False
+    10.1.144.0/20 False
+    10.1.160.0/19 False
+    10.1.192.0/18 False
+
+    >>> list(convert_cidr4_list_to_contiguous_cidr4s(
+    ...     [cidr4('10.0.0.2'), cidr4('10.0.0.1')], presorted=True))
+    Traceback (most recent call last):
+    ...
+    ValueError: Input is not sorted: 10.0.0.1 after 10.0.0.2
     """
-    ips = list(sorted(cidr4_inuse_list))
-
-    # Group IPs per class_c
-    class_cs = []
-    class_c = None
-    ips_new = []
-    for ip in ips:
-        assert ip.sigbits == 32, ip
-        class_c_new = ip.address & 0xffffff00
-        if class_c_new != class_c:
-            if ips_new:
-                class_cs.append(ips_new)
-            ips_new = []
-            class_c = class_c_new
-        ips_new.append(ip)
-    if ips_new:
-        class_cs.append(ips_new)
-
-    # Loop over found class_cs, and yield inuse/not-inuse blocks.
-    for ips in class_cs:
-        first = ips[0].truncated(24)
-        last = None
-        for ip in ips:
-            if last is None:
-                for c in cidr4.generate_cidr4_list_from_start_end(
-                        first.address, ip.address):
-                    yield cidr4_inuse(c, False)
-                first = last = ip
-            elif ip.address == last.address + 1:
-                last = ip
+    if not presorted:
+        cidr4_inuse_list = sorted(cidr4_inuse_list)
+    supermask = (0xffffffff << (32 - sigbits)) & 0xffffffff
+    supersize = 1 << (32 - sigbits)
+
+    def blocks(start, end_ex, inuse):
+        # Split at the supernet boundaries.
+        while start < end_ex:
+            boundary = min((start & supermask) + supersize, end_ex)
+            for c in cidr4.generate_cidr4_list_from_start_end(
+                    start, boundary):
+                yield cidr4_inuse(c, inuse)
+            start = boundary
+
+    # The current run of used addresses, end exclusive.
+    prev = run_start = run_end = None
+    for ip in cidr4_inuse_list:
+        start = ip.address
+        end = start + (1 << (32 - ip.sigbits))
+        if run_end is not None:
+            if start < prev.address:
+                raise ValueError(
+                    'Input is not sorted: %s after %s' % (ip, prev))
+            if start <= run_end:
+                run_end = max(run_end, end)
+                prev = ip
+                continue
+            # A gap: yield the run, and the free space after it.
+            yield from blocks(run_start, run_end, True)
+            supernet_end = ((run_end - 1) & supermask) + supersize
+            if start < supernet_end:
+                yield from blocks(run_end, start, False)
             else:
-                for c in cidr4.generate_cidr4_list_from_start_end(
-                        first.address, last.address + 1):
-                    yield cidr4_inuse(c, True)
-                for c in cidr4.generate_cidr4_list_from_start_end(
-                        last.address + 1, ip.address):
-                    yield cidr4_inuse(c, False)
-                first = last = ip
-        for c in cidr4.generate_cidr4_list_from_start_end(
-                first.address, last.address + 1):
-            yield cidr4_inuse(c, True)
-        for c in cidr4.generate_cidr4_list_from_start_end(
-                last.address + 1, last.truncated(24).next().address):
-            yield cidr4_inuse(c, False)
+                yield from blocks(run_end, supernet_end, False)
+                yield from blocks(start & supermask, start, False)
+        else:
+            yield from blocks(start & supermask, start, False)
+        prev, run_start, run_end = ip, start, end
+
+    if run_end is not None:
+        yield from blocks(run_start, run_end, True)
+        yield from blocks(
+            run_end, ((run_end - 1) & supermask) + supersize, False)
 
 
 # Example:
@@ -385,7 +356,7 @@ cidr4_inuse(cidr4=cidr4("1.2.3.128/25"), inuse=False)]
 # ips = [cidr4(ip) for ip in buf.split()]
 # for ci in convert_cidr4_list_to_contiguous_cidr4s(ips):
 #     if sys.argv[1:2] == ['--verbose']:
-#         cs = ci.cidr4.as_list()
+#         cs = ci.cidr4.hosts()
 #     else:
 #         cs = [ci.cidr4]
 #     if ci.inuse:
@@ -0,0 +1,252 @@
+# vim: set ts=8 sw=4 sts=4 et ai:
+from array import array
+from bisect import bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from osso.core.cidr4 import cidr4
+
+
+__all__ = ('Cidr4Set',)
+
+
+def _normalize(starts, lasts):
+    """
+    Sort the (inclusive) ranges and merge the overlapping and adjacent
+    ones. Returns two arrays of starts and lasts.
+    """
+    if numpy is not None and len(starts) > 1:
+        starts = numpy.frombuffer(starts, dtype=numpy.uint32)
+        lasts = numpy.frombuffer(lasts, dtype=numpy.uint32)
+        order = numpy.argsort(starts, kind='stable')
+        starts, lasts = starts[order], lasts[order]
+        # The furthest address covered so far; a range that starts
+        # beyond it (and is not adjacent) begins a new merged range.
+        reach = numpy.maximum.accumulate(lasts).astype(numpy.int64)
+        first = numpy.flatnonzero(numpy.concatenate((
+            [True], starts[1:] > reach[:-1] + 1)))
+        ends = numpy.append(first[1:] - 1, len(starts) - 1)
+        return (array('I', starts[first].tolist()),
+                array('I', reach[ends].tolist()))
+
+    new_starts, new_lasts = array('I'), array('I')
+    for start, last in sorted(zip(starts, lasts)):
+        if new_lasts and start <= new_lasts[-1] + 1:
+            if last > new_lasts[-1]:
+                new_lasts[-1] = last
+        else:
+            new_starts.append(start)
+            new_lasts.append(last)
+    return new_starts, new_lasts
+
+
+def _as_range(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value, value
+    if not isinstance(value, cidr4):
+        value = cidr4(value)
+    return value.address, value.address + (1 << (32 - value.sigbits)) - 1
+
+
+class Cidr4Set(object):
+    """
+    A set of IPv4 addresses, stored as sorted arrays of the first and
+    last address of every contiguous range. A million networks take
+    a few MB, and the set operations are a linear sweep over the
+    arrays. NumPy is used to build the set and for contains_each() if
+    it is installed.
+
+    >>> s = Cidr4Set(['10.0.0.0/24', '10.0.1.0/24', '10.0.0.128/25',
+    ...               '192.168.1.1'])
+    >>> s
+    Cidr4Set(['10.0.0.0/23', '192.168.1.1'])
+    >>> '10.0.1.2' in s, cidr4('10.0.0.0/16') in s, 0x0a000005 in s
+    (True, False, True)
+    >>> list(s.ranges())
+    [(167772160, 167772671), (3232235777, 3232235777)]
+    >>> s.num_addresses
+    513
+
+    Iterating yields the fewest cidr4 blocks covering the set.
+
+    >>> list(Cidr4Set(['1.2.3.3', '1.2.3.4/30', '1.2.3.8']))
+    [cidr4("1.2.3.3"), cidr4("1.2.3.4/30"), cidr4("1.2.3.8")]
+    >>> list(Cidr4Set(['0.0.0.0/0']))
+    [cidr4("0.0.0.0/0")]
+
+    Set operations take any iterable of cidr4 values.
+
+    >>> a = Cidr4Set(['10.0.0.0/8'])
+    >>> a - ['10.1.0.0/16', '10.128.0.0/9']
+    Cidr4Set(['10.0.0.0/16', '10.2.0.0/15', '10.4.0.0/14', '10.8.0.0/13', \
+'10.16.0.0/12', '10.32.0.0/11', '10.64.0.0/10'])
+    >>> a & Cidr4Set(['10.1.2.0/24', '11.0.0.0/8', '8.0.0.0/7'])
+    Cidr4Set(['10.1.2.0/24'])
+    >>> a | ['11.0.0.0/8', '12.0.0.0/8']
+    Cidr4Set(['10.0.0.0/7', '12.0.0.0/8'])
+    >>> a ^ ['10.0.0.0/9', '11.0.0.0/8']
+    Cidr4Set(['10.128.0.0/9', '11.0.0.0/8'])
+    >>> a - a == Cidr4Set(), bool(a - a), a.issuperset(['10.9.8.7'])
+    (True, False, True)
+    """
+    __slots__ = ('_starts', '_lasts')
+
+    def __init__(self, iterable=()):
+        starts, lasts = array('I'), array('I')
+        for value in iterable:
+            start, last = _as_range(value)
+            starts.append(start)
+            lasts.append(last)
+        self._starts, self._lasts = _normalize(starts, lasts)
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """
+        Create a set from (first, last) address pairs, both inclusive.
+
+        >>> Cidr4Set.from_ranges([(0, 255), (256, 256), (1024, 2047)])
+        Cidr4Set(['0.0.0.0/24', '0.0.1.0', '0.0.4.0/22'])
+        """
+        starts, lasts = array('I'), array('I')
+        for first, last in ranges:
+            if first > last:
+                raise ValueError('Range %r to %r is empty.' % (first, last))
+            starts.append(first)
+            lasts.append(last)
+        return cls._from_arrays(*_normalize(starts, lasts))
+
+    @classmethod
+    def _from_arrays(cls, starts, lasts):
+        ret = cls.__new__(cls)
+        ret._starts, ret._lasts = starts, lasts
+        return ret
+
+    @classmethod
+    def _coerce(cls, other):
+        if isinstance(other, Cidr4Set):
+            return other
+        return cls(other)
+
+    def ranges(self):
+        """
+        Yield the (first, last) addresses of the ranges, both inclusive.
+        """
+        return zip(self._starts, self._lasts)
+
+    @property
+    def num_addresses(self):
+        return sum(self._lasts) - sum(self._starts) + len(self._starts)
+
+    def __iter__(self):
+        for start, last in zip(self._starts, self._lasts):
+            yield from cidr4.generate_list_from_start_end(start, last + 1)
+
+    def __contains__(self, value):
+        first, last = _as_range(value)
+        index = bisect_right(self._starts, first) - 1
+        return index >= 0 and last <= self._lasts[index]
+
+    def contains_each(self, addresses):
+        """
+        Return a list of booleans that tell whether every (integer)
+        address is in the set.
+
+        >>> Cidr4Set(['0.0.0.4/30']).contains_each([3, 4, 7, 8])
+        [False, True, True, False]
+        """
+        if numpy is not None and self:
+            addresses = numpy.asarray(addresses, dtype=numpy.int64)
+            starts = numpy.frombuffer(self._starts, dtype=numpy.uint32)
+            lasts = numpy.frombuffer(self._lasts, dtype=numpy.uint32)
+            index = numpy.searchsorted(starts, addresses, side='right') - 1
+            found = (index >= 0) & (
+                addresses <= lasts.take(numpy.maximum(index, 0), mode='clip'))
+            return found.tolist()
+        return [address in self for address in addresses]
+
+    def __bool__(self):
+        return len(self._starts) != 0
+
+    def __eq__(self, other):
+        if not isinstance(other, Cidr4Set):
+            return NotImplemented
+        return self._starts == other._starts and self._lasts == other._lasts
+
+    def __ne__(self, other):
+        if not isinstance(other, Cidr4Set):
+            return NotImplemented
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Cidr4Set(%r)' % ([str(i) for i in self],)
+
+    def union(self, other):
+        other = self._coerce(other)
+        return self._from_arrays(*_normalize(
+            self._starts + other._starts, self._lasts + other._lasts))
+
+    def intersection(self, other):
+        other = self._coerce(other)
+        a_starts, a_lasts = self._starts, self._lasts
+        b_starts, b_lasts = other._starts, other._lasts
+        starts, lasts = array('I'), array('I')
+        i = j = 0
+        while i < len(a_starts) and j < len(b_starts):
+            start = max(a_starts[i], b_starts[j])
+            last = min(a_lasts[i], b_lasts[j])
+            if start <= last:
+                starts.append(start)
+                lasts.append(last)
+            if a_lasts[i] < b_lasts[j]:
+                i += 1
+            else:
+                j += 1
+        return self._from_arrays(starts, lasts)
+
+    def difference(self, other):
+        other = self._coerce(other)
+        b_starts, b_lasts = other._starts, other._lasts
+        starts, lasts = array('I'), array('I')
+        j = 0
+        for start, last in zip(self._starts, self._lasts):
+            # Skip the ranges that end before this one.
+            while j < len(b_starts) and b_lasts[j] < start:
+                j += 1
+            k = j
+            while k < len(b_starts) and b_starts[k] <= last:
+                if b_starts[k] > start:
+                    starts.append(start)
+                    lasts.append(b_starts[k] - 1)
+                start = b_lasts[k] + 1
+                if start > last:
+                    break
+                k += 1
+            if start <= last:
+                starts.append(start)
+                lasts.append(last)
+        return self._from_arrays(starts, lasts)
+
+    def symmetric_difference(self, other):
+        other = self._coerce(other)
+        return self.union(other).difference(self.intersection(other))
+
+    def issubset(self, other):
+        return not self.difference(other)
+
+    def issuperset(self, other):
+        return not self._coerce(other).difference(self)
+
+    __or__ = __ror__ = union
+    __and__ = __rand__ = intersection
+    __sub__ = difference
+    __xor__ = __rxor__ = symmetric_difference
+    __le__ = issubset
+    __ge__ = issuperset
+
+    def __rsub__(self, other):
+        return self._coerce(other).difference(self)
@@ -0,0 +1,133 @@
+# vim: set ts=8 sw=4 sts=4 et ai:
+from collections import namedtuple
+from collections.abc import MutableMapping
+
+from osso.core.cidr4 import cidr4
+
+
+__all__ = ('Cidr4Table', 'cidr4_match')
+
+
+cidr4_match = namedtuple('cidr4_match', 'cidr4 payload')
+
+
+class Cidr4Table(MutableMapping):
+    """
+    A mapping of cidr4 networks to payloads, with a longest prefix
+    match lookup.
+
+    The networks are kept in a dictionary per prefix length. A lookup
+    masks the address for every prefix length in use, longest first,
+    and probes that dictionary: at most 33 dictionary lookups, no
+    matter how many networks there are.
+
+    >>> table = Cidr4Table({
+    ...     '10.0.0.0/8': 'internal',
+    ...     '10.1.0.0/16': 'office',
+    ...     '10.1.2.3': 'printer',
+    ... })
+    >>> table.lookup('10.1.2.3')
+    cidr4_match(cidr4=cidr4("10.1.2.3"), payload='printer')
+    >>> table.lookup('10.1.2.4')
+    cidr4_match(cidr4=cidr4("10.1.0.0/16"), payload='office')
+    >>> table.lookup(cidr4('10.2.0.0/16')).payload
+    'internal'
+    >>> table.lookup(0x0a010203).payload  # 10.1.2.3
+    'printer'
+    >>> table.lookup('192.168.1.1') is None
+    True
+
+    Networks are only matched by the networks that contain them.
+
+    >>> table.lookup('10.0.0.0/7') is None
+    True
+    >>> table['0.0.0.0/0'] = 'default'
+    >>> table.lookup('10.0.0.0/7').payload
+    'default'
+
+    It is a mapping too, of the exact networks.
+
+    >>> table['10.1.0.0/16'], len(table), '10.1.2.3/32' in table
+    ('office', 4, True)
+    >>> del table['10.1.0.0/16']
+    >>> table.lookup('10.1.2.4').payload
+    'internal'
+    >>> sorted(table.items())
+    [(cidr4("0.0.0.0/0"), 'default'), (cidr4("10.0.0.0/8"), 'internal'), \
+(cidr4("10.1.2.3"), 'printer')]
+    """
+    def __init__(self, items=()):
+        self._networks = {}  # sigbits => {address: cidr4_match}
+        self._levels = []  # (sigbits, netmask, networks), longest first
+        if hasattr(items, 'items'):
+            items = items.items()
+        for network, payload in items:
+            self[network] = payload
+
+    def _update_levels(self):
+        self._levels = [
+            (sigbits, (0xffffffff << (32 - sigbits)) & 0xffffffff,
+             self._networks[sigbits])
+            for sigbits in sorted(self._networks, reverse=True)]
+
+    def lookup(self, value, default=None):
+        """
+        Return the cidr4_match of the most specific network that
+        contains value (an int, cidr4 or string), or default.
+        """
+        if isinstance(value, int):
+            address, max_sigbits = value, 32
+        else:
+            if not isinstance(value, cidr4):
+                value = cidr4(value)
+            address, max_sigbits = value.address, value.sigbits
+        for sigbits, netmask, networks in self._levels:
+            if sigbits <= max_sigbits:
+                try:
+                    return networks[address & netmask]
+                except KeyError:
+                    pass
+        return default
+
+    def __setitem__(self, network, payload):
+        if not isinstance(network, cidr4):
+            network = cidr4(network)
+        if network.sigbits not in self._networks:
+            self._networks[network.sigbits] = {}
+            self._update_levels()
+        self._networks[network.sigbits][network.address] = cidr4_match(
+            network, payload)
+
+    def __getitem__(self, network):
+        if not isinstance(network, cidr4):
+            network = cidr4(network)
+        try:
+            return self._networks[network.sigbits][network.address].payload
+        except KeyError:
+            raise KeyError(network)
+
+    def __delitem__(self, network):
+        if not isinstance(network, cidr4):
+            network = cidr4(network)
+        try:
+            del self._networks[network.sigbits][network.address]
+        except KeyError:
+            raise KeyError(network)
+        if not self._networks[network.sigbits]:
+            del self._networks[network.sigbits]
+            self._update_levels()
+
+    def __contains__(self, network):
+        try:
+            self[network]
+        except (KeyError, TypeError, ValueError):
+            return False
+        return True
+
+    def __len__(self):
+        return sum(len(networks) for networks in self._networks.values())
+
+    def __iter__(self):
+        for networks in self._networks.values():
+            for match in networks.values():
+                yield match.cidr4
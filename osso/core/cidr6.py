@@ -0,0 +1,110 @@
+# vim: set ts=8 sw=4 sts=4 et ai:
+from functools import lru_cache
+from socket import AF_INET6, inet_ntop, inet_pton
+
+from osso.core.cidr import BaseCidr
+
+
+__all__ = ('cidr6',)
+
+
+@lru_cache(maxsize=16384)
+def _parse_cidr6(value):
+    """
+    Parse a cidr6 string into an (address, sigbits) tuple. Raises
+    ValueError if it is not in CIDR6 notation.
+    """
+    host, slash, sigbits = value.strip().partition('/')
+    if slash:
+        sigbits = int(sigbits)  # may raise ValueError
+        if sigbits < 0 or sigbits > 128:
+            raise ValueError('Not in CIDR6 notation.')
+    else:
+        sigbits = 128
+
+    try:
+        address = int.from_bytes(inet_pton(AF_INET6, host), 'big')
+    except OSError:
+        raise ValueError('Not in CIDR6 notation.')
+
+    if address & ((1 << (128 - sigbits)) - 1):
+        raise ValueError('Found non-zero bit to the right of the netmask.')
+    return address, sigbits
+
+
+class cidr6(BaseCidr):
+    """
+    An IPv6 CIDR block (or individual IP in the case of a /128 netmask).
+    It works like cidr4, on 128-bit addresses.
+
+    >>> cidr6('2001:DB8:0:0::1')
+    cidr6("2001:db8::1")
+    >>> cidr6('2001:db8::/32').as_string()
+    '2001:db8::/32'
+    >>> cidr6('2001:db8::1').as_string()
+    '2001:db8::1/128'
+    >>> cidr6('2001:db8::/126').as_from_to()
+    '[2001:db8:: - 2001:db8::3]'
+    >>> cidr6.from_int(0x20010db8 << 96, 32)
+    cidr6("2001:db8::/32")
+
+    Test comparisons and the in operator.
+
+    >>> a, b = cidr6('2001:db8::/32'), cidr6('2001:db8::/48')
+    >>> a < b and b > a and a != b and a == '2001:db8::/32'
+    True
+    >>> b in a, a in b, '2001:db8:1::1' in a, '2001:db9::1' in a
+    (True, False, True, False)
+    >>> from osso.core.cidr4 import cidr4
+    >>> a == cidr4('0.0.0.0/0'), a == '0.0.0.0/0'
+    (False, False)
+
+    Test initialization.
+
+    >>> try: cidr6('2001:db8::1/64')
+    ... except ValueError: pass
+    ... else: assert False
+    >>> try: cidr6('1.2.3.4')
+    ... except ValueError: pass
+    ... else: assert False
+    >>> try: cidr6('::/129')
+    ... except ValueError: pass
+    ... else: assert False
+    >>> try: cidr6((1 << 128, 128))
+    ... except ValueError: pass
+    ... else: assert False
+    >>> try: cidr6('ffff:ffff:ffff:ffff::/64').next()
+    ... except ValueError: pass
+    ... else: assert False
+
+    Test the block arithmetic.
+
+    >>> cidr6('2001:db8::1:2').truncated(64)
+    cidr6("2001:db8::/64")
+    >>> cidr6('2001:db8::/64').next()
+    cidr6("2001:db8:0:1::/64")
+    >>> list(cidr6.generate_cidr6_list_from_start_end(
+    ...     cidr6('2001:db8::3').address, cidr6('2001:db8::9').address))
+    [cidr6("2001:db8::3"), cidr6("2001:db8::4/126"), cidr6("2001:db8::8")]
+    >>> list(cidr6.generate_cidr6_list_from_start_end(0, 1 << 128))
+    [cidr6("::/0")]
+    >>> cidr6('2001:db8::/64').hosts()[-1]
+    cidr6("2001:db8::ffff:ffff:ffff:ffff")
+    """
+    __slots__ = ()
+
+    BITS = 128
+
+    _parse = staticmethod(_parse_cidr6)
+
+    @classmethod
+    def generate_cidr6_list_from_start_end(cls, start, end_ex):
+        return cls.generate_list_from_start_end(start, end_ex)
+
+    def _as_ip(self, address):
+        return inet_ntop(AF_INET6, address.to_bytes(16, 'big'))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
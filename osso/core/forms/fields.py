@@ -8,6 +8,7 @@ from django.utils.translation import gettext_lazy as _
 from osso.core.forms.widgets import (
     new_widget_with_attributes, EditableSelectWidget)
 from osso.core.cidr4 import cidr4
+from osso.core.cidr6 import cidr6
 
 
 safecharfield_re = re.compile(r'[\x00-\x08\x0a-\x1f]')
@@ -42,6 +43,26 @@ class Cidr4Field(forms.CharField):
         return value
 
 
+class Cidr6Field(forms.CharField):
+    default_error_messages = {
+        'invalid': _('An IPv6 address in CIDR notation must be a:b::c/d.'),
+    }
+
+    def __init__(self, *args, **kwargs):
+        kwargs['max_length'] = 64  # max is 43, but allow some blanks
+        super(Cidr6Field, self).__init__(*args, **kwargs)
+
+    def clean(self, value):
+        value = super(Cidr6Field, self).clean(value)
+        if value in self.empty_values and not self.required:
+            return None
+        try:
+            value = cidr6(value)
+        except ValueError:
+            raise forms.ValidationError(self.default_error_messages['invalid'])
+        return value
+
+
 class EditableSelectIterator(ModelChoiceIterator):
     def choice(self, obj):
         value = getattr(obj, self.field.to_field_name)
@@ -1,14 +1,20 @@
 # vim: set ts=8 sw=4 sts=4 et ai:
 import warnings
 
+from django.core.exceptions import EmptyResultSet
 from django.db import connection, models
+from django.db.models import lookups
+from django.db.models.expressions import Col
+from django.db.models.sql.compiler import SQLUpdateCompiler
 from osso.core.forms import fields
 from osso.core.cidr4 import cidr4
+from osso.core.cidr6 import cidr6
 
 
 __all__ = [
-    'Cidr4Field', 'Creator', 'DecimalField', 'EditableSelectField',
-    'FormatterBaseField', 'FormatterCharField', 'FormatterTextField',
+    'Cidr4Field', 'Cidr4LastField', 'Cidr6Field', 'Creator', 'DecimalField',
+    'EditableSelectField', 'FormatterBaseField', 'FormatterCharField',
+    'FormatterTextField',
     'NonReversibleForeignKey', 'NonReversibleManyToManyField',
     'NonReversibleOneToOneField', 'ParentField', 'PhoneNumberField',
     'SafeCharField',
@@ -26,7 +32,12 @@ class Creator(object):
     def __get__(self, obj, type=None):
         if obj is None:
             return self
-        return obj.__dict__[self.field.name]
+        try:
+            return obj.__dict__[self.field.name]
+        except KeyError:
+            # A deferred field: load it, like Django's DeferredAttribute.
+            obj.refresh_from_db(fields=[self.field.attname])
+            return obj.__dict__[self.field.name]
 
     def __set__(self, obj, value):
         obj.__dict__[self.field.name] = self.field.to_python(value)
@@ -45,18 +56,131 @@ class SafeCharField(models.CharField):
         return super(SafeCharField, self).formfield(**defaults)
 
 
+def _cidr4_as_string(value):
+    # Ugly storage method to get proper sorting.
+    return '%03d.%03d.%03d.%03d/%02d' % (
+        (value.address >> 24) & 0xff,
+        (value.address >> 16) & 0xff,
+        (value.address >> 8) & 0xff,
+        (value.address) & 0xff,
+        value.sigbits
+    )
+
+
+def _cidr4_last(value):
+    return value.address + (1 << (32 - value.sigbits)) - 1
+
+
+# The netmask length from the last minus the first address, or 63 if
+# the columns do not form a network.
+_CIDR4_SIGBITS_SQL = 'CASE %%s - %%s %s ELSE 63 END' % (' '.join(
+    'WHEN %d THEN %d' % ((1 << (32 - sigbits)) - 1, sigbits)
+    for sigbits in range(32, -1, -1)),)
+
+
+class Cidr4Col(Col):
+    """
+    The column of a Cidr4Field(storage='integer') in SELECT and ORDER
+    BY: the first address times 64 plus the netmask length, computed
+    from both columns, so values() and order_by() see the whole
+    network. The lookups compare the columns themselves, and in UPDATE
+    it is the first address column, so F() writes what it reads.
+    """
+    def as_sql(self, compiler, connection):
+        address_sql, params = super(Cidr4Col, self).as_sql(
+            compiler, connection)
+        if isinstance(compiler, SQLUpdateCompiler):
+            return address_sql, params
+        last_sql, last_params = compiler.compile(Col(
+            self.alias, self.target.model._meta.get_field(
+                self.target.last_field_name)))
+        return '(%s * 64 + %s)' % (address_sql, _CIDR4_SIGBITS_SQL % (
+            last_sql, address_sql)), params + last_params + params
+
+
+class Cidr4Creator(Creator):
+    """
+    The Creator for Cidr4Field(storage='integer'): it also sets the
+    last address, so bulk_update() can write it.
+    """
+    def __set__(self, obj, value):
+        super(Cidr4Creator, self).__set__(obj, value)
+        value = obj.__dict__[self.field.name]
+        obj.__dict__[self.field.last_field_name] = (
+            None if value is None else _cidr4_last(value))
+
+
 class Cidr4Field(models.Field):
     '''
     An IPv4 address with netmask field.
+
+    The storage argument selects how it is stored:
+
+    - 'string' (default): a zero-padded string, e.g. 010.000.000.000/08,
+      to get proper sorting.
+    - 'integer': the first address in this column, and the last address
+      in a companion column <name>_last, which is set on save and by
+      QuerySet.update(). Updates with an expression, like
+      bulk_update(), must set <name>_last too. Add an index on both
+      columns: the lookups compare them. order_by() sorts on a value
+      computed from both, see Cidr4Col, which the index cannot serve;
+      order_by('<name>', '-<name>_last') can.
+    - 'inet': the native cidr type on PostgreSQL; a string elsewhere.
+
+    All storage modes support the contains_ip, within and overlaps
+    lookups, which compile to index-friendly predicates:
+
+        Allocation.objects.filter(network__contains_ip='10.1.2.3')
+        Allocation.objects.filter(network__within='10.0.0.0/8')
+        Allocation.objects.filter(network__overlaps='10.1.0.0/16')
     '''
-    def __init__(self, **kwargs):
+    STORAGES = ('string', 'integer', 'inet')
+
+    def __init__(self, storage='string', **kwargs):
         assert 'max_length' not in kwargs
+        if storage not in self.STORAGES:
+            raise ValueError('storage must be one of %r' % (self.STORAGES,))
+        self.storage = storage
         kwargs['max_length'] = 18
         super(Cidr4Field, self).__init__(**kwargs)
 
+    def deconstruct(self):
+        name, path, args, kwargs = super(Cidr4Field, self).deconstruct()
+        del kwargs['max_length']
+        if self.storage != 'string':
+            kwargs['storage'] = self.storage
+        return name, path, args, kwargs
+
+    def get_storage(self, connection):
+        if self.storage == 'inet' and connection.vendor != 'postgresql':
+            return 'string'
+        return self.storage
+
     def get_internal_type(self):
+        if self.storage == 'integer':
+            return "BigIntegerField"
         return "CharField"
 
+    def get_col(self, alias, output_field=None):
+        if self.storage == 'integer':
+            return Cidr4Col(alias, self, output_field)
+        return super(Cidr4Field, self).get_col(alias, output_field)
+
+    def get_integer_columns(self, compiler, alias):
+        '''
+        Return the SQL of the first and the last address columns of a
+        Cidr4Field(storage='integer').
+        '''
+        address_sql, params = compiler.compile(Col(alias, self))
+        last_sql, last_params = compiler.compile(Col(
+            alias, self.model._meta.get_field(self.last_field_name)))
+        return address_sql, list(params), last_sql, list(last_params)
+
+    def db_type(self, connection):
+        if self.get_storage(connection) == 'inet':
+            return 'cidr'
+        return super(Cidr4Field, self).db_type(connection)
+
     def to_python(self, value):
         # to_python will be called at ModelForm instantiation with ''
         # as initial value, hence we must accept it as valid value
@@ -67,17 +191,41 @@ class Cidr4Field(models.Field):
     def get_prep_value(self, value):
         if value is None:
             return None
-        value = cidr4(value)
-        # Ugly storage method to get proper sorting
-        # (A CIDR DB field (postgres has it) or two integer fields
-        # would be better.)
-        return '%03d.%03d.%03d.%03d/%02d' % (
-            (value.address >> 24) & 0xff,
-            (value.address >> 16) & 0xff,
-            (value.address >> 8) & 0xff,
-            (value.address) & 0xff,
-            value.sigbits
-        )
+        return _cidr4_as_string(cidr4(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        storage = self.get_storage(connection)
+        if storage == 'integer':
+            return cidr4(value).address
+        if storage == 'inet':
+            return cidr4(value).as_string()
+        return value
+
+    def get_placeholder(self, value, compiler, connection):
+        # QuerySet.update() does not call pre_save(): set the last
+        # address along with the first.
+        if (self.storage != 'integer' or
+                not isinstance(compiler, SQLUpdateCompiler)):
+            return '%s'
+        updates = {field: value for field, model, value in (
+            compiler.query.values)}
+        last_field = self.model._meta.get_field(self.last_field_name)
+        if last_field in updates:
+            return '%s'
+        value = updates[self]
+        if value is None:  # the placeholder is not used
+            return '%s'
+        if hasattr(value, 'resolve_expression'):
+            raise ValueError(
+                'Updating %s with an expression needs %s too' % (
+                    self.name, self.last_field_name))
+        return '%%s, %s = %d' % (
+            compiler.quote_name_unless_alias(last_field.column),
+            _cidr4_last(cidr4(value)))
 
     def formfield(self, **kwargs):
         defaults = {
@@ -87,10 +235,292 @@ class Cidr4Field(models.Field):
         return super(Cidr4Field, self).formfield(**defaults)
 
     def from_db_value(self, value, expression, connection, context=None):
+        if isinstance(value, int):  # storage='integer', see Cidr4Col
+            try:
+                return cidr4.from_int(value >> 6, value & 63)
+            except ValueError:
+                raise ValueError(
+                    'The %s and %s columns of %s do not form a network' % (
+                        self.column, self.last_field_name,
+                        self.model._meta.db_table))
+        if value is not None and not isinstance(value, str):
+            value = str(value)  # psycopg returns an ipaddress network
         return self.to_python(value)
 
     def contribute_to_class(self, cls, name, **kwargs):
         super(Cidr4Field, self).contribute_to_class(cls, name, **kwargs)
+        if self.storage == 'integer':
+            self.last_field_name = '%s_last' % (self.name,)
+            if not cls._meta.abstract:
+                Cidr4LastField(null=self.null).contribute_to_class(
+                    cls, self.last_field_name)
+            setattr(cls, self.name, Cidr4Creator(self))
+        else:
+            setattr(cls, self.name, Creator(self))
+
+
+class Cidr4LastField(models.BigIntegerField):
+    '''
+    The last address of a Cidr4Field(storage='integer'), added by that
+    field as <name>_last.
+    '''
+    def __init__(self, *args, **kwargs):
+        kwargs['editable'] = False
+        super(Cidr4LastField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(Cidr4LastField, self).deconstruct()
+        del kwargs['editable']
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        # The Cidr4Field adds us, but migrations add us again.
+        if any(field.name == name for field in cls._meta.local_fields):
+            return
+        super(Cidr4LastField, self).contribute_to_class(cls, name, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.name[:-len('_last')])
+        last = None if value is None else _cidr4_last(value)
+        setattr(model_instance, self.attname, last)
+        return last
+
+
+class Cidr4Lookup(models.Lookup):
+    '''
+    Base class of the Cidr4Field lookups, with an as_<storage>_sql()
+    method per storage mode.
+    '''
+    prepare_rhs = False
+
+    def get_prep_lookup(self):
+        if hasattr(self.rhs, 'resolve_expression'):
+            raise ValueError('The %s lookup needs a cidr4 value' % (
+                self.lookup_name,))
+        return cidr4(self.rhs)
+
+    def as_sql(self, compiler, connection):
+        field = self.lhs.output_field
+        storage = field.get_storage(connection)
+        if storage == 'integer':
+            return self.as_integer_sql(
+                *field.get_integer_columns(compiler, self.lhs.alias))
+        lhs_sql, params = compiler.compile(self.lhs)
+        return getattr(self, 'as_%s_sql' % (storage,))(lhs_sql, list(params))
+
+    def _strings_in(self, lhs_sql, params, networks):
+        networks = [_cidr4_as_string(i) for i in networks]
+        if not networks:
+            return '1 = 0', params
+        return '%s IN (%s)' % (lhs_sql, ', '.join(['%s'] * len(networks))), (
+            params + networks)
+
+
+class Cidr4ColumnsMixin(object):
+    '''
+    Compare the first and the last address columns of a
+    Cidr4Field(storage='integer') with the networks, so the index on
+    them is used; the first address alone is not enough: 10.0.0.0/8 and
+    /16 share it. Other storage modes and expressions use the default
+    lookup.
+    '''
+    def as_sql(self, compiler, connection):
+        field = self.lhs.output_field
+        if (field.get_storage(connection) != 'integer' or
+                not self.rhs_is_direct_value()):
+            return super(Cidr4ColumnsMixin, self).as_sql(compiler, connection)
+        return self.as_integer_sql(
+            *field.get_integer_columns(compiler, self.lhs.alias))
+
+    def _compare(self, lhs_sql, params, last_sql, last_params, network,
+                 operators):
+        # Networks sort on the first address, and then on the last,
+        # reversed: 10.0.0.0/8 sorts before 10.0.0.0/16. The first
+        # condition is the one that an index can serve.
+        first, strict, last = operators
+        return '(%s %s %%s AND (%s %s %%s OR %s %s %%s))' % (
+            lhs_sql, first, lhs_sql, strict, last_sql, last), (
+            params + [network.address] + params + [network.address] +
+            last_params + [_cidr4_last(network)])
+
+
+@Cidr4Field.register_lookup
+class Cidr4Exact(Cidr4ColumnsMixin, lookups.Exact):
+    def as_integer_sql(self, lhs_sql, params, last_sql, last_params):
+        network = cidr4(self.rhs)
+        return '(%s = %%s AND %s = %%s)' % (lhs_sql, last_sql), (
+            params + [network.address] + last_params +
+            [_cidr4_last(network)])
+
+
+@Cidr4Field.register_lookup
+class Cidr4In(Cidr4ColumnsMixin, lookups.In):
+    def as_integer_sql(self, lhs_sql, params, last_sql, last_params):
+        networks = sorted(set(cidr4(i) for i in self.rhs if i is not None))
+        if not networks:
+            raise EmptyResultSet
+        sql = '(%s = %%s AND %s = %%s)' % (lhs_sql, last_sql)
+        return '(%s)' % (' OR '.join([sql] * len(networks)),), [
+            param for network in networks
+            for param in (params + [network.address] + last_params +
+                          [_cidr4_last(network)])]
+
+
+@Cidr4Field.register_lookup
+class Cidr4GreaterThan(Cidr4ColumnsMixin, lookups.GreaterThan):
+    def as_integer_sql(self, *columns):
+        return self._compare(*columns, cidr4(self.rhs), ('>=', '>', '<'))
+
+
+@Cidr4Field.register_lookup
+class Cidr4GreaterThanOrEqual(Cidr4ColumnsMixin, lookups.GreaterThanOrEqual):
+    def as_integer_sql(self, *columns):
+        return self._compare(*columns, cidr4(self.rhs), ('>=', '>', '<='))
+
+
+@Cidr4Field.register_lookup
+class Cidr4LessThan(Cidr4ColumnsMixin, lookups.LessThan):
+    def as_integer_sql(self, *columns):
+        return self._compare(*columns, cidr4(self.rhs), ('<=', '<', '>'))
+
+
+@Cidr4Field.register_lookup
+class Cidr4LessThanOrEqual(Cidr4ColumnsMixin, lookups.LessThanOrEqual):
+    def as_integer_sql(self, *columns):
+        return self._compare(*columns, cidr4(self.rhs), ('<=', '<', '>='))
+
+
+@Cidr4Field.register_lookup
+class Cidr4Range(Cidr4ColumnsMixin, lookups.Range):
+    def as_integer_sql(self, *columns):
+        start_sql, start_params = self._compare(
+            *columns, cidr4(self.rhs[0]), ('>=', '>', '<='))
+        end_sql, end_params = self._compare(
+            *columns, cidr4(self.rhs[1]), ('<=', '<', '>='))
+        return '(%s AND %s)' % (start_sql, end_sql), start_params + end_params
+
+
+@Cidr4Field.register_lookup
+class Cidr4ContainsIp(Cidr4Lookup):
+    '''
+    The networks that contain the address (or network).
+    '''
+    lookup_name = 'contains_ip'
+
+    def as_string_sql(self, lhs_sql, params):
+        # Only 33 networks can contain an address: look them all up.
+        return self._strings_in(lhs_sql, params, [
+            self.rhs.truncated(sigbits)
+            for sigbits in range(self.rhs.sigbits + 1)])
+
+    def as_integer_sql(self, lhs_sql, lhs_params, last_sql, last_params):
+        return '(%s <= %%s AND %s >= %%s)' % (lhs_sql, last_sql), (
+            lhs_params + [self.rhs.address] +
+            last_params + [_cidr4_last(self.rhs)])
+
+    def as_inet_sql(self, lhs_sql, params):
+        return '%s >>= %%s::cidr' % (lhs_sql,), params + [
+            self.rhs.as_string()]
+
+
+@Cidr4Field.register_lookup
+class Cidr4Within(Cidr4Lookup):
+    '''
+    The networks inside the network (including itself).
+    '''
+    lookup_name = 'within'
+
+    def as_string_sql(self, lhs_sql, params):
+        return '(%s >= %%s AND %s <= %%s)' % (lhs_sql, lhs_sql), (
+            params + [_cidr4_as_string(self.rhs)] + params +
+            [_cidr4_as_string(cidr4._from_valid(_cidr4_last(self.rhs), 32))])
+
+    def as_integer_sql(self, lhs_sql, lhs_params, last_sql, last_params):
+        return '(%s >= %%s AND %s <= %%s)' % (lhs_sql, last_sql), (
+            lhs_params + [self.rhs.address] +
+            last_params + [_cidr4_last(self.rhs)])
+
+    def as_inet_sql(self, lhs_sql, params):
+        return '%s <<= %%s::cidr' % (lhs_sql,), params + [
+            self.rhs.as_string()]
+
+
+@Cidr4Field.register_lookup
+class Cidr4Overlaps(Cidr4Lookup):
+    '''
+    The networks that share addresses with the network: those inside
+    it and those that contain it.
+    '''
+    lookup_name = 'overlaps'
+
+    def as_string_sql(self, lhs_sql, params):
+        within_sql, within_params = Cidr4Within.as_string_sql(
+            self, lhs_sql, params)
+        supernets_sql, supernets_params = self._strings_in(
+            lhs_sql, params, [
+                self.rhs.truncated(sigbits)
+                for sigbits in range(self.rhs.sigbits)])
+        return '(%s OR %s)' % (within_sql, supernets_sql), (
+            within_params + supernets_params)
+
+    def as_integer_sql(self, lhs_sql, lhs_params, last_sql, last_params):
+        return '(%s <= %%s AND %s >= %%s)' % (lhs_sql, last_sql), (
+            lhs_params + [_cidr4_last(self.rhs)] +
+            last_params + [self.rhs.address])
+
+    def as_inet_sql(self, lhs_sql, params):
+        return '%s && %%s::cidr' % (lhs_sql,), params + [
+            self.rhs.as_string()]
+
+
+class Cidr6Field(models.Field):
+    '''
+    An IPv6 address with netmask field.
+
+    Stored as 32 hex digits and the zero-padded netmask length, e.g.
+    20010db8000000000000000000000000/032, to get proper sorting.
+    '''
+    def __init__(self, **kwargs):
+        assert 'max_length' not in kwargs
+        kwargs['max_length'] = 36
+        super(Cidr6Field, self).__init__(**kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(Cidr6Field, self).deconstruct()
+        del kwargs['max_length']
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return "CharField"
+
+    def to_python(self, value):
+        # to_python will be called at ModelForm instantiation with ''
+        # as initial value, hence we must accept it as valid value
+        if value in (None, ''):
+            return None
+        return cidr6(value)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        value = cidr6(value)
+        return '%032x/%03d' % (value.address, value.sigbits)
+
+    def formfield(self, **kwargs):
+        defaults = {
+            'form_class': fields.Cidr6Field,
+        }
+        defaults.update(kwargs)
+        return super(Cidr6Field, self).formfield(**defaults)
+
+    def from_db_value(self, value, expression, connection, context=None):
+        if value is None:
+            return None
+        address, sigbits = value.split('/')
+        return cidr6((int(address, 16), int(sigbits)))
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(Cidr6Field, self).contribute_to_class(cls, name, **kwargs)
         setattr(cls, self.name, Creator(self))
 
 
@@ -1 +1,2 @@
 from .cidr4 import cidr4
+from .cidr6 import cidr6
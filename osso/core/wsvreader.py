@@ -1,7 +1,19 @@
 # vim: set ts=8 sw=4 sts=4 et ai tw=79:
 # WJD/2013
+import mmap
+import os
 import re
 import unittest
+from collections import namedtuple
+from functools import partial
+from io import BytesIO
+
+# A column is a double quoted value (in which "" is a literal double
+# quote) or a run of anything but whitespace and double quotes, with
+# whitespace or the start/end of the line on both sides. Anything else
+# on the line is skipped.
+TOKEN_RE = re.compile(
+    r'(?:^|(?<=\s))(?:"((?:[^"]|"")*)"|([^"\s]+))(?=\s|$)')
 
 
 class WsvReader(object):
@@ -40,13 +52,38 @@ class WsvReader(object):
         #  'optional_column': 'data4c',
         #  'extra0': 'data4d',
         #  'extra1': 'column_names expand as necessary'}
+
+    Pass row='tuple' or row='namedtuple' to get tuples instead of
+    dicts. Those have one value per header column: missing values are
+    None and extra values are dropped. The namedtuple class is
+    generated from the header, as reader.row_class; column names that
+    are not valid identifiers are renamed to _0, _1, etc.
+
+    Pass columns=('column_name2', 'column_name1') to get only those
+    columns, in that order. The names must be in the header.
+
+    Pass schema={'column_name1': int, 'column_name2': cidr4} to convert
+    the values of those columns with the callables. A converter that
+    raises TypeError, ValueError or ArithmeticError causes a ValueError
+    with the line number. Pass collect_errors=True to skip those rows
+    instead; then reader.errors is a list of (line number, column name,
+    value, exception) tuples.
     '''
+    ROW_TYPES = ('dict', 'tuple', 'namedtuple')
 
-    def __init__(self, file, dict=dict):
+    def __init__(self, file, dict=dict, row='dict', columns=None,
+                 schema=None, collect_errors=False):
+        if row not in self.ROW_TYPES:
+            raise ValueError('row must be one of %s, not %r' % (
+                ', '.join(self.ROW_TYPES), row))
         self.file = file
         self.need_seek = False
         self.dict = dict
-        self.findre = re.compile(r'\s([^"\s]*|"([^"]|"")*")\s')
+        self.row = row
+        self.columns = None if columns is None else tuple(columns)
+        self.schema = schema
+        self.collect_errors = collect_errors
+        self.errors = []
 
     def __iter__(self):
         if self.need_seek:
@@ -57,12 +94,17 @@ class WsvReader(object):
             self.need_seek = True
 
         self.fileiter = iter(self.file)
+        self.lineno = 0
         self.read_header()
         return self
 
     def __next__(self):
-        columns = self.split_line(self.get_line())
+        return self.make_row(self.split_line(self.get_line()))
+
+    def next_columns(self):
+        return self.split_line(self.get_line())
 
+    def make_dict(self, columns):
         # Ensure that the header is long enough.
         i = 0
         while len(columns) > len(self.columnnames):
@@ -77,10 +119,95 @@ class WsvReader(object):
         self.columnnames = self.split_line(self.get_line())
         if len(self.columnnames) != len(set(self.columnnames)):
             raise ValueError('duplicate column names!')
+        self.make_row = self.compile_row()
+        if self.schema:
+            self.make_row = self.compile_schema(self.make_row)
+
+    def compile_row(self):
+        # Return the function that turns the split line into a row.
+        # Everything that only depends on the header is done here,
+        # once, instead of for every row.
+        if self.row == 'dict' and self.columns is None:
+            return self.make_dict
+
+        names = self.columnnames
+        indexes = None
+        if self.columns is not None:
+            unknown = [i for i in self.columns if i not in names]
+            if unknown:
+                raise ValueError('unknown column names: %s' % (
+                    ', '.join(unknown),))
+            names = self.columns
+            indexes = [self.columnnames.index(i) for i in names]
+
+        if self.row == 'dict':
+            dict_, pairs = self.dict, list(zip(names, indexes))
+
+            def make_row(columns):
+                count = len(columns)
+                return dict_([(name, columns[index])
+                              for name, index in pairs if index < count])
+            return make_row
+
+        if self.row == 'namedtuple':
+            self.row_class = namedtuple('Row', names, rename=True)
+            # Like _make(), without the length check.
+            make = partial(tuple.__new__, self.row_class)
+        else:
+            make = tuple
+
+        # Pad short lines, so every index is valid.
+        width = len(self.columnnames)
+        padding = [None] * width
+        if indexes is None:
+            def make_row(columns):
+                if len(columns) < width:
+                    columns += padding[len(columns):]
+                return make(columns[:width])
+        else:
+            def make_row(columns):
+                if len(columns) < width:
+                    columns += padding[len(columns):]
+                return make([columns[index] for index in indexes])
+        return make_row
+
+    def compile_schema(self, make_row):
+        # Return make_row, wrapped in a function that converts the
+        # values first. Columns that are not returned are not converted.
+        unknown = [i for i in self.schema if i not in self.columnnames]
+        if unknown:
+            raise ValueError('unknown column names: %s' % (
+                ', '.join(unknown),))
+        converters = [
+            (self.columnnames.index(name), name, convert)
+            for name, convert in self.schema.items()
+            if self.columns is None or name in self.columns]
+        collect_errors = self.collect_errors
+        errors = self.errors = []
+
+        def convert_row(columns):
+            while True:
+                count = len(columns)
+                failed = False
+                for index, name, convert in converters:
+                    if index < count:
+                        try:
+                            columns[index] = convert(columns[index])
+                        except (TypeError, ValueError, ArithmeticError) as e:
+                            if not collect_errors:
+                                raise ValueError('line %d, column %s: %s' % (
+                                    self.lineno, name, e)) from e
+                            errors.append(
+                                (self.lineno, name, columns[index], e))
+                            failed = True
+                if not failed:
+                    return make_row(columns)
+                columns = self.next_columns()
+        return convert_row
 
     def get_line(self):
         # Fetch a new line. Skip all blank lines and comments.
-        for line in self.fileiter:
+        for self.lineno, line in enumerate(self.fileiter, self.lineno + 1):
             line = line.strip()
             if not line:
                 continue
@@ -98,20 +225,287 @@ class WsvReader(object):
         return column
 
     def split_line(self, line):
-        # We add space to both ends as sentinels.
-        line = ' ' + line + ' '
-        # Find the columns.
-        columns = []
-        pos = 0
-        while True:
-            match = self.findre.search(line, pos=pos)
-            if not match:
-                break
-            value = match.groups()[0]
-            if value:
-                columns.append(self.unquote(value))
-            pos = match.end() - 1
-        return columns
+        # Without double quotes, str.split() does the same thing in C.
+        if '"' not in line:
+            return line.split()
+        # Otherwise, find and unquote all columns in a single pass.
+        # Quoted values are in the first group, without the quotes.
+        return [plain or quoted.replace('""', '"')
+                for quoted, plain in TOKEN_RE.findall(line)]
+
+
+class MmapWsvReader(WsvReader):
+    '''
+    Whitespace-separated values reader for large files.
+
+    It reads like WsvReader, but takes the path of a file, which it
+    memory-maps and decodes in slices of about CHUNK_SIZE bytes that
+    end on a line boundary. The encoding must be ASCII compatible, like
+    UTF-8, so a newline byte is always the end of a line.
+
+    Only \n (and \r\n) end a line, unlike in a file opened in text
+    mode: a file with lone \r line endings raises ValueError.
+
+    Pass processes=N to parse the file in N processes, in chunks that
+    are split on line boundaries. The rows are returned in order.
+
+    The file stays mapped until close() is called, or the with block
+    ends::
+
+        with MmapWsvReader(path) as reader:
+            for row in reader:
+                print(row)
+    '''
+    CHUNK_SIZE = 1 << 24
+
+    def __init__(self, path, encoding='utf-8', processes=None, dict=dict,
+                 row='dict', columns=None, schema=None, collect_errors=False):
+        super().__init__(
+            None, dict=dict, row=row, columns=columns, schema=schema,
+            collect_errors=collect_errors)
+        self.path = path
+        self.encoding = encoding
+        self.processes = processes
+        self.mm = None
+
+    def __iter__(self):
+        self.open()
+        self.lineno = 0
+        self.read_header()
+        if self.processes and self.processes > 1:
+            self.columniter = self.iter_parallel(self.mm.tell())
+        else:
+            # Only keep track of the line numbers for the schema.
+            lineno = self.lineno + 1 if self.schema else None
+            self.columniter = self.iter_columns(
+                self.mm.tell(), self.size, lineno)
+        return self
+
+    def __next__(self):
+        return self.make_row(next(self.columniter))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def next_columns(self):
+        return next(self.columniter)
+
+    def open(self):
+        self.close()
+        with open(self.path, 'rb') as file:
+            self.size = os.fstat(file.fileno()).st_size
+            # You cannot map an empty file.
+            if self.size:
+                self.mm = mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.mm = BytesIO()
+        self.mm.seek(0)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def get_line(self):
+        # Fetch the header line, leaving the map at the line after it.
+        for self.lineno, line in enumerate(iter(self.mm.readline, b''), 1):
+            line = line.strip()
+            if b'\r' in line:
+                # Or we would read the whole file as the header.
+                raise ValueError(
+                    'line %d: lines must end with \\n, not \\r' % (
+                        self.lineno,))
+            if line and not line.startswith(b'#'):
+                return line.decode(self.encoding)
+        raise StopIteration()
+
+    def iter_columns(self, start, end, lineno=None):
+        # Generate the split lines of the data from start to end. The
+        # lines are found in the bytes, and decoded a chunk at a time.
+        # If lineno is the number of the line at start, self.lineno is
+        # set to the number of each line that is generated.
+        encoding, split_line = self.encoding, self.split_line
+        for chunk_start, chunk_end in self.chunks(
+                start, end, self.CHUNK_SIZE):
+            text = self.mm[chunk_start:chunk_end].decode(encoding)
+            lines = text.split('\n')
+            if '\r' in text:
+                self.check_carriage_returns(lines, chunk_start, lineno)
+            if lineno is None:
+                yield from map(split_line, [
+                    i for i in map(str.strip, lines)
+                    if i and not i.startswith('#')])
+                continue
+            for self.lineno, line in enumerate(map(str.strip, lines), lineno):
+                if line and not line.startswith('#'):
+                    yield split_line(line)
+            lineno += len(lines) - 1
+
+    def check_carriage_returns(self, lines, start, lineno=None):
+        # A lone \r inside a line would silently join two records.
+        for index, line in enumerate(lines):
+            if '\r' in line.strip():
+                if lineno is None:
+                    lineno = self.mm[:start].count(b'\n') + 1
+                raise ValueError(
+                    'line %d: lines must end with \\n, not \\r' % (
+                        lineno + index,))
+
+    def chunks(self, start, end, step):
+        # Split the data from start to end into chunks of about step
+        # bytes that end at the end of a line.
+        while start < end:
+            newline = self.mm.find(b'\n', start + step, end)
+            chunk_end = end if newline == -1 else newline + 1
+            yield start, chunk_end
+            start = chunk_end
+
+    def read_chunk(self, start, end, lineno=None):
+        self.open()
+        try:
+            if lineno is None:
+                return list(self.iter_columns(start, end))
+            return [(self.lineno, columns)
+                    for columns in self.iter_columns(start, end, lineno)]
+        finally:
+            self.close()
+
+    def iter_parallel(self, start):
+        from concurrent.futures import ProcessPoolExecutor
+
+        # More chunks than processes, so a slow one does not hold up
+        # the others for long.
+        step = max((self.size - start) // (self.processes * 4), 1)
+        chunks = list(self.chunks(start, self.size, step))
+
+        # Only keep track of the line numbers for the schema.
+        linenos = [None] * len(chunks)
+        if self.schema:
+            linenos[0] = self.lineno + 1
+            for index, (chunk_start, chunk_end) in enumerate(chunks[:-1]):
+                linenos[index + 1] = linenos[index] + self.mm[
+                    chunk_start:chunk_end].count(b'\n')
+
+        args = [
+            (self.path, self.encoding, chunk_start, chunk_end, lineno)
+            for (chunk_start, chunk_end), lineno in zip(chunks, linenos)]
+        with ProcessPoolExecutor(self.processes) as executor:
+            for rows in executor.map(_read_chunk, args):
+                if not self.schema:
+                    yield from rows
+                    continue
+                for self.lineno, columns in rows:
+                    yield columns
+
+
+def _read_chunk(args):
+    # Parse a chunk of an MmapWsvReader file in a worker process.
+    path, encoding, start, end, lineno = args
+    return MmapWsvReader(path, encoding=encoding).read_chunk(
+        start, end, lineno)
+
+
+class WsvWriter(object):
+    '''
+    Whitespace-separated values writer, for files that WsvReader reads.
+
+    Usage::
+
+        writer = WsvWriter(file, ('column_name1', 'column_name2'))
+        writer.writerow({'column_name1': 'data1a', 'column_name2': ''})
+        writer.writerow(('data2a', 'has "spaces"'))
+        writer.flush()
+
+        # Writes this:
+
+        # column_name1 column_name2
+        # data1a       ""
+        # data2a       "has ""spaces"""
+
+    Rows are dicts (or other mappings) or sequences. None is a missing
+    value: at the end of a row it is left out, elsewhere it is written
+    as "". Other values are written as str(value); those that are empty,
+    start with a # or contain whitespace or double quotes are quoted.
+    A row without values is written as a single "", because WsvReader
+    skips blank lines; it reads back with an empty first value.
+
+    The rows are kept until there are window rows, and then written
+    with a single write, with the columns aligned to the widest value
+    seen so far. Call flush() (or use the writer as a context manager)
+    to write the rest. Pass align=False to separate the values with a
+    single space instead.
+    '''
+    QUOTE_RE = re.compile(r'^$|^#|[\s"]')
+
+    def __init__(self, file, columnnames, window=1000, align=True):
+        self.file = file
+        self.columnnames = list(columnnames)
+        if len(self.columnnames) != len(set(self.columnnames)):
+            raise ValueError('duplicate column names!')
+        self.window = window
+        self.align = align
+        self.widths = []
+        self.pending = [[self.quote(i) for i in self.columnnames]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.flush()
+
+    def quote(self, value):
+        if self.QUOTE_RE.search(value):
+            if '\n' in value or '\r' in value:
+                raise ValueError('cannot write newlines: %r' % (value,))
+            return '"%s"' % (value.replace('"', '""'),)
+        return value
+
+    def writerow(self, row):
+        if hasattr(row, 'keys'):
+            row = [row.get(i) for i in self.columnnames]
+        else:
+            row = list(row)
+        while row and row[-1] is None:
+            row.pop()
+
+        quote = self.quote
+        self.pending.append([
+            '""' if value is None else quote(str(value))
+            for value in row] or ['""'])
+        if len(self.pending) >= self.window:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+
+        if not self.align:
+            self.file.write(''.join(' '.join(i) + '\n' for i in rows))
+            return
+
+        # Widen the columns that need it. All but the last value of
+        # each row are padded.
+        widths = self.widths
+        for row in rows:
+            for index, value in enumerate(row[:-1]):
+                if index == len(widths):
+                    widths.append(len(value))
+                elif len(value) > widths[index]:
+                    widths[index] = len(value)
+        self.file.write(''.join(
+            ' '.join([value.ljust(width)
+                      for value, width in zip(row[:-1], widths)]
+                     + row[-1:])
+            + '\n' for row in rows))
 
 
 class TestCase(unittest.TestCase):
@@ -239,6 +633,226 @@ class TestCase(unittest.TestCase):
               'extra0': 'd4'}]
         )
 
+    def test_split_line(self):
+        "Malformed columns are skipped, like the sentinel parser did."
+        reader = WsvReader(None)
+        self.assertEqual(reader.split_line('a\t  b'), ['a', 'b'])
+        self.assertEqual(
+            reader.split_line('a"b "c d"x "" "e""f" g""h'), ['', 'e"f'])
+        self.assertEqual(
+            reader.split_line('"""" """a" "b"""'), ['"', '"a', 'b"'])
+
+    def test_row_tuple(self):
+        "Tuples have one value per header column."
+        file = self.get_file('col1 col2 col3\nd1 d2 d3 d4\nd1\n')
+        reader = WsvReader(file, row='tuple')
+        self.assertEqual(
+            list(reader), [('d1', 'd2', 'd3'), ('d1', None, None)])
+
+    def test_row_namedtuple(self):
+        "The namedtuple class is generated from the header."
+        file = self.get_file('col1 "col 2" col3\nd1 d2 d3\nd1 d2\n')
+        reader = WsvReader(file, row='namedtuple')
+        data = list(reader)
+        self.assertEqual(reader.row_class._fields, ('col1', '_1', 'col3'))
+        self.assertEqual(data[0].col1, 'd1')
+        self.assertEqual(data[1], ('d1', 'd2', None))
+
+    def test_columns(self):
+        "Only the selected columns are returned, in that order."
+        string = 'col1 col2 col3\nd1 d2 d3\nd1 d2\n'
+        reader = WsvReader(self.get_file(string), columns=('col3', 'col1'))
+        self.assertEqual(
+            list(reader), [{'col3': 'd3', 'col1': 'd1'}, {'col1': 'd1'}])
+
+        reader = WsvReader(
+            self.get_file(string), row='namedtuple', columns=['col3'])
+        self.assertEqual([i.col3 for i in reader], ['d3', None])
+
+        reader = WsvReader(self.get_file(string), columns=('col4',))
+        self.assertRaises(ValueError, list, reader)
+        self.assertRaises(ValueError, WsvReader, None, row='list')
+
+    def test_mmap(self):
+        "The memory-mapped reader returns the same rows."
+        import tempfile
+        string = (
+            '# comment\n1st "2nd col\xfcmn" 3rd\n\n'
+            + 'd1 "d2 ""x""" \xe9\t""\nd1\n#d1\n"a b" c d e f\n' * 50)
+        with tempfile.NamedTemporaryFile(suffix='.wsv') as file:
+            file.write(string.encode('utf-8'))
+            file.flush()
+            for kwargs in (
+                    {}, {'row': 'tuple'}, {'row': 'namedtuple'},
+                    {'columns': ('3rd', '1st')},
+                    {'row': 'tuple', 'columns': ('2nd col\xfcmn',)}):
+                expected = list(WsvReader(self.get_file(string), **kwargs))
+                for processes in (None, 3):
+                    reader = MmapWsvReader(
+                        file.name, processes=processes, **kwargs)
+                    self.assertEqual(list(reader), expected)
+                    self.assertEqual(list(reader), expected)
+                # Split the file into many chunks.
+                reader = MmapWsvReader(file.name, **kwargs)
+                reader.CHUNK_SIZE = 10
+                self.assertEqual(list(reader), expected)
+
+    def test_mmap_close(self):
+        "The file is unmapped on close() and at the end of a with block."
+        import tempfile
+        with tempfile.NamedTemporaryFile(suffix='.wsv') as file:
+            file.write(b'a b\n1 2\n')
+            file.flush()
+            with MmapWsvReader(file.name) as reader:
+                self.assertEqual(list(reader), [{'a': '1', 'b': '2'}])
+                mm = reader.mm
+                self.assertFalse(mm.closed)
+            self.assertTrue(mm.closed)
+            self.assertIsNone(reader.mm)
+            reader.close()  # again
+            self.assertEqual(list(reader), [{'a': '1', 'b': '2'}])
+            reader.close()
+            self.assertIsNone(reader.mm)
+
+    def test_mmap_line_endings(self):
+        "Lines end with \\n or \\r\\n; lone \\r is refused."
+        import tempfile
+        string = '# comment\na b\n1 2\n\n3 4\n'
+        expected = list(WsvReader(self.get_file(string)))
+        for newline, ok in (('\r\n', True), ('\r', False)):
+            with tempfile.NamedTemporaryFile(suffix='.wsv') as file:
+                file.write(string.replace('\n', newline).encode('utf-8'))
+                file.flush()
+                with MmapWsvReader(file.name) as reader:
+                    if ok:
+                        self.assertEqual(list(reader), expected)
+                    else:
+                        self.assertRaises(ValueError, iter, reader)
+
+    def test_mmap_lone_carriage_return(self):
+        "A lone \\r in the data is refused too, with its line number."
+        import tempfile
+        with tempfile.NamedTemporaryFile(suffix='.wsv') as file:
+            file.write(b'a b\n1 2\n3 4\r5 6\n7 8\n')
+            file.flush()
+            for processes in (None, 2):
+                with MmapWsvReader(file.name, processes=processes) as reader:
+                    with self.assertRaises(ValueError) as cm:
+                        list(reader)
+                    self.assertEqual(
+                        str(cm.exception),
+                        'line 3: lines must end with \\n, not \\r')
+
+    def test_mmap_empty(self):
+        "An empty file has no header."
+        import tempfile
+        with tempfile.NamedTemporaryFile(suffix='.wsv') as file:
+            self.assertRaises(StopIteration, iter, MmapWsvReader(file.name))
+
+    def test_schema(self):
+        "Values are converted; bad rows raise or are collected."
+        from decimal import Decimal
+        from osso.core.cidr4 import cidr4
+        string = (
+            '# comment\nid price network\n1 1.50 10.0.0.0/8\n\n'
+            '2 x 10.1.0.0/16\n3 2 10.1.0.1/16\n4\n')
+        schema = {'id': int, 'price': Decimal, 'network': cidr4}
+
+        reader = WsvReader(self.get_file(string), schema=schema)
+        with self.assertRaises(ValueError) as cm:
+            list(reader)
+        self.assertTrue(str(cm.exception).startswith('line 5, column price'))
+
+        reader = WsvReader(
+            self.get_file(string), schema=schema, collect_errors=True)
+        self.assertEqual(list(reader), [
+            {'id': 1, 'price': Decimal('1.50'),
+             'network': cidr4('10.0.0.0/8')},
+            {'id': 4}])
+        self.assertEqual(
+            [i[0:3] for i in reader.errors],
+            [(5, 'price', 'x'), (6, 'network', '10.1.0.1/16')])
+
+        # Only the selected columns are converted.
+        reader = WsvReader(
+            self.get_file(string), row='tuple', columns=('id', 'network'),
+            schema={'id': int, 'price': int}, collect_errors=True)
+        self.assertEqual(
+            [i[0] for i in reader], [1, 2, 3, 4])
+
+    def test_schema_mmap(self):
+        "The memory-mapped reader reports the same line numbers."
+        import tempfile
+        string = 'id\n' + ''.join(
+            '# comment\n%s\n\n' % (i if i % 7 else 'x%d' % (i,))
+            for i in range(100))
+        expected = WsvReader(
+            self.get_file(string), schema={'id': int}, collect_errors=True)
+        rows = list(expected)
+        with tempfile.NamedTemporaryFile(suffix='.wsv') as file:
+            file.write(string.encode('utf-8'))
+            file.flush()
+            for processes in (None, 3):
+                reader = MmapWsvReader(
+                    file.name, processes=processes, schema={'id': int},
+                    collect_errors=True)
+                reader.CHUNK_SIZE = 10
+                self.assertEqual(list(reader), rows)
+                self.assertEqual(
+                    [i[0:3] for i in reader.errors],
+                    [i[0:3] for i in expected.errors])
+
+    def test_writer(self):
+        "Columns are aligned per window, missing values left out."
+        file = self.get_file('')
+        writer = WsvWriter(file, ('1st', '2nd column', '#3rd'), window=3)
+        writer.writerow({'1st': 'data1', '2nd column': None, '#3rd': 3})
+        writer.writerow(['x', 'y', 'z', None])
+        written = file.getvalue()
+        self.assertEqual(written, (
+            '1st   "2nd column" "#3rd"\n'
+            'data1 ""           3\n'
+            'x     y            z\n'))
+        writer.writerow(('longer data', '""'))
+        writer.writerow({'1st': 'a', '2nd column': 'b'})
+        writer.flush()
+        self.assertEqual(file.getvalue()[len(written):], (
+            '"longer data" """"""\n'
+            'a             b\n'))
+
+        file = self.get_file('')
+        with WsvWriter(file, ('a', 'b'), align=False) as writer:
+            writer.writerow(('data 1', ''))
+        self.assertEqual(file.getvalue(), 'a b\n"data 1" ""\n')
+
+        self.assertRaises(ValueError, WsvWriter, file, ('a', 'a'))
+        self.assertRaises(ValueError, writer.writerow, ('a\nb',))
+
+    def test_writer_round_trip(self):
+        "What WsvWriter writes, WsvReader reads back."
+        import random
+        rng = random.Random(1)
+        columnnames = ['col1', 'col 2', '"col3"', '#col4', '']
+        rows = [
+            [''.join(rng.choice('ab "#\t\xe9') for j in range(
+                rng.randint(0, 5))) for i in columnnames]
+            for k in range(200)]
+        # Rows without values are not lost as blank lines.
+        empty = ('',) + (None,) * (len(columnnames) - 1)
+        expected = [tuple(i) for i in rows]
+        rows[0:0], expected[0:0] = [()], [empty]
+        rows[100:100] = [dict.fromkeys(columnnames), [None, None]]
+        expected[100:100] = [empty, empty]
+        rows.append({})
+        expected.append(empty)
+        for align in (True, False):
+            file = self.get_file('')
+            with WsvWriter(file, columnnames, window=64,
+                           align=align) as writer:
+                writer.writerows(rows)
+            file.seek(0)
+            self.assertEqual(list(WsvReader(file, row='tuple')), expected)
+
     def get_file(self, string, seekable=True):
         from io import StringIO
 
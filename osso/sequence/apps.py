@@ -6,22 +6,53 @@ from django.conf import settings
 from django.db.models.signals import post_migrate
 
 from osso.sequence.backends import SequenceError
+from osso.sequence.block import BlockSequence
 
 
 class SequenceAppConfig(AppConfig):
     name = 'osso.sequence'
     verbose_name = 'Sequence'
 
+    # The "table" engine keeps all sequences in the sequence_sequence
+    # table. The "native" engine uses the database sequence objects,
+    # which are non-transactional: nextval() does not lock, but values
+    # are not returned on rollback either. The "memory" engine keeps
+    # them in process memory, for tests and single-node tools.
+    ENGINES = ('table', 'native', 'memory')
+    NATIVE_BACKENDS = ('mysql', 'postgresql')
+
     def ready(self):
         post_migrate.connect(self.install, sender=self)
 
+    def get_engine(self):
+        engine = getattr(settings, 'SEQUENCE_ENGINE', 'table')
+        if engine not in self.ENGINES:
+            raise SequenceError('%r is not an available sequence engine' %
+                                (engine,))
+        return engine
+
     def get_backend(self):
+        backend = self.get_engine_backend(self.get_engine())
+        if backend is not None:
+            block_sizes = getattr(settings, 'SEQUENCE_BLOCK_SIZES', None)
+            if block_sizes:
+                backend = BlockSequence(backend, block_sizes)
+        return backend
+
+    def get_engine_backend(self, engine):
+        if engine == 'memory':
+            return self.load_backend('memory').Sequence()
         db_engine = settings.DATABASES['default']['ENGINE']
         db_engine = db_engine.rsplit('.', 1)[-1]
-        if db_engine:
-            backend = self.load_backend(db_engine)
-            return backend.Sequence()
-        return None
+        if not db_engine:
+            return None
+        if engine == 'native':
+            db_engine = db_engine.split('_', 1)[0]
+            if db_engine not in self.NATIVE_BACKENDS:
+                raise SequenceError('%r has no native sequence engine' %
+                                    (db_engine,))
+            return self.load_backend('%s_native' % (db_engine,)).Sequence()
+        return self.load_backend(db_engine).Sequence()
 
     def install(self, **kwargs):
         backend = self.get_backend()
@@ -1,5 +1,9 @@
 # vim: set ts=8 sw=4 sts=4 et ai:
 import re
+from functools import lru_cache
+from threading import local
+
+from django.db import connection
 
 class SequenceError(ValueError):
     pass
@@ -8,10 +12,29 @@ class SequenceDoesNotExist(SequenceError):
     pass
 
 sequence_name_re = re.compile('^[a-zA-Z]{1}[a-zA-Z0-9_]{0,63}$')
+
+# Native sequences are named _sq<name>, and are limited by the 63
+# character identifier length of PostgreSQL.
+NATIVE_PREFIX = '_sq'
+NATIVE_MAX_NAME_LENGTH = 63 - len(NATIVE_PREFIX)
+# Attempts at fetching a contiguous range from a native sequence.
+NATIVE_RESERVE_ATTEMPTS = 5
+
+@lru_cache(maxsize=1024)
+def is_valid_name(name):
+    return sequence_name_re.match(name) is not None
+
+def is_contiguous(values, increment):
+    return all(value == values[0] + increment * i
+               for i, value in enumerate(values))
+
 class BaseSequence(object):
     '''
     Base Sequence class
     '''
+    def __init__(self):
+        self._local = local()
+
     def create(self, name, start=1, increment=1):
         '''
         Create a sequence with identifier `name`
@@ -36,12 +59,36 @@ class BaseSequence(object):
         '''
         raise NotImplementedError()
 
+    def nextval_many(self, name, count):
+        '''
+        return the next `count` values for the sequence `name` as a
+        range; they are contiguous, in steps of the sequence increment
+        '''
+        first, increment = self.reserve(name, count)
+        return range(first, first + increment * count, increment)
+
+    def reserve(self, name, count):
+        '''
+        reserve `count` consecutive values for the sequence `name` in a
+        single statement; return the tuple (first_value, increment)
+        '''
+        raise NotImplementedError()
+
     def setval(self, name, value):
         '''
         set the value for sequence `name` to `value`
         '''
         raise NotImplementedError()
 
+    def all(self):
+        '''
+        return a list of (name, start, increment, value) tuples of all
+        sequences
+        '''
+        from osso.sequence.models import Sequence
+        return list(Sequence.objects.order_by('name').values_list(
+            'name', 'start', 'increment', 'value'))
+
     def install(self, **kwargs):
         '''
         hook to prepare the database for sequences
@@ -52,10 +99,37 @@ class BaseSequence(object):
         '''
         validate if the given name is a valid sequence name
         '''
-        match = sequence_name_re.match(name)
-        if not match:
+        if not is_valid_name(name):
             raise SequenceError('invalid sequence name %r' % name)
 
+    def validate_count(self, count):
+        '''
+        validate if the given count is a valid amount of values
+        '''
+        if not isinstance(count, int) or count < 1:
+            raise SequenceError('invalid sequence value count %r' % (count,))
+
+    def get_cursor(self):
+        '''
+        return a cursor for the current connection; the cursor is
+        reused for as long as the underlying database connection lives
+        '''
+        connection.ensure_connection()
+        connection.validate_no_broken_transaction()
+        key = (connection.connection, connection.queries_logged)
+        cached = getattr(self._local, 'cursor', None)
+        if cached is None or cached[0] != key:
+            cursor = connection.cursor()
+            self.prepare_cursor(cursor)
+            cached = self._local.cursor = (key, cursor)
+        return cached[1]
+
+    def prepare_cursor(self, cursor):
+        '''
+        hook to prepare a fresh cursor before it is reused
+        '''
+        pass
+
     def has_savepoint_issues(self):
         '''
         set to true if this connection has problems with savepoints in
@@ -0,0 +1,254 @@
+# vim: set ts=8 sw=4 sts=4 et ai:
+import atexit
+import fcntl
+import mmap
+import os
+import struct
+import time
+from threading import Lock, RLock
+
+from django.conf import settings
+
+from osso.sequence.backends import (BaseSequence, SequenceDoesNotExist,
+                                    SequenceError)
+
+# The file is a header followed by fixed size records, one per sequence.
+FILE_MAGIC = b'OSSOSEQ1'
+FILE_HEADER = struct.Struct('<8sq')  # magic, record count
+FILE_RECORD = struct.Struct('<64sqqq?7x')  # name, start, incr., value, set
+FILE_RECORDS_MIN = 64
+
+_stores = {}
+_stores_lock = Lock()
+
+
+def get_store(path=None, checkpoint=1.0):
+    '''
+    Return the process-wide store for `path` (None for memory only)
+    '''
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = Store(path, checkpoint)
+        return _stores[path]
+
+
+class Store(object):
+    '''
+    Thread-safe in-process sequence storage, optionally backed by a
+    memory-mapped file
+
+    Every change is written into the mapping right away; the mapping is
+    flushed to disk at most every `checkpoint` seconds, and at exit. A
+    file can only be used by one process at a time.
+    '''
+    def __init__(self, path=None, checkpoint=1.0):
+        self.lock = RLock()
+        self.path = path
+        self.checkpoint_interval = checkpoint
+        self.sequences = {}  # name => [start, increment, value]
+        self.slots = {}  # name => record index in the file
+        self._fd = self._mmap = None
+        if path is not None:
+            self._open(path)
+            atexit.register(self.checkpoint)
+
+    def _open(self, path):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            raise SequenceError('%r is in use by another process' % path)
+
+        if os.fstat(fd).st_size == 0:
+            os.ftruncate(
+                fd, FILE_HEADER.size + FILE_RECORD.size * FILE_RECORDS_MIN)
+            os.pwrite(fd, FILE_HEADER.pack(FILE_MAGIC, 0), 0)
+        self._fd = fd
+        self._mmap = mmap.mmap(fd, 0)
+
+        magic, count = FILE_HEADER.unpack_from(self._mmap, 0)
+        if magic != FILE_MAGIC:
+            self.close()
+            raise SequenceError('%r is not a sequence file' % path)
+        for index in range(count):
+            name, start, increment, value, is_set = FILE_RECORD.unpack_from(
+                self._mmap, FILE_HEADER.size + FILE_RECORD.size * index)
+            name = name.rstrip(b'\0').decode('ascii')
+            self.sequences[name] = [
+                start, increment, (None, value)[is_set]]
+            self.slots[name] = index
+        self._last_checkpoint = time.monotonic()
+
+    def close(self):
+        '''
+        Flush and close the file, and forget this store
+        '''
+        with _stores_lock:
+            if _stores.get(self.path) is self:
+                del _stores[self.path]
+        with self.lock:
+            if self._mmap is not None:
+                self._mmap.flush()
+                self._mmap.close()
+                os.close(self._fd)
+                self._fd = self._mmap = None
+                atexit.unregister(self.checkpoint)
+
+    def checkpoint(self):
+        '''
+        Flush the changes to disk
+        '''
+        with self.lock:
+            if self._mmap is not None:
+                self._mmap.flush()
+                self._last_checkpoint = time.monotonic()
+
+    def store(self, name):
+        '''
+        Write the sequence `name` to the file, if any
+        '''
+        if self._mmap is None:
+            return
+        start, increment, value = self.sequences[name]
+        if name not in self.slots:
+            index = self.slots[name] = len(self.slots)
+            size = FILE_HEADER.size + FILE_RECORD.size * (index + 1)
+            if size > len(self._mmap):
+                self._mmap.resize(max(size, len(self._mmap) * 2))
+            FILE_HEADER.pack_into(self._mmap, 0, FILE_MAGIC, len(self.slots))
+        FILE_RECORD.pack_into(
+            self._mmap, FILE_HEADER.size + FILE_RECORD.size * self.slots[name],
+            name.encode('ascii'), start, increment, value or 0,
+            value is not None)
+        self._maybe_checkpoint()
+
+    def remove(self, name):
+        '''
+        Remove the sequence `name` from the file, if any
+        '''
+        if self._mmap is None:
+            return
+        # Move the last record into the freed slot.
+        index = self.slots.pop(name)
+        if index != len(self.slots):
+            last_offset = FILE_HEADER.size + FILE_RECORD.size * len(self.slots)
+            offset = FILE_HEADER.size + FILE_RECORD.size * index
+            self._mmap[offset:offset + FILE_RECORD.size] = (
+                self._mmap[last_offset:last_offset + FILE_RECORD.size])
+            for other, other_index in self.slots.items():
+                if other_index == len(self.slots):
+                    self.slots[other] = index
+                    break
+        FILE_HEADER.pack_into(self._mmap, 0, FILE_MAGIC, len(self.slots))
+        self._maybe_checkpoint()
+
+    def _maybe_checkpoint(self):
+        if time.monotonic() - self._last_checkpoint >= (
+                self.checkpoint_interval):
+            self.checkpoint()
+
+
+class Sequence(BaseSequence):
+    '''
+    In-process Sequence class
+
+    Keeps the sequences in process memory, so nextval() needs no
+    database round trip. Select it with SEQUENCE_ENGINE = 'memory'.
+    All instances in a process share their data.
+
+    The values are not shared between processes and are not rolled
+    back with database transactions. Set SEQUENCE_MEMORY_FILE to a path
+    to keep them in a memory-mapped file, which is flushed to disk at
+    most every SEQUENCE_MEMORY_CHECKPOINT seconds (default 1.0). After
+    a system crash, the values since the last checkpoint are lost and
+    will be handed out again. Only one process can use the file.
+    '''
+    def __init__(self, path=None, checkpoint=None):
+        super().__init__()
+        if path is None:
+            path = getattr(settings, 'SEQUENCE_MEMORY_FILE', None)
+        if checkpoint is None:
+            checkpoint = getattr(settings, 'SEQUENCE_MEMORY_CHECKPOINT', 1.0)
+        self.store = get_store(path, checkpoint)
+
+    def get(self, name):
+        self.validate_name(name)
+        try:
+            return self.store.sequences[name]
+        except KeyError:
+            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+
+    def create(self, name, start=1, increment=1):
+        '''
+        Create a sequence with identifier `name`
+        '''
+        self.validate_name(name)
+        with self.store.lock:
+            if name in self.store.sequences:
+                raise SequenceError('sequence %r already exists' % name)
+            self.store.sequences[name] = [start, increment, None]
+            self.store.store(name)
+
+    def drop(self, name):
+        '''
+        Drop the sequence with identifier `name` if it exists
+        '''
+        with self.store.lock:
+            self.get(name)
+            del self.store.sequences[name]
+            self.store.remove(name)
+
+    def currval(self, name):
+        '''
+        Return the current value of the sequence `name`
+        '''
+        value = self.get(name)[2]
+        if value is None:
+            raise SequenceError('sequence %r has no value' % name)
+        return value
+
+    def nextval(self, name):
+        '''
+        Return the next value for the sequence `name`
+        '''
+        with self.store.lock:
+            seq = self.get(name)
+            if seq[2] is None:
+                seq[2] = seq[0]
+            else:
+                seq[2] += seq[1]
+            self.store.store(name)
+            return seq[2]
+
+    def reserve(self, name, count):
+        '''
+        Reserve `count` values for the sequence `name` at once
+        '''
+        self.validate_count(count)
+        with self.store.lock:
+            seq = self.get(name)
+            if seq[2] is None:
+                first = seq[0]
+            else:
+                first = seq[2] + seq[1]
+            seq[2] = first + seq[1] * (count - 1)
+            self.store.store(name)
+            return first, seq[1]
+
+    def setval(self, name, value):
+        '''
+        Set the value for sequence `name` to `value`
+        '''
+        with self.store.lock:
+            self.get(name)[2] = value
+            self.store.store(name)
+
+    def all(self):
+        '''
+        Return a list of (name, start, increment, value) tuples of all
+        sequences
+        '''
+        with self.store.lock:
+            return [(name,) + tuple(seq) for name, seq in sorted(
+                self.store.sequences.items())]
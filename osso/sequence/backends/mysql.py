@@ -22,7 +22,7 @@ class Sequence(BaseSequence):
         Create a sequence with identifier `name`
         '''
         self.validate_name(name)
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
 
         sid = transaction.savepoint()
         try:
@@ -45,7 +45,7 @@ class Sequence(BaseSequence):
         Drop the sequence with identifier `name` if it exists
         '''
         self.validate_name(name)
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
         rows = cursor.execute('DELETE FROM sequence_sequence WHERE name = %s',
                               (name,))
         if rows == 0:
@@ -56,7 +56,7 @@ class Sequence(BaseSequence):
         Return the current value of the sequence `name`
         '''
         self.validate_name(name)
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
         cursor.execute('SELECT value FROM sequence_sequence WHERE name = %s',
                        (name,))
         row = cursor.fetchone()
@@ -71,7 +71,7 @@ class Sequence(BaseSequence):
         Return the next value for the sequence `name`
         '''
         self.validate_name(name)
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
         try:
             # The new way. We're using a stored prodecure nowadays
             # instead of a function, because the function does not
@@ -94,12 +94,50 @@ class Sequence(BaseSequence):
             raise SequenceDoesNotExist('sequence %r does not exist' % name)
         return row[0]
 
+    def reserve(self, name, count):
+        '''
+        Reserve `count` values for the sequence `name` at once
+        '''
+        self.validate_name(name)
+        self.validate_count(count)
+        cursor = self.get_cursor()
+        try:
+            # Like nextval, use a stored procedure for proper
+            # replication.
+            cursor.callproc('nextval_many', (name, count))
+        except (DatabaseError, OperationalError):  # SP does not exist
+            # LAST_INSERT_ID(expr) is kept per connection, so we read
+            # back our own value, even if another connection updated it
+            # since.
+            rows = cursor.execute(
+                'UPDATE sequence_sequence '
+                'SET value = LAST_INSERT_ID(COALESCE(value + increment * %s, '
+                '                                    start + increment * %s)) '
+                'WHERE name = %s',
+                (count, count - 1, name))
+            if rows == 0:
+                raise SequenceDoesNotExist(
+                    'sequence %r does not exist' % name)
+            cursor.execute('SELECT LAST_INSERT_ID() - increment * %s, '
+                           '       increment '
+                           'FROM sequence_sequence WHERE name = %s',
+                           (count - 1, name))
+            row = cursor.fetchone()
+        else:
+            row = cursor.fetchone()
+            discard = cursor.nextset()  # must call nextset for SP
+            assert discard == 1
+
+        if row is None or row[0] is None:
+            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+        return row[0], row[1]
+
     def setval(self, name, value):
         '''
         Set the value for sequence `name` to `value`
         '''
         self.validate_name(name)
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
         rows = cursor.execute('UPDATE sequence_sequence SET value = %s '
                               'WHERE name = %s',
                               (value, name))
@@ -157,6 +195,32 @@ class Sequence(BaseSequence):
             else:
                 raise
 
+        try:
+            cursor.execute('''
+                CREATE PROCEDURE `nextval_many`(IN seq_name VARCHAR(63)
+                                                CHARACTER SET ascii,
+                                                IN seq_count INT)
+                    MODIFIES SQL DATA
+                    SQL SECURITY INVOKER
+                BEGIN
+                    UPDATE sequence_sequence
+                        SET value = LAST_INSERT_ID(COALESCE(
+                            value + increment * seq_count,
+                            start + increment * (seq_count - 1)))
+                        WHERE name = seq_name;
+                    IF ROW_COUNT() = 0 THEN
+                        SELECT NULL, NULL;
+                    ELSE
+                        SELECT LAST_INSERT_ID() - increment * (seq_count - 1),
+                               increment
+                            FROM sequence_sequence WHERE name = seq_name;
+                    END IF;
+                END
+            '''.replace('\n                ', '\n').strip())
+        except (DatabaseError, OperationalError) as e:
+            if e.args[0] != 1304:  # function/procedure exists
+                raise
+
     def has_savepoint_issues(self):
         if not hasattr(self, '_has_savepoint_issues'):
             try:
@@ -0,0 +1,154 @@
+# vim: set ts=8 sw=4 sts=4 et ai:
+try:
+    from MySQLdb import OperationalError
+except ImportError:
+    OperationalError = Exception
+
+from django.db import DatabaseError
+
+from osso.sequence.backends import (
+    NATIVE_MAX_NAME_LENGTH, NATIVE_PREFIX, NATIVE_RESERVE_ATTEMPTS,
+    SequenceDoesNotExist, SequenceError, is_contiguous)
+from osso.sequence.backends.mysql import Sequence as TableSequence
+
+
+class Sequence(TableSequence):
+    '''
+    MariaDB native Sequence class
+
+    Every sequence is a CREATE SEQUENCE object named `_sq<name>`, which
+    requires MariaDB 10.3 or newer. NEXTVAL() on those is not rolled
+    back with the transaction: concurrent transactions never wait on
+    each other, but a rollback leaves a gap.
+
+    Beware that create(), drop() and a setval() to a lower value are
+    DDL, which implicitly commits the current transaction.
+    '''
+    def get_native_name(self, name):
+        '''
+        Return the quoted native sequence name for `name`
+        '''
+        self.validate_name(name)
+        if len(name) > NATIVE_MAX_NAME_LENGTH:
+            raise SequenceError('sequence name %r is too long' % name)
+        return '`%s%s`' % (NATIVE_PREFIX, name)
+
+    def read(self, cursor, name):
+        '''
+        Return the (value, start, increment) of the sequence `name`,
+        where value is None if nextval() was never called
+        '''
+        native_name = self.get_native_name(name)
+        try:
+            # With NOCACHE, the next_not_cached_value is the next value.
+            cursor.execute('SELECT next_not_cached_value, start_value, '
+                           'increment FROM %s' % (native_name,))
+        except (DatabaseError, OperationalError):
+            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+        next_value, start, increment = cursor.fetchone()
+        if next_value == start:
+            return None, start, increment
+        return next_value - increment, start, increment
+
+    def create(self, name, start=1, increment=1):
+        '''
+        Create a sequence with identifier `name`
+        '''
+        native_name = self.get_native_name(name)
+        cursor = self.get_cursor()
+        try:
+            cursor.execute(
+                'CREATE SEQUENCE %s START WITH %d INCREMENT BY %d '
+                'MINVALUE -9223372036854775807 MAXVALUE 9223372036854775806 '
+                'NOCACHE' % (native_name, start, increment))
+        except (DatabaseError, OperationalError) as e:
+            if e.args[0] == 1050:  # table exists
+                raise SequenceError('sequence %r already exists' % name)
+            raise
+
+    def drop(self, name):
+        '''
+        Drop the sequence with identifier `name` if it exists
+        '''
+        native_name = self.get_native_name(name)
+        cursor = self.get_cursor()
+        try:
+            cursor.execute('DROP SEQUENCE %s' % (native_name,))
+        except (DatabaseError, OperationalError):
+            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+
+    def currval(self, name):
+        '''
+        Return the current value of the sequence `name`
+        '''
+        value, start, increment = self.read(self.get_cursor(), name)
+        if value is None:
+            raise SequenceError('sequence %r has no value' % name)
+        return value
+
+    def nextval(self, name):
+        '''
+        Return the next value for the sequence `name`
+        '''
+        native_name = self.get_native_name(name)
+        cursor = self.get_cursor()
+        try:
+            cursor.execute('SELECT NEXTVAL(%s)' % (native_name,))
+        except (DatabaseError, OperationalError):
+            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+        return cursor.fetchone()[0]
+
+    def reserve(self, name, count):
+        '''
+        Reserve `count` values for the sequence `name` at once
+
+        A native sequence cannot hand out a range atomically. When
+        other sessions interleave, the fetched values are discarded
+        (leaving a gap) and we try again. This uses the seq_1_to_N
+        tables of the MariaDB Sequence engine.
+        '''
+        native_name = self.get_native_name(name)
+        self.validate_count(count)
+        cursor = self.get_cursor()
+        value, start, increment = self.read(cursor, name)
+
+        for attempt in range(NATIVE_RESERVE_ATTEMPTS):
+            cursor.execute('SELECT NEXTVAL(%s) FROM seq_1_to_%d' %
+                           (native_name, count))
+            values = [row[0] for row in cursor.fetchall()]
+            if is_contiguous(values, increment):
+                return values[0], increment
+        raise SequenceError('could not reserve %d contiguous values for '
+                            'sequence %r' % (count, name))
+
+    def setval(self, name, value):
+        '''
+        Set the value for sequence `name` to `value`
+        '''
+        native_name = self.get_native_name(name)
+        cursor = self.get_cursor()
+        current, start, increment = self.read(cursor, name)
+        # SETVAL() refuses to go back; that takes a RESTART.
+        cursor.execute('SELECT SETVAL(%s, %%s)' % (native_name,), (value,))
+        if cursor.fetchone()[0] is None:
+            cursor.execute('ALTER SEQUENCE %s RESTART WITH %d' %
+                           (native_name, value + increment))
+
+    def all(self):
+        '''
+        Return a list of (name, start, increment, value) tuples of all
+        sequences
+        '''
+        cursor = self.get_cursor()
+        cursor.execute('SELECT table_name FROM information_schema.tables '
+                       'WHERE table_schema = DATABASE() '
+                       'AND table_type = %s '
+                       'AND LEFT(table_name, %s) = %s '
+                       'ORDER BY table_name',
+                       ('SEQUENCE', len(NATIVE_PREFIX), NATIVE_PREFIX))
+        ret = []
+        for (table_name,) in cursor.fetchall():
+            name = table_name[len(NATIVE_PREFIX):]
+            value, start, increment = self.read(cursor, name)
+            ret.append((name, start, increment, value))
+        return ret
@@ -1,21 +1,69 @@
 # vim: set ts=8 sw=4 sts=4 et ai:
+import re
 from functools import wraps
 
-from django.db import DatabaseError, connection, transaction
+from django.conf import settings
+from django.db import connection, transaction
 from osso.sequence.backends import (BaseSequence, SequenceDoesNotExist,
                                     SequenceError)
 
 
+# The hot statements; they are executed as server side prepared
+# statements when enabled. Every $N placeholder must be used exactly
+# once and in order, so they can be swapped for %s when not prepared.
+STATEMENTS = {
+    'currval': (
+        ('varchar',),
+        'SELECT value FROM sequence_sequence WHERE name = $1'),
+    'nextval': (
+        ('varchar',),
+        'UPDATE sequence_sequence '
+        'SET value = COALESCE(value + increment, start) '
+        'WHERE name = $1 '
+        'RETURNING value'),
+    'reserve': (
+        ('integer', 'integer', 'varchar'),
+        'UPDATE sequence_sequence '
+        'SET value = COALESCE('
+        'value + increment * $1, start + increment * $2) '
+        'WHERE name = $3 '
+        'RETURNING value, increment'),
+}
+PREPARED_PREFIX = 'osso_sequence_'
+
+
+def _compile_statements():
+    placeholder_re = re.compile(r'\$\d+')
+    compiled = {}
+    for statement, (types, sql) in STATEMENTS.items():
+        name = PREPARED_PREFIX + statement
+        compiled[statement] = (
+            name,
+            'PREPARE %s (%s) AS %s' % (name, ', '.join(types), sql),
+            'EXECUTE %s (%s)' % (name, ', '.join(['%s'] * len(types))),
+            placeholder_re.sub('%s', sql))
+    return compiled
+
+
+COMPILED_STATEMENTS = _compile_statements()
+
+
 def savepoint(func):
     """
-    After a "relation does not exist" failure, the current transaction
-    is aborted. This decorator makes sure we can continue.
+    After a database failure, the current transaction is aborted. This
+    decorator makes sure we can continue.
+
+    The savepoint is skipped in autocommit mode (where there is no
+    transaction to protect) and when the Sequence was created with
+    savepoints=False.
     """
     @wraps(func)
-    def wrapper(*args, **kwargs):
+    def wrapper(self, *args, **kwargs):
+        if not self.savepoints or connection.get_autocommit():
+            return func(self, *args, **kwargs)
         sid = transaction.savepoint()
         try:
-            ret = func(*args, **kwargs)
+            ret = func(self, *args, **kwargs)
         except Exception:
             transaction.savepoint_rollback(sid)
             raise
@@ -27,20 +75,74 @@ def savepoint(func):
 class Sequence(BaseSequence):
     """
     PostgreSQL Sequence class
+
+    Missing and duplicate sequences are detected from the statement
+    results, so they never abort the current transaction. The
+    savepoints only guard against unexpected database errors. Set
+    SEQUENCE_SAVEPOINTS = False (or pass savepoints=False) to save two
+    statements per call, at the cost of an aborted transaction on such
+    an error.
+
+    Set SEQUENCE_PREPARED_STATEMENTS = True (or pass prepared=True) to
+    prepare the currval, nextval and reserve statements once per
+    connection. This is off by default, because prepared statements do
+    not survive poolers that reset or share server sessions (e.g.
+    pgbouncer in transaction mode). With psycopg server side binding
+    they are skipped, because psycopg prepares frequent statements by
+    itself.
     """
+    def __init__(self, savepoints=None, prepared=None):
+        super().__init__()
+        if savepoints is None:
+            savepoints = getattr(settings, 'SEQUENCE_SAVEPOINTS', True)
+        if prepared is None:
+            prepared = getattr(
+                settings, 'SEQUENCE_PREPARED_STATEMENTS', False)
+            options = connection.settings_dict.get('OPTIONS', {})
+            if options.get('server_side_binding'):
+                prepared = False
+        self.savepoints = savepoints
+        self.prepared = prepared
+
+    def prepare_cursor(self, cursor):
+        '''
+        Prepare the hot statements, if they do not exist on this
+        connection yet
+        '''
+        if not self.prepared:
+            return
+        cursor.execute(
+            'SELECT name FROM pg_prepared_statements WHERE name = ANY(%s)',
+            ([i[0] for i in COMPILED_STATEMENTS.values()],))
+        existing = set(row[0] for row in cursor.fetchall())
+        for name, prepare, execute, sql in COMPILED_STATEMENTS.values():
+            if name not in existing:
+                cursor.execute(prepare)
+
+    def execute(self, cursor, statement, params):
+        '''
+        Execute one of the STATEMENTS, prepared if enabled
+        '''
+        name, prepare, execute, sql = COMPILED_STATEMENTS[statement]
+        if self.prepared:
+            cursor.execute(execute, params)
+        else:
+            cursor.execute(sql, params)
+
     @savepoint
     def create(self, name, start=1, increment=1):
         '''
         Create a sequence with identifier "name"
         '''
         self.validate_name(name)
-        cursor = connection.cursor()
-        try:
-            cursor.execute('INSERT INTO sequence_sequence '
-                           '("name", "start", "increment") '
-                           'VALUES (%s, %s, %s)',
-                           (name, start, increment))
-        except DatabaseError:
+        cursor = self.get_cursor()
+        cursor.execute('INSERT INTO sequence_sequence '
+                       '("name", "start", "increment") '
+                       'VALUES (%s, %s, %s) '
+                       'ON CONFLICT ("name") DO NOTHING '
+                       'RETURNING "name"',
+                       (name, start, increment))
+        if cursor.fetchone() is None:
             raise SequenceError('sequence %r already exists' % name)
 
     @savepoint
@@ -49,7 +151,7 @@ class Sequence(BaseSequence):
         Drop the sequence with identifier "name" if it exists
         '''
         self.validate_name(name)
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
         cursor.execute('DELETE FROM sequence_sequence WHERE name = %s',
                        (name,))
         if cursor.rowcount == 0:
@@ -61,9 +163,8 @@ class Sequence(BaseSequence):
         Return the current value of the sequence "name"
         '''
         self.validate_name(name)
-        cursor = connection.cursor()
-        cursor.execute('SELECT value FROM sequence_sequence WHERE name = %s',
-                       (name,))
+        cursor = self.get_cursor()
+        self.execute(cursor, 'currval', (name,))
         row = cursor.fetchone()
         if row is None:
             raise SequenceDoesNotExist('sequence %r does not exist' % name)
@@ -78,29 +179,36 @@ class Sequence(BaseSequence):
         Return the next value for the sequence "name"
         '''
         self.validate_name(name)
-        cursor = connection.cursor()
-        try:
-            cursor.execute(
-                'UPDATE sequence_sequence '
-                'SET value = COALESCE(value + increment, start) '
-                'WHERE name = %s '
-                'RETURNING value',
-                (name,))
-        except DatabaseError:
-            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+        cursor = self.get_cursor()
+        self.execute(cursor, 'nextval', (name,))
         row = cursor.fetchone()
         if row is None:
             raise SequenceDoesNotExist('sequence %r does not exist' % name)
         assert isinstance(row[0], int)
         return row[0]
 
+    @savepoint
+    def reserve(self, name, count):
+        '''
+        Reserve "count" values for the sequence "name" at once
+        '''
+        self.validate_name(name)
+        self.validate_count(count)
+        cursor = self.get_cursor()
+        self.execute(cursor, 'reserve', (count, count - 1, name))
+        row = cursor.fetchone()
+        if row is None:
+            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+        value, increment = row
+        return value - increment * (count - 1), increment
+
     @savepoint
     def setval(self, name, value):
         '''
         Set the value for sequence "name" to "value"
         '''
         self.validate_name(name)
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
         cursor.execute('UPDATE sequence_sequence SET value = %s '
                        'WHERE name = %s',
                        (value, name))
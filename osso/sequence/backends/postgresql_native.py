@@ -0,0 +1,158 @@
+# vim: set ts=8 sw=4 sts=4 et ai:
+from django.db import DatabaseError
+
+from osso.sequence.backends import (
+    NATIVE_MAX_NAME_LENGTH, NATIVE_PREFIX, NATIVE_RESERVE_ATTEMPTS,
+    SequenceDoesNotExist, SequenceError, is_contiguous)
+from osso.sequence.backends.postgresql import (
+    Sequence as TableSequence, savepoint)
+
+
+class Sequence(TableSequence):
+    """
+    PostgreSQL native Sequence class
+
+    Every sequence is a CREATE SEQUENCE object named "_sq<name>".
+    nextval() on those takes no row locks and is not rolled back with
+    the transaction: concurrent transactions never wait on each other,
+    but a rollback leaves a gap.
+
+    Unlike the table engine, a missing sequence in nextval() is
+    detected by a database error, so disabling the savepoints aborts
+    the current transaction on a missing sequence.
+    """
+    def __init__(self, savepoints=None):
+        super().__init__(savepoints=savepoints, prepared=False)
+
+    def get_native_name(self, name):
+        '''
+        Return the quoted native sequence name for "name"
+        '''
+        self.validate_name(name)
+        if len(name) > NATIVE_MAX_NAME_LENGTH:
+            raise SequenceError('sequence name %r is too long' % name)
+        # Names are valid identifiers but have to be quoted to
+        # preserve case.
+        return '"%s%s"' % (NATIVE_PREFIX, name)
+
+    def exists(self, cursor, native_name):
+        cursor.execute('SELECT to_regclass(%s)', (native_name,))
+        return cursor.fetchone()[0] is not None
+
+    @savepoint
+    def create(self, name, start=1, increment=1):
+        '''
+        Create a sequence with identifier "name"
+        '''
+        native_name = self.get_native_name(name)
+        cursor = self.get_cursor()
+        if self.exists(cursor, native_name):
+            raise SequenceError('sequence %r already exists' % name)
+        cursor.execute(
+            'CREATE SEQUENCE %s INCREMENT %d START %d '
+            'MINVALUE -9223372036854775807 MAXVALUE 9223372036854775806' %
+            (native_name, increment, start))
+
+    @savepoint
+    def drop(self, name):
+        '''
+        Drop the sequence with identifier "name" if it exists
+        '''
+        native_name = self.get_native_name(name)
+        cursor = self.get_cursor()
+        if not self.exists(cursor, native_name):
+            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+        cursor.execute('DROP SEQUENCE %s' % (native_name,))
+
+    @savepoint
+    def currval(self, name):
+        '''
+        Return the current value of the sequence "name"
+        '''
+        self.get_native_name(name)
+        cursor = self.get_cursor()
+        cursor.execute('SELECT last_value FROM pg_sequences '
+                       'WHERE schemaname = current_schema() '
+                       'AND sequencename = %s',
+                       (NATIVE_PREFIX + name,))
+        row = cursor.fetchone()
+        if row is None:
+            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+        if row[0] is None:
+            raise SequenceError('sequence %r has no value' % name)
+        return row[0]
+
+    @savepoint
+    def nextval(self, name):
+        '''
+        Return the next value for the sequence "name"
+        '''
+        native_name = self.get_native_name(name)
+        cursor = self.get_cursor()
+        try:
+            cursor.execute('SELECT nextval(%s)', (native_name,))
+        except DatabaseError:
+            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+        return cursor.fetchone()[0]
+
+    @savepoint
+    def reserve(self, name, count):
+        '''
+        Reserve "count" values for the sequence "name" at once
+
+        A native sequence cannot hand out a range atomically. When
+        other sessions interleave, the fetched values are discarded
+        (leaving a gap) and we try again.
+        '''
+        native_name = self.get_native_name(name)
+        self.validate_count(count)
+        cursor = self.get_cursor()
+        cursor.execute('SELECT increment_by FROM pg_sequences '
+                       'WHERE schemaname = current_schema() '
+                       'AND sequencename = %s',
+                       (NATIVE_PREFIX + name,))
+        row = cursor.fetchone()
+        if row is None:
+            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+        increment = row[0]
+
+        for attempt in range(NATIVE_RESERVE_ATTEMPTS):
+            cursor.execute(
+                'SELECT nextval(%s) FROM generate_series(1, %s) AS i '
+                'ORDER BY i',
+                (native_name, count))
+            values = [row[0] for row in cursor.fetchall()]
+            if is_contiguous(values, increment):
+                return values[0], increment
+        raise SequenceError('could not reserve %d contiguous values for '
+                            'sequence %r' % (count, name))
+
+    @savepoint
+    def setval(self, name, value):
+        '''
+        Set the value for sequence "name" to "value"
+        '''
+        native_name = self.get_native_name(name)
+        cursor = self.get_cursor()
+        if not self.exists(cursor, native_name):
+            raise SequenceDoesNotExist('sequence %r does not exist' % name)
+        cursor.execute('SELECT setval(%s, %s)', (native_name, value))
+
+    def all(self):
+        '''
+        Return a list of (name, start, increment, value) tuples of all
+        sequences
+        '''
+        cursor = self.get_cursor()
+        cursor.execute('SELECT sequencename, start_value, increment_by, '
+                       '       last_value '
+                       'FROM pg_sequences '
+                       'WHERE schemaname = current_schema() '
+                       'AND left(sequencename, %s) = %s '
+                       'ORDER BY sequencename',
+                       (len(NATIVE_PREFIX), NATIVE_PREFIX))
+        return [(row[0][len(NATIVE_PREFIX):],) + tuple(row[1:])
+                for row in cursor.fetchall()]
+
+    def install(self, **kwargs):
+        pass
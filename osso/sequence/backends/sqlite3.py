@@ -1,11 +1,20 @@
 # vim: set ts=8 sw=4 sts=4 et ai:
+from contextlib import contextmanager
+from threading import Lock
+
 from django.db import connection
-from django.db.utils import DatabaseError, IntegrityError
+from django.db.utils import DatabaseError, IntegrityError, OperationalError
 
 from osso.sequence.backends import (BaseSequence, SequenceDoesNotExist,
                                     SequenceError)
 
 
+# Times BEGIN IMMEDIATE is retried after the busy timeout.
+BUSY_RETRIES = 10
+# Serializes the write transactions of the threads in this process.
+_write_lock = Lock()
+
+
 class Sequence(BaseSequence):
     """
     SQLite3 Sequence class
@@ -53,13 +62,49 @@ class Sequence(BaseSequence):
         """
         pass
 
+    @contextmanager
+    def write_transaction(self, cursor):
+        """
+        Run the block in a transaction that holds the write lock from
+        the start.
+
+        A plain (deferred) BEGIN takes a read lock on the first read
+        and upgrades it on the first write; two connections doing that
+        at once deadlock, and one fails with "database is locked".
+        BEGIN IMMEDIATE takes the write lock up front. SQLite does not
+        queue the waiters fairly, so the threads of this process take
+        turns through a lock, and BEGIN IMMEDIATE is retried when the
+        busy timeout runs out while other processes hold the lock.
+
+        Inside an outer transaction, the locks are up to that one.
+        """
+        if not connection.get_autocommit():
+            yield
+            return
+
+        with _write_lock:
+            for attempt in range(BUSY_RETRIES, -1, -1):
+                try:
+                    cursor.execute('BEGIN IMMEDIATE')
+                except OperationalError:
+                    if not attempt:
+                        raise
+                else:
+                    break
+            try:
+                yield
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
     def create(self, name, start=1, increment=1):
         """
         Create a sequence with identifier ``name``.
         """
         self.validate_name(name)
 
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
         self.lock(cursor)
         try:
             cursor.execute('INSERT INTO sequence_sequence '
@@ -77,7 +122,7 @@ class Sequence(BaseSequence):
         """
         self.validate_name(name)
 
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
         self.lock(cursor)
         try:
             cursor2 = cursor.execute('DELETE FROM sequence_sequence '
@@ -96,7 +141,7 @@ class Sequence(BaseSequence):
         """
         self.validate_name(name)
 
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
         self.lock(cursor)
         try:
             cursor.execute('SELECT value FROM sequence_sequence '
@@ -120,24 +165,31 @@ class Sequence(BaseSequence):
         """
         self.validate_name(name)
 
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
         self.lock(cursor)
         try:
-            cursor2 = cursor.execute('UPDATE sequence_sequence '
-                                     'SET value = value + increment '
-                                     'WHERE name = %s AND value IS NOT NULL',
-                                     (name,))
+            # The UPDATE and SELECT must be in one transaction, or
+            # another connection can update the value in between.
+            # (Raise outside of it, so we don't break an outer atomic.)
+            with self.write_transaction(cursor):
+                cursor2 = cursor.execute(
+                    'UPDATE sequence_sequence '
+                    'SET value = value + increment '
+                    'WHERE name = %s AND value IS NOT NULL',
+                    (name,))
+
+                if cursor2.rowcount == 0:
+                    cursor2 = cursor.execute(
+                        'UPDATE sequence_sequence '
+                        'SET value = start '
+                        'WHERE name = %s AND value IS NULL',
+                        (name,))
+
+                cursor.execute('SELECT value FROM sequence_sequence '
+                               'WHERE name = %s',
+                               (name,))
+                row = cursor.fetchone()
 
-            if cursor2.rowcount == 0:
-                cursor2 = cursor.execute('UPDATE sequence_sequence '
-                                         'SET value = start '
-                                         'WHERE name = %s AND value IS NULL',
-                                         (name,))
-
-            cursor.execute('SELECT value FROM sequence_sequence '
-                           'WHERE name = %s',
-                           (name,))
-            row = cursor.fetchone()
             if row is None:
                 raise SequenceDoesNotExist('sequence %r does not exist' % name)
 
@@ -148,13 +200,46 @@ class Sequence(BaseSequence):
 
         return value
 
+    def reserve(self, name, count):
+        """
+        Reserve ``count`` values for the sequence ``name`` at once.
+        """
+        self.validate_name(name)
+        self.validate_count(count)
+
+        cursor = self.get_cursor()
+        self.lock(cursor)
+        try:
+            # See nextval() on why this needs a transaction.
+            with self.write_transaction(cursor):
+                cursor.execute('UPDATE sequence_sequence '
+                               'SET value = COALESCE(value + increment * %s, '
+                               'start + increment * %s) '
+                               'WHERE name = %s',
+                               (count, count - 1, name))
+
+                cursor.execute('SELECT value, increment '
+                               'FROM sequence_sequence '
+                               'WHERE name = %s',
+                               (name,))
+                row = cursor.fetchone()
+
+            if row is None:
+                raise SequenceDoesNotExist('sequence %r does not exist' % name)
+
+            value, increment = row
+        finally:
+            self.unlock(cursor)
+
+        return value - increment * (count - 1), increment
+
     def setval(self, name, value):
         """
         Set the value for sequence ``name`` to ``value``.
         """
         self.validate_name(name)
 
-        cursor = connection.cursor()
+        cursor = self.get_cursor()
         self.lock(cursor)
         try:
             cursor2 = cursor.executemany('UPDATE sequence_sequence '
@@ -0,0 +1,123 @@
+# vim: set ts=8 sw=4 sts=4 et ai:
+from threading import Lock
+
+from django.db import transaction
+
+from osso.sequence.backends import BaseSequence
+
+
+class BlockSequence(BaseSequence):
+    '''
+    Sequence wrapper that reserves values in blocks ("hi/lo").
+
+    For every sequence listed in `block_sizes`, nextval() reserves a
+    block of that many values with a single UPDATE on the sequence
+    table and hands them out from process memory, under a thread lock.
+    Sequences that are not listed are passed straight to the backend.
+
+    Enable it through the settings::
+
+        SEQUENCE_BLOCK_SIZES = {'cdr': 1000, 'invoice': 20}
+
+    Gap policy:
+
+    - Values are unique, but not gapless: values left in a block when
+      the process exits, or when setval() or drop() is called, are
+      never handed out.
+    - Values are only increasing per process. Concurrent processes
+      each hand out values from their own block, so their values
+      interleave.
+    - A block is only reserved outside of transactions, because a
+      rollback would otherwise return the block to the database while
+      we still hand out its values. Inside an atomic() block the
+      remainder of the current block is used, after which nextval()
+      falls back to a regular (row-locking) backend call.
+    - currval() returns the last value handed out by this process, or
+      the database value if this process has not handed out any. The
+      database value is the end of the most recently reserved block.
+    - setval() and drop() only discard the blocks of this process.
+      Other processes keep handing out their remaining values.
+    '''
+    def __init__(self, backend, block_sizes):
+        super().__init__()
+        self.backend = backend
+        self.block_sizes = dict(block_sizes)
+        self._lock = Lock()
+        self._blocks = {}  # name => [next_value, remaining, increment]
+        self._last = {}  # name => last value handed out
+
+    def _discard(self, name):
+        with self._lock:
+            self._blocks.pop(name, None)
+            self._last.pop(name, None)
+
+    def create(self, name, start=1, increment=1):
+        '''
+        Create a sequence with identifier `name`
+        '''
+        self.backend.create(name, start=start, increment=increment)
+
+    def drop(self, name):
+        '''
+        Drop the sequence with identifier `name` and discard its block
+        '''
+        self._discard(name)
+        self.backend.drop(name)
+
+    def currval(self, name):
+        '''
+        Return the last value handed out by this process for `name`
+        '''
+        with self._lock:
+            if name in self._last:
+                return self._last[name]
+        return self.backend.currval(name)
+
+    def nextval(self, name):
+        '''
+        Return the next value for the sequence `name`
+        '''
+        block_size = self.block_sizes.get(name, 1)
+        if block_size <= 1:
+            return self.backend.nextval(name)
+
+        with self._lock:
+            block = self._blocks.get(name)
+            if not block or not block[1]:
+                if not transaction.get_autocommit():
+                    value = self.backend.nextval(name)
+                    self._last[name] = value
+                    return value
+                first, increment = self.backend.reserve(name, block_size)
+                block = self._blocks[name] = [first, block_size, increment]
+
+            value = block[0]
+            block[0] += block[2]
+            block[1] -= 1
+            self._last[name] = value
+            return value
+
+    def reserve(self, name, count):
+        '''
+        Reserve `count` values for the sequence `name` at once
+        '''
+        return self.backend.reserve(name, count)
+
+    def setval(self, name, value):
+        '''
+        Set the value for sequence `name` and discard its block
+        '''
+        self._discard(name)
+        self.backend.setval(name, value)
+
+    def all(self):
+        return self.backend.all()
+
+    def install(self, **kwargs):
+        self.backend.install(**kwargs)
+
+    def validate_name(self, name):
+        self.backend.validate_name(name)
+
+    def has_savepoint_issues(self):
+        return self.backend.has_savepoint_issues()
@@ -0,0 +1,57 @@
+# vim: set ts=8 sw=4 sts=4 et ai tw=79:
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from osso.sequence.apps import SequenceAppConfig
+from osso.sequence.backends import SequenceError
+
+
+class Command(BaseCommand):
+    help = '''
+    Move all sequences from one sequence engine to the other.
+
+    Run this when changing the SEQUENCE_ENGINE setting, e.g.:
+
+        ./manage.py sequenceengine table native
+
+    The sequences keep their start, increment and current value. Stop
+    everything that allocates sequence values while this runs.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'source', choices=SequenceAppConfig.ENGINES,
+            help='Engine to move the sequences from')
+        parser.add_argument(
+            'target', choices=SequenceAppConfig.ENGINES,
+            help='Engine to move the sequences to')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['source'] == kwargs['target']:
+            raise CommandError('source and target engine are the same')
+
+        app_config = apps.get_app_config('sequence')
+        try:
+            source = app_config.get_engine_backend(kwargs['source'])
+            target = app_config.get_engine_backend(kwargs['target'])
+        except SequenceError as e:
+            raise CommandError(str(e))
+        if source is None or target is None:
+            raise CommandError('no database configured')
+
+        verbosity = int(kwargs.get('verbosity', 1))
+        moved = 0
+        with transaction.atomic():
+            for name, start, increment, value in source.all():
+                target.create(name, start=start, increment=increment)
+                if value is not None:
+                    target.setval(name, value)
+                source.drop(name)
+                moved += 1
+                if verbosity > 1:
+                    self.stdout.write('moved %s (value %s)' % (name, value))
+
+        if verbosity > 0:
+            self.stdout.write('moved %d sequence(s) from %s to %s' % (
+                moved, kwargs['source'], kwargs['target']))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# vim: set ts=8 sw=4 sts=4 et ai:
+"""
+Benchmark cidr4.collapse() against ipaddress.collapse_addresses().
+
+Generates random (overlapping and adjacent) IPv4 networks, collapses
+them with both, checks that the results are the same and reports the
+times. Example::
+
+    python tests/bench_cidr.py --count 200000 --min-sigbits 16
+
+The exit status is 1 if the results differ.
+"""
+import argparse
+import ipaddress
+import os
+import random
+import sys
+import time
+
+
+def setup():
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path[0:0] = [os.path.dirname(tests_dir)]
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    # Cluster the networks in a /8, so many of them touch or overlap.
+    networks = []
+    for i in range(args.count):
+        sigbits = rng.randint(args.min_sigbits, 32)
+        address = (10 << 24 | rng.getrandbits(24)) >> (32 - sigbits) << (
+            32 - sigbits)
+        networks.append((address, sigbits))
+    return networks
+
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    ret = func(*args)
+    return ret, time.perf_counter() - t0
+
+
+def run(args):
+    from osso.core.cidr4 import cidr4
+
+    networks = generate(args)
+    ours = [cidr4.from_int(address, sigbits) for address, sigbits in networks]
+    theirs = [ipaddress.IPv4Network((address, sigbits))
+              for address, sigbits in networks]
+
+    ours, our_time = timed(cidr4.collapse, ours)
+    theirs, their_time = timed(
+        lambda nets: list(ipaddress.collapse_addresses(nets)), theirs)
+    same = [(i.address, i.sigbits) for i in ours] == [
+        (int(i.network_address), i.prefixlen) for i in theirs]
+
+    print('networks   : %d (/%d to /32)' % (args.count, args.min_sigbits))
+    print('collapsed  : %d' % (len(ours),))
+    print('cidr4      : %.3f s' % (our_time,))
+    print('ipaddress  : %.3f s (%.1fx)' % (
+        their_time, their_time / our_time))
+    print('same       : %s' % ('yes' if same else 'NO',))
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark cidr4.collapse() against ipaddress.')
+    parser.add_argument(
+        '--count', type=int, default=100000,
+        help='number of networks (default: 100000)')
+    parser.add_argument(
+        '--min-sigbits', type=int, default=20,
+        help='largest network size to generate (default: 20)')
+    parser.add_argument(
+        '--seed', type=int, default=1,
+        help='random seed (default: 1)')
+    args = parser.parse_args()
+
+    setup()
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# vim: set ts=8 sw=4 sts=4 et ai:
+"""
+Concurrency stress benchmark for the osso.sequence backends.
+
+Runs N threads or processes that all call nextval() on one sequence,
+then reports throughput, p50/p99 latency and checks the values for
+duplicates and gaps. Examples::
+
+    # SQLite file database, 8 threads.
+    python tests/bench_sequence.py --workers 8
+
+    # Local PostgreSQL (see testapp/settings_postgres.py), 8 processes,
+    # with a block cache of 100 values.
+    python tests/bench_sequence.py --database postgres --processes \\
+        --workers 8 --block-size 100
+
+A test database is created (and destroyed) for the run, like the test
+runner does. The exit status is 1 if any value was handed out twice, or if any
+nextval() call failed.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
+
+SETTINGS = {
+    'sqlite': 'testapp.settings',
+    'postgres': 'testapp.settings_postgres',
+    'mysql': 'testapp.settings_mysql',
+}
+SEQUENCE_NAME = 'bench'
+
+
+def setup(args):
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path[0:0] = [os.path.dirname(tests_dir), tests_dir]
+    os.environ['DJANGO_SETTINGS_MODULE'] = SETTINGS[args.database]
+
+    import django
+    from django.conf import settings
+
+    # The in-memory SQLite database cannot be shared; use a file.
+    if args.database == 'sqlite':
+        settings.DATABASES['default']['TEST'] = {
+            'NAME': os.path.join(args.tmpdir, 'bench.sqlite3')}
+    settings.DEBUG = False  # don't keep all queries in memory
+    settings.SEQUENCE_ENGINE = args.engine
+    if args.block_size > 1:
+        settings.SEQUENCE_BLOCK_SIZES = {SEQUENCE_NAME: args.block_size}
+    django.setup()
+
+
+def get_sequence():
+    from django.apps import apps
+    return apps.get_app_config('sequence').get_backend()
+
+
+def worker(args):
+    """
+    Call nextval() count times; return the values, the latencies and
+    the errors (as strings), so one failing call does not end the run.
+    """
+    count, atomic, sequence = args
+    from django.db import connection, transaction
+
+    if sequence is None:
+        sequence = get_sequence()
+    values, latencies, errors = [], [], []
+    try:
+        for i in range(count):
+            t0 = time.perf_counter()
+            try:
+                if atomic:
+                    with transaction.atomic():
+                        value = sequence.nextval(SEQUENCE_NAME)
+                else:
+                    value = sequence.nextval(SEQUENCE_NAME)
+            except Exception as e:
+                errors.append('%s: %s' % (type(e).__name__, e))
+                continue
+            latencies.append(time.perf_counter() - t0)
+            values.append(value)
+    finally:
+        connection.close()
+    return values, latencies, errors
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[int(round(fraction * (len(sorted_values) - 1)))]
+
+
+def run(args):
+    from django.db import connection, connections
+
+    creation = connection.creation
+    old_name = creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        sequence = get_sequence()
+        sequence.create(SEQUENCE_NAME)
+        # Forked processes must not share our connection.
+        connections.close_all()
+
+        if args.processes:
+            # Every process gets its own sequence (and block cache).
+            jobs = [(args.count, args.atomic, None)] * args.workers
+            pool = get_context('fork').Pool(args.workers)
+            t0 = time.perf_counter()
+            results = pool.map(worker, jobs)
+            elapsed = time.perf_counter() - t0
+            pool.close()
+            pool.join()
+        else:
+            # All threads share the sequence (and block cache).
+            jobs = [(args.count, args.atomic, sequence)] * args.workers
+            with ThreadPoolExecutor(args.workers) as pool:
+                t0 = time.perf_counter()
+                results = list(pool.map(worker, jobs))
+                elapsed = time.perf_counter() - t0
+    finally:
+        connections.close_all()
+        creation.destroy_test_db(old_name, verbosity=0)
+
+    values = [value for result in results for value in result[0]]
+    latencies = sorted(
+        latency for result in results for latency in result[1])
+    errors = [error for result in results for error in result[2]]
+    unique = set(values)
+    duplicates = len(values) - len(unique)
+    skipped = unique and (max(unique) - min(unique) + 1) - len(unique)
+
+    print('database   : %s (%s engine, block size %d)' % (
+        args.database, args.engine, args.block_size))
+    print('workers    : %d %s x %d nextval()%s' % (
+        args.workers, ('threads', 'processes')[args.processes], args.count,
+        ('', ' in atomic()')[args.atomic]))
+    print('throughput : %.0f values/s' % (len(values) / elapsed,))
+    if latencies:
+        print('latency    : p50 %.3f ms, p99 %.3f ms, max %.3f ms' % (
+            percentile(latencies, 0.50) * 1000,
+            percentile(latencies, 0.99) * 1000, latencies[-1] * 1000))
+    print('duplicates : %d' % (duplicates,))
+    print('skipped    : %d' % (skipped,))
+    print('errors     : %d' % (len(errors),))
+    for error in sorted(set(errors))[:5]:
+        print('             %s (%dx)' % (error, errors.count(error)))
+    return duplicates == 0 and not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Stress test the osso.sequence nextval().')
+    parser.add_argument(
+        '--database', choices=sorted(SETTINGS), default='sqlite',
+        help='database to test against (default: sqlite)')
+    parser.add_argument(
+        '--engine', choices=('table', 'native', 'memory'), default='table',
+        help='sequence engine (default: table)')
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help='number of concurrent workers (default: 4)')
+    parser.add_argument(
+        '--processes', action='store_true',
+        help='use processes instead of threads')
+    parser.add_argument(
+        '--count', type=int, default=1000,
+        help='nextval() calls per worker (default: 1000)')
+    parser.add_argument(
+        '--block-size', type=int, default=1,
+        help='SEQUENCE_BLOCK_SIZES value for the sequence (default: 1)')
+    parser.add_argument(
+        '--atomic', action='store_true',
+        help='wrap every nextval() in transaction.atomic()')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        args.tmpdir = tmpdir
+        setup(args)
+        ok = run(args)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
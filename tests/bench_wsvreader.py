@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# vim: set ts=8 sw=4 sts=4 et ai:
+"""
+Benchmark WsvReader on a large generated file.
+
+Writes a WSV file with a mix of plain and quoted values to a temporary
+directory, reads it with WsvReader, with the old search-per-column
+tokenizer and with MmapWsvReader, checks that the rows are the same and
+reports the times.
+Example::
+
+    python tests/bench_wsvreader.py --lines 3000000
+
+The exit status is 1 if the results differ.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+
+def setup():
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path[0:0] = [os.path.dirname(tests_dir)]
+
+
+def generate(args, file):
+    rng = random.Random(args.seed)
+    file.write('# generated by bench_wsvreader\n')
+    file.write('id network description owner status\n')
+    for i in range(args.lines):
+        if rng.random() < args.quoted:
+            description = '"customer %d ""%s"""' % (
+                rng.getrandbits(16), rng.choice(('gold', 'silver')))
+        else:
+            description = 'customer%d' % (rng.getrandbits(16),)
+        file.write('%d\t10.%d.%d.0/24  %s %s\t%s\n' % (
+            i, rng.getrandbits(8), rng.getrandbits(8), description,
+            rng.choice(('alice', 'bob', '""')),
+            rng.choice(('active', 'reserved'))))
+
+
+def legacy_split_line(line, findre=re.compile(r'\s([^"\s]*|"([^"]|"")*")\s')):
+    # The tokenizer that WsvReader used before: a search per column on
+    # a line padded with sentinel spaces.
+    line = ' ' + line + ' '
+    columns = []
+    pos = 0
+    while True:
+        match = findre.search(line, pos=pos)
+        if not match:
+            break
+        value = match.groups()[0]
+        if value:
+            if value[0] == '"':
+                value = value[1:-1].replace('""', '"')
+            columns.append(value)
+        pos = match.end() - 1
+    return columns
+
+
+def timed(func, *args, **kwargs):
+    t0 = time.perf_counter()
+    ret = func(*args, **kwargs)
+    return ret, time.perf_counter() - t0
+
+
+def read_all(reader_class, path, **kwargs):
+    with open(path) as file:
+        return list(reader_class(file, **kwargs))
+
+
+def run(args):
+    from osso.core.wsvreader import MmapWsvReader, WsvReader
+
+    class LegacyWsvReader(WsvReader):
+        def split_line(self, line):
+            return legacy_split_line(line)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bench.wsv')
+        with open(path, 'w') as file:
+            generate(args, file)
+        size = os.path.getsize(path)
+
+        ours, our_time = timed(read_all, WsvReader, path)
+        if args.skip_legacy:
+            theirs, their_time = ours, None
+        else:
+            theirs, their_time = timed(read_all, LegacyWsvReader, path)
+        row_times = [
+            (row, timed(read_all, WsvReader, path, row=row)[1])
+            for row in args.row]
+        mmap_times = []
+        for processes in [None] + args.processes:
+            rows, mmap_time = timed(
+                lambda: list(MmapWsvReader(path, processes=processes)))
+            theirs = theirs if rows == ours else None
+            mmap_times.append((processes or 1, mmap_time))
+    same = ours == theirs
+
+    print('lines      : %d (%.1f MiB, %d%% quoted)' % (
+        args.lines, size / 1048576.0, args.quoted * 100))
+    print('WsvReader  : %.3f s' % (our_time,))
+    if their_time is not None:
+        print('legacy     : %.3f s (%.1fx)' % (
+            their_time, their_time / our_time))
+        print('same       : %s' % ('yes' if same else 'NO',))
+    for row, row_time in row_times:
+        print('%-10s : %.3f s' % ('row=' + row, row_time))
+    for processes, mmap_time in mmap_times:
+        print('mmap x%-4d : %.3f s' % (processes, mmap_time))
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark WsvReader on a large generated file.')
+    parser.add_argument(
+        '--lines', type=int, default=2000000,
+        help='number of data lines (default: 2000000)')
+    parser.add_argument(
+        '--quoted', type=float, default=0.2,
+        help='fraction of lines with quoted values (default: 0.2)')
+    parser.add_argument(
+        '--skip-legacy', action='store_true',
+        help='only time the current tokenizer')
+    parser.add_argument(
+        '--row', action='append', default=[],
+        choices=('tuple', 'namedtuple'),
+        help='also time this row mode (may be repeated)')
+    parser.add_argument(
+        '--processes', type=int, action='append', default=[],
+        help='also time MmapWsvReader with this many processes '
+             '(may be repeated)')
+    parser.add_argument(
+        '--seed', type=int, default=1,
+        help='random seed (default: 1)')
+    args = parser.parse_args()
+
+    setup()
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,29 @@
-from django.test import TestCase
+import os
+import tempfile
+import time
+from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import Mock, patch
 
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+
+from osso.aboutconfig import utils
+from osso.aboutconfig import models
 from osso.aboutconfig.models import Item
-from osso.aboutconfig.utils import aboutconfig
+from osso.aboutconfig.notify import FileNotifier, PostgresNotifier
+from osso.aboutconfig.utils import (
+    ConfigError, aboutconfig, aboutconfig_many, aboutconfig_prefix)
+from osso.core.cidr4 import cidr4
+
 
+class AboutConfigTestCase(TransactionTestCase):
+    def setUp(self):
+        # The snapshot survives the flush after a previous test.
+        utils._snapshot.clear()
 
-class AboutConfigTestCase(TestCase):
     def test_aboutconfig(self):
         item = Item.objects.create(
             key='a.b.c.d.e', value=' \n \r somevalue with \n spaces \t ')
@@ -27,3 +46,240 @@ class AboutConfigTestCase(TestCase):
         assert aboutconfig('key', 'val', set=True) is None
         assert aboutconfig('key', 'not val', set=True) is None
         assert aboutconfig('key', 'val') == 'not val'
+
+    def test_aboutconfig_snapshot(self):
+        Item.objects.create(key='a.b', value='1')
+        Item.objects.create(key='a.c', value='2')
+        with self.assertNumQueries(1):
+            self.assertEqual(aboutconfig('a.b'), '1')
+            self.assertEqual(aboutconfig('a.c'), '2')
+            self.assertEqual(aboutconfig('a.d'), '')
+
+        # Saves and deletes in this process are seen right away.
+        Item.objects.filter(key='a.b').get().delete()
+        self.assertEqual(aboutconfig('a.b'), '')
+        Item.objects.create(key='a.b', value='3')
+        self.assertEqual(aboutconfig('a.b'), '3')
+
+    def test_aboutconfig_rollback(self):
+        Item.objects.create(key='a.b', value='1')
+        self.assertEqual(aboutconfig('a.b'), '1')
+        try:
+            with transaction.atomic():
+                Item.objects.filter(key='a.b').get().delete()
+                Item.objects.create(key='a.b', value='2')
+                self.assertEqual(aboutconfig('a.b'), '2')
+                raise ZeroDivisionError
+        except ZeroDivisionError:
+            pass
+        # The uncommitted value was not kept in the snapshot.
+        self.assertEqual(aboutconfig('a.b'), '1')
+        with self.assertNumQueries(0):
+            self.assertEqual(aboutconfig('a.b'), '1')
+
+    def test_aboutconfig_version(self):
+        Item.objects.create(key='a.b', value='1')
+        self.assertEqual(aboutconfig('a.b'), '1')
+
+        # Another process changes the item (no signal here).
+        Item.objects.filter(key='a.b').update(value='2')
+        with patch.object(utils, 'VERSION_CHECK_TIME', 0):
+            with self.assertNumQueries(0):
+                self.assertEqual(aboutconfig('a.b'), '1')
+            # And bumps the version.
+            cache.set(utils.VERSION_CACHE_KEY, 'other')
+            with self.assertNumQueries(1):
+                self.assertEqual(aboutconfig('a.b'), '2')
+
+    def test_aboutconfig_commit_bumps_version(self):
+        aboutconfig('a.b')
+        version = cache.get(utils.VERSION_CACHE_KEY)
+        with transaction.atomic():
+            Item.objects.create(key='a.b', value='1')
+        self.assertNotEqual(cache.get(utils.VERSION_CACHE_KEY), version)
+
+    def test_aboutconfig_file_notifier(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'changed')
+            with override_settings(ABOUTCONFIG_NOTIFIER={
+                    'BACKEND': 'osso.aboutconfig.notify.FileNotifier',
+                    'OPTIONS': {'path': path}}):
+                Item.objects.create(key='a.b', value='1')
+                self.assertEqual(aboutconfig('a.b'), '1')
+
+                # Another process changes the item (no signal here).
+                Item.objects.filter(key='a.b').update(value='2')
+                with self.assertNumQueries(0):
+                    self.assertEqual(aboutconfig('a.b'), '1')
+                # And notifies us; the version is not checked.
+                FileNotifier(path).notify()
+                with self.assertNumQueries(1):
+                    self.assertEqual(aboutconfig('a.b'), '2')
+                    self.assertEqual(aboutconfig('a.b'), '2')
+
+                # Our own commits notify too.
+                with transaction.atomic():
+                    Item.objects.create(key='a.c', value='3')
+                self.assertTrue(os.path.exists(path))
+                Item.objects.filter(key='a.c').update(value='4')
+                FileNotifier(path).notify()
+                self.assertEqual(aboutconfig('a.c'), '4')
+
+    def test_aboutconfig_file_notifier_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'changed')
+            notifier = FileNotifier(path)
+            with ThreadPoolExecutor(8) as executor:
+                for future in [executor.submit(notifier.notify)
+                               for i in range(200)]:
+                    future.result()
+            self.assertEqual(os.listdir(tmpdir), ['changed'])
+
+    def test_aboutconfig_notifier_error(self):
+        Item.objects.create(key='a.b', value='1')
+        self.assertEqual(aboutconfig('a.b'), '1')
+        notifier = Mock(spec=['notify', 'changed'])
+        notifier.notify.side_effect = OSError('disk full')
+        notifier.changed.return_value = False
+        with patch.object(utils, '_get_notifier', return_value=notifier):
+            # The commit succeeds and the snapshot is dropped anyway.
+            with self.assertLogs('osso.aboutconfig.utils', 'ERROR'):
+                with transaction.atomic():
+                    Item.objects.filter(key='a.b').update(value='2')
+                    Item.objects.create(key='a.c', value='3')
+            self.assertEqual(aboutconfig('a.b'), '2')
+        notifier.notify.assert_called_once_with()
+
+    def test_aboutconfig_postgres_notifier_error(self):
+        notifier = PostgresNotifier()
+        listener = Mock(spec=['poll', 'close', 'notifies'])
+        listener.poll.side_effect = Exception('server closed the connection')
+        notifier._listener, notifier._pid = listener, os.getpid()
+
+        # A broken listener counts as a change and is closed, not leaked.
+        self.assertTrue(notifier.changed())
+        listener.close.assert_called_once_with()
+        self.assertIsNone(notifier._listener)
+
+        # The listener of a parent process is left alone.
+        notifier._listener, notifier._pid = listener, os.getpid() + 1
+        with patch.object(notifier, '_get_listener', side_effect=Exception):
+            self.assertTrue(notifier.changed())
+        listener.close.assert_called_once_with()
+        self.assertIsNone(notifier._listener)
+
+    def test_aboutconfig_many(self):
+        Item.objects.create(key='a.b', value='1')
+        Item.objects.create(key='a.c', value='2')
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                aboutconfig_many(['a.c', 'a.b', 'a.d', 'a.e'], {'a.d': 4}),
+                {'a.c': '2', 'a.b': '1', 'a.d': '4', 'a.e': ''})
+            self.assertEqual(aboutconfig_many([]), {})
+
+    def test_aboutconfig_prefix(self):
+        Item.objects.create(key='asterisk.management.username', value='u')
+        Item.objects.create(key='asterisk.management.password', value='p')
+        Item.objects.create(key='asterisk.other', value='o')
+        with self.assertNumQueries(1):
+            self.assertEqual(aboutconfig_prefix('asterisk.management.'), {
+                'asterisk.management.password': 'p',
+                'asterisk.management.username': 'u'})
+            self.assertEqual(aboutconfig_prefix('sip.'), {})
+
+    def test_aboutconfig_missing(self):
+        aboutconfig('a.b')
+        with self.assertNumQueries(0):
+            for i in range(10):
+                self.assertEqual(aboutconfig('a.b', 'default'), 'default')
+
+        # Creation is seen right away, by this process, and the other
+        # processes get a new version.
+        version = cache.get(utils.VERSION_CACHE_KEY)
+        with transaction.atomic():
+            aboutconfig('a.b', 'value', set=True)
+        self.assertNotEqual(cache.get(utils.VERSION_CACHE_KEY), version)
+        self.assertEqual(aboutconfig('a.b', 'default'), 'value')
+
+    def test_aboutconfig_typed(self):
+        for key, datatype_id, value in (
+                ('int', models.DATATYPE_INTEGER, ' 42 '),
+                ('decimal', models.DATATYPE_DECIMAL, '1.50'),
+                ('bool', models.DATATYPE_BOOLEAN, 'off'),
+                ('json', models.DATATYPE_JSON, '{"a": [1, 2]}'),
+                ('nets', models.DATATYPE_CIDR4_LIST, '10.0.0.0/8,1.2.3.4')):
+            Item.objects.create(key=key, datatype_id=datatype_id, value=value)
+
+        self.assertEqual(aboutconfig('int'), 42)
+        self.assertEqual(aboutconfig('decimal'), Decimal('1.50'))
+        self.assertIs(aboutconfig('bool'), False)
+        self.assertEqual(aboutconfig('json'), {'a': [1, 2]})
+        self.assertEqual(
+            aboutconfig('nets'), [cidr4('10.0.0.0/8'), cidr4('1.2.3.4')])
+        # Parsed once.
+        self.assertIs(aboutconfig('json'), aboutconfig('json'))
+
+    def test_aboutconfig_typed_default(self):
+        # The default is a string, also where the Item would be typed.
+        self.assertEqual(aboutconfig('int', 5), '5')
+        self.assertEqual(aboutconfig_many(['int'], {'int': 5}), {'int': '5'})
+        Item.objects.create(
+            key='int', datatype_id=models.DATATYPE_INTEGER, value='5')
+        self.assertEqual(aboutconfig('int', 5), 5)
+
+    def test_aboutconfig_typed_invalid(self):
+        for datatype_id, value in (
+                (models.DATATYPE_INTEGER, '4.2'),
+                (models.DATATYPE_DECIMAL, 'abc'),
+                (models.DATATYPE_BOOLEAN, 'maybe'),
+                (models.DATATYPE_JSON, '{'),
+                (models.DATATYPE_CIDR4_LIST, '10.0.0.1/8'),
+                (99, '')):
+            with self.assertRaises(ValidationError):
+                Item.objects.create(
+                    key='key', datatype_id=datatype_id, value=value)
+
+        Item.objects.create(
+            key='key', datatype_id=models.DATATYPE_INTEGER, value='1')
+        with self.assertRaises(ValidationError):
+            aboutconfig('key', 'one', set=True)
+        self.assertEqual(aboutconfig('key'), 1)
+
+        # Bypassing the validation: only the lookup of this key fails.
+        Item.objects.filter(key='key').update(value='one')
+        Item.objects.create(key='other', value='1')
+        self.assertRaises(ConfigError, aboutconfig, 'key')
+        self.assertEqual(aboutconfig('other'), '1')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'requires PostgreSQL')
+class PostgresNotifierTestCase(TransactionTestCase):
+    def setUp(self):
+        self.notifier = PostgresNotifier()
+        self.addCleanup(self.notifier._close_listener)
+
+    def wait_changed(self, timeout=5.0):
+        # The notification arrives asynchronously after the commit.
+        deadline = time.monotonic() + timeout
+        while not self.notifier.changed():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def test_listen_notify(self):
+        self.assertFalse(self.notifier.changed())  # starts listening
+        self.assertFalse(self.notifier.changed())
+
+        PostgresNotifier().notify()
+        self.assertTrue(self.wait_changed())
+        self.assertFalse(self.notifier.changed())
+
+        # Notifications are delivered on commit only.
+        with transaction.atomic():
+            PostgresNotifier().notify()
+            time.sleep(0.1)
+            self.assertFalse(self.notifier.changed())
+        self.assertTrue(self.wait_changed())
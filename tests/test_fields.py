@@ -0,0 +1,312 @@
+# vim: set ts=8 sw=4 sts=4 et ai:
+from django import forms
+from django.db import connection, models, transaction
+from django.db.models import F
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from osso.core.cidr4 import cidr4
+from osso.core.cidr6 import cidr6
+from osso.core.forms.fields import Cidr6Field as Cidr6FormField
+from osso.core.models.fields import Cidr4Field, Cidr6Field
+
+
+class StringAllocation(models.Model):
+    network = Cidr4Field(null=True)
+
+    class Meta:
+        app_label = 'core'
+
+
+class IntegerAllocation(models.Model):
+    network = Cidr4Field(storage='integer', null=True)
+
+    class Meta:
+        app_label = 'core'
+        indexes = [models.Index(fields=['network', 'network_last'])]
+
+
+class InetAllocation(models.Model):
+    network = Cidr4Field(storage='inet', null=True)
+
+    class Meta:
+        app_label = 'core'
+
+
+class Cidr6Allocation(models.Model):
+    network = Cidr6Field(null=True, blank=True)
+
+    class Meta:
+        app_label = 'core'
+
+
+class Cidr4FieldTestCase(TestCase):
+    models = (StringAllocation, IntegerAllocation, InetAllocation)
+    networks = ('0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24',
+                '10.1.2.3', '10.2.0.0/16', '192.168.0.0/16')
+
+    def setUp(self):
+        for model in self.models:
+            for network in self.networks:
+                model.objects.create(network=network)
+            model.objects.create(network=None)
+
+    def assertNetworks(self, queryset, expected):
+        self.assertEqual(
+            sorted(str(i.network) for i in queryset), sorted(expected))
+
+    def test_storage(self):
+        self.assertEqual(
+            StringAllocation.objects.values_list('network', flat=True).get(
+                network='10.1.0.0/16'), cidr4('10.1.0.0/16'))
+        obj = IntegerAllocation.objects.get(network='10.1.0.0/16')
+        self.assertEqual(obj.network, cidr4('10.1.0.0/16'))
+        self.assertEqual(obj.network_last, cidr4('10.1.255.255').address)
+        obj.network = '10.3.0.0/24'
+        obj.save()
+        obj = IntegerAllocation.objects.get(pk=obj.pk)
+        self.assertEqual(obj.network, cidr4('10.3.0.0/24'))
+        self.assertEqual(obj.network_last, cidr4('10.3.0.255').address)
+        self.assertIsNone(IntegerAllocation.objects.get(
+            network__isnull=True).network)
+
+    def test_storage_inet(self):
+        column_type = InetAllocation._meta.get_field('network').db_type(
+            connection)
+        if connection.vendor == 'postgresql':
+            self.assertEqual(column_type, 'cidr')
+        else:
+            self.assertEqual(column_type, 'varchar(18)')
+
+    def test_exact(self):
+        for model in self.models:
+            self.assertNetworks(
+                model.objects.filter(network='10.0.0.0/8'), ['10.0.0.0/8'])
+
+    def test_contains_ip(self):
+        for model in self.models:
+            self.assertNetworks(
+                model.objects.filter(network__contains_ip='10.1.2.3'),
+                ['0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24',
+                 '10.1.2.3'])
+            self.assertNetworks(
+                model.objects.filter(network__contains_ip='10.1.3.0/24'),
+                ['0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16'])
+
+    def test_within(self):
+        for model in self.models:
+            self.assertNetworks(
+                model.objects.filter(network__within='10.0.0.0/8'),
+                ['10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '10.1.2.3',
+                 '10.2.0.0/16'])
+            self.assertNetworks(
+                model.objects.filter(network__within='10.1.2.3'),
+                ['10.1.2.3'])
+
+    def test_in(self):
+        for model in self.models:
+            self.assertNetworks(
+                model.objects.filter(
+                    network__in=['10.1.0.0/16', '10.1.2.3', None]),
+                ['10.1.0.0/16', '10.1.2.3'])
+            self.assertNetworks(
+                model.objects.filter(network__in=['10.0.0.0/16']), [])
+            self.assertNetworks(model.objects.filter(network__in=[]), [])
+            self.assertNetworks(
+                model.objects.filter(network__in=model.objects.filter(
+                    network__within='10.1.0.0/16').values('network')),
+                ['10.1.0.0/16', '10.1.2.0/24', '10.1.2.3'])
+
+    def test_compare(self):
+        networks = sorted(cidr4(i) for i in self.networks)
+        for model in self.models:
+            for network in ('10.0.0.0/8', '10.1.0.0/24', '10.1.2.3'):
+                value = cidr4(network)
+                self.assertNetworks(
+                    model.objects.filter(network__gt=network),
+                    [str(i) for i in networks if i > value])
+                self.assertNetworks(
+                    model.objects.filter(network__gte=network),
+                    [str(i) for i in networks if i >= value])
+                self.assertNetworks(
+                    model.objects.filter(network__lt=network),
+                    [str(i) for i in networks if i < value])
+                self.assertNetworks(
+                    model.objects.filter(network__lte=network),
+                    [str(i) for i in networks if i <= value])
+            self.assertNetworks(
+                model.objects.filter(
+                    network__range=('10.0.0.0/16', '10.1.2.0/24')),
+                ['10.1.0.0/16', '10.1.2.0/24'])
+
+    def test_order_by(self):
+        networks = sorted(cidr4(i) for i in self.networks)
+        for model in self.models:
+            queryset = model.objects.exclude(network=None)
+            self.assertEqual(
+                [i.network for i in queryset.order_by('network')], networks)
+            self.assertEqual(
+                list(queryset.order_by('-network').values_list(
+                    'network', flat=True)), networks[::-1])
+        # Or on the columns, which the index can serve.
+        self.assertEqual(
+            [i.network for i in IntegerAllocation.objects.exclude(
+                network=None).order_by('network', '-network_last')],
+            networks)
+
+    def test_values(self):
+        for model in self.models:
+            self.assertEqual(
+                sorted(model.objects.filter(
+                    network__within='10.0.0.0/8').values_list(
+                        'network', flat=True)),
+                [cidr4('10.0.0.0/8'), cidr4('10.1.0.0/16'),
+                 cidr4('10.1.2.0/24'), cidr4('10.1.2.3'),
+                 cidr4('10.2.0.0/16')])
+            self.assertEqual(
+                model.objects.filter(network='10.1.0.0/16').values(
+                    'network').get(), {'network': cidr4('10.1.0.0/16')})
+
+    def test_prep_value(self):
+        for model in self.models:
+            self.assertEqual(
+                model._meta.get_field('network').get_prep_value('10.1.0.0/16'),
+                '010.001.000.000/16')
+
+    def test_compare_sql(self):
+        # The columns are compared, not a value computed from them.
+        for lookup in ('exact', 'in', 'gt', 'gte', 'lt', 'lte', 'range'):
+            value = '10.0.0.0/8'
+            if lookup in ('in', 'range'):
+                value = [value, '10.1.0.0/16']
+            with CaptureQueriesContext(connection) as queries:
+                list(IntegerAllocation.objects.filter(
+                    **{'network__' + lookup: value}).values_list('id'))
+            where = queries[0]['sql'].split(' WHERE ')[1]
+            self.assertNotIn('CASE', where)
+
+    def test_update(self):
+        IntegerAllocation.objects.filter(network='10.0.0.0/8').update(
+            network='10.0.0.0/16')
+        self.assertEqual(
+            IntegerAllocation.objects.get(network='10.0.0.0/16').network_last,
+            cidr4('10.0.255.255').address)
+        # The last address is left, but unused.
+        IntegerAllocation.objects.filter(network='10.0.0.0/16').update(
+            network=None)
+        self.assertEqual(
+            list(IntegerAllocation.objects.filter(network=None).values_list(
+                'network', flat=True)), [None, None])
+        self.assertFalse(IntegerAllocation.objects.filter(
+            network__contains_ip='10.0.0.1', network=None).exists())
+
+        # Expressions cannot be converted in Python.
+        with self.assertRaises(ValueError), transaction.atomic():
+            IntegerAllocation.objects.update(network=F('network'))
+        IntegerAllocation.objects.filter(network='10.1.2.3').update(
+            network=F('network'), network_last=F('network_last'))
+        self.assertEqual(
+            IntegerAllocation.objects.get(network='10.1.2.3').network_last,
+            cidr4('10.1.2.3').address)
+
+        # Nor can bulk_update(), which sets the last address to go with
+        # the first.
+        objs = list(IntegerAllocation.objects.filter(
+            network__within='10.1.0.0/16'))
+        for obj in objs:
+            obj.network = obj.network.truncated(8)
+        with self.assertRaises(ValueError), transaction.atomic():
+            IntegerAllocation.objects.bulk_update(objs, ['network'])
+        IntegerAllocation.objects.bulk_update(
+            objs, ['network', 'network_last'])
+        self.assertEqual(IntegerAllocation.objects.filter(
+            network='10.0.0.0/8').count(), 3)
+
+    def test_columns_disagree(self):
+        IntegerAllocation.objects.filter(network='10.1.0.0/16').update(
+            network_last=cidr4('10.1.2.255').address)
+        with self.assertRaises(ValueError):
+            list(IntegerAllocation.objects.all())
+        IntegerAllocation.objects.filter(network='10.1.2.3').update(
+            network_last=None)
+        with self.assertRaises(ValueError):
+            list(IntegerAllocation.objects.filter(
+                network_last=None).values_list('network', flat=True))
+
+    def test_deferred(self):
+        for model in self.models:
+            obj = model.objects.only('id').get(
+                pk=model.objects.get(network='10.1.0.0/16').pk)
+            self.assertEqual(obj.get_deferred_fields() & {'network'},
+                             {'network'})
+            with self.assertNumQueries(1):
+                self.assertEqual(obj.network, cidr4('10.1.0.0/16'))
+                self.assertEqual(obj.network, cidr4('10.1.0.0/16'))
+
+    def test_overlaps(self):
+        for model in self.models:
+            self.assertNetworks(
+                model.objects.filter(network__overlaps='10.1.0.0/16'),
+                ['0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24',
+                 '10.1.2.3'])
+            self.assertNetworks(
+                model.objects.filter(network__overlaps='0.0.0.0/0'),
+                self.networks)
+
+
+class Cidr6FieldTestCase(TestCase):
+    networks = ('::/0', '2001:db8::/32', '2001:db8::/48', '2001:db8:1::/48',
+                '2001:db8::1', 'fe80::/10')
+
+    def setUp(self):
+        for network in self.networks:
+            Cidr6Allocation.objects.create(network=network)
+        Cidr6Allocation.objects.create(network=None)
+
+    def test_storage(self):
+        obj = Cidr6Allocation.objects.get(network='2001:db8::/48')
+        self.assertEqual(obj.network, cidr6('2001:db8::/48'))
+        self.assertEqual(
+            Cidr6Allocation.objects.filter(pk=obj.pk).extra(
+                select={'raw': 'network'}).values_list('raw', flat=True)[0],
+            '20010db8000000000000000000000000/048')
+        obj.network = '2001:db8:2::/48'
+        obj.save()
+        obj = Cidr6Allocation.objects.get(pk=obj.pk)
+        self.assertEqual(obj.network, cidr6('2001:db8:2::/48'))
+        self.assertIsNone(Cidr6Allocation.objects.get(
+            network__isnull=True).network)
+
+    def test_deconstruct(self):
+        name, path, args, kwargs = Cidr6Allocation._meta.get_field(
+            'network').deconstruct()
+        self.assertEqual(path, 'osso.core.models.fields.Cidr6Field')
+        self.assertEqual(kwargs, {'null': True, 'blank': True})
+
+    def test_exact(self):
+        self.assertEqual(
+            [str(i.network) for i in Cidr6Allocation.objects.filter(
+                network='2001:DB8::/32')], ['2001:db8::/32'])
+        self.assertEqual(
+            list(Cidr6Allocation.objects.filter(
+                network__in=['2001:db8::1', 'fe80::/10']).order_by(
+                    'network').values_list('network', flat=True)),
+            [cidr6('2001:db8::1'), cidr6('fe80::/10')])
+
+    def test_ordering(self):
+        self.assertEqual(
+            list(Cidr6Allocation.objects.exclude(network=None).order_by(
+                'network').values_list('network', flat=True)),
+            sorted(cidr6(i) for i in self.networks))
+
+    def test_formfield(self):
+        field = Cidr6Allocation._meta.get_field('network').formfield()
+        self.assertIsInstance(field, Cidr6FormField)
+        self.assertEqual(
+            field.clean(' 2001:DB8::/32 '), cidr6('2001:db8::/32'))
+        self.assertIsNone(field.clean(''))
+        for value in ('2001:db8::1/32', '10.0.0.0/8', 'aap'):
+            with self.assertRaises(forms.ValidationError):
+                field.clean(value)
+        with self.assertRaises(forms.ValidationError):
+            Cidr6FormField().clean('')
@@ -1,7 +1,19 @@
 # vim: set ts=8 sw=4 sts=4 et ai:
-from django.test import TestCase
+import os
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import skipUnless
+
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
 
 from osso.sequence import SequenceDoesNotExist, SequenceError, sequence
+from osso.sequence.backends import memory
+from osso.sequence.block import BlockSequence
 
 
 class SequenceTest(TestCase):
@@ -135,3 +147,270 @@ class SequenceTest(TestCase):
         sequence.create('Counter')
         sequence.drop('Counter')
         self.assertEqual(sequence.nextval('counter'), 1)
+
+    def test_reserve(self):
+        sequence.create('counter')
+        sequence.create('invoice', start=100, increment=10)
+        self.assertEqual(sequence.reserve('counter', 5), (1, 1))
+        self.assertEqual(sequence.currval('counter'), 5)
+        self.assertEqual(sequence.reserve('counter', 1), (6, 1))
+        self.assertEqual(sequence.nextval('counter'), 7)
+
+        self.assertEqual(sequence.reserve('invoice', 3), (100, 10))
+        self.assertEqual(sequence.currval('invoice'), 120)
+        self.assertEqual(sequence.nextval('invoice'), 130)
+
+        self.assertRaises(SequenceError, sequence.reserve, 'counter', 0)
+        self.assertRaises(
+            SequenceDoesNotExist, sequence.reserve, 'missing', 5)
+
+    def test_nextval_many(self):
+        sequence.create('counter')
+        sequence.create('counter2')
+        sequence.create('invoice', start=100, increment=10)
+        sequence.create('invoice2', start=100, increment=10)
+        for name in ('counter', 'invoice'):
+            for count in (1, 5, 3):
+                many = sequence.nextval_many(name, count)
+                self.assertEqual(len(many), count)
+                self.assertEqual(
+                    list(many),
+                    [sequence.nextval(name + '2') for i in range(count)])
+                self.assertEqual(
+                    sequence.currval(name), sequence.currval(name + '2'))
+
+        self.assertRaises(SequenceError, sequence.nextval_many, 'counter', 0)
+        self.assertRaises(
+            SequenceDoesNotExist, sequence.nextval_many, 'missing', 5)
+
+    def test_recover_on_failed_nextval_many(self):
+        self.assertRaises(SequenceError, sequence.nextval_many, 'counter', 5)
+        sequence.create('counter')
+        self.assertEqual(list(sequence.nextval_many('counter', 2)), [1, 2])
+
+    def test_cursor_reuse(self):
+        self.assertIs(sequence.get_cursor(), sequence.get_cursor())
+        sequence.create('counter')
+        self.assertEqual(sequence.nextval('counter'), 1)
+        self.assertEqual(sequence.nextval('counter'), 2)
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+    def test_postgresql_without_savepoints(self):
+        # Failures must not abort the transaction, even without the
+        # savepoints.
+        from osso.sequence.backends.postgresql import Sequence
+        seq = Sequence(savepoints=False)
+        seq.create('counter')
+        self.assertRaises(SequenceError, seq.create, 'counter')
+        self.assertRaises(SequenceDoesNotExist, seq.nextval, 'invoice')
+        self.assertRaises(SequenceDoesNotExist, seq.reserve, 'invoice', 2)
+        self.assertRaises(SequenceDoesNotExist, seq.setval, 'invoice', 2)
+        self.assertRaises(SequenceDoesNotExist, seq.drop, 'invoice')
+        self.assertEqual(seq.nextval('counter'), 1)
+
+    def test_all(self):
+        sequence.create('invoice', start=100, increment=10)
+        sequence.create('counter')
+        sequence.nextval('counter')
+        self.assertEqual(sequence.all(), [
+            ('counter', 1, 1, 1), ('invoice', 100, 10, None)])
+
+    def test_engine(self):
+        app_config = apps.get_app_config('sequence')
+        self.assertEqual(app_config.get_engine(), 'table')
+        with override_settings(SEQUENCE_ENGINE='bogus'):
+            self.assertRaises(SequenceError, app_config.get_engine)
+        if connection.vendor not in app_config.NATIVE_BACKENDS:
+            self.assertRaises(
+                SequenceError, app_config.get_engine_backend, 'native')
+
+    def test_sequenceengine_memory(self):
+        sequence.create('counter')
+        sequence.nextval('counter')
+        with TemporaryDirectory() as tmpdir, override_settings(
+                SEQUENCE_MEMORY_FILE=os.path.join(tmpdir, 'sequences')):
+            call_command('sequenceengine', 'table', 'memory', verbosity=0)
+            self.assertEqual(sequence.all(), [])
+            mem = apps.get_app_config('sequence').get_engine_backend('memory')
+            self.assertEqual(mem.nextval('counter'), 2)
+            call_command('sequenceengine', 'memory', 'table', verbosity=0)
+            self.assertEqual(mem.all(), [])
+            mem.store.close()
+        self.assertEqual(sequence.all(), [('counter', 1, 1, 2)])
+
+
+class NativeSequenceTest(TransactionTestCase):
+    # CREATE SEQUENCE and DROP SEQUENCE commit implicitly on MySQL and
+    # MariaDB, so these cannot run inside the transaction of a TestCase.
+    def tearDown(self):
+        app_config = apps.get_app_config('sequence')
+        if connection.vendor in app_config.NATIVE_BACKENDS:
+            native = app_config.get_engine_backend('native')
+            for name, start, increment, currval in native.all():
+                native.drop(name)
+
+    @skipUnless(connection.vendor in ('mysql', 'postgresql'),
+                'no native sequences')
+    def test_native_engine(self):
+        app_config = apps.get_app_config('sequence')
+        native = app_config.get_engine_backend('native')
+        native.create('counter')
+        native.create('invoice', start=100, increment=10)
+        self.assertRaises(SequenceError, native.create, 'counter')
+        self.assertRaises(SequenceError, native.currval, 'counter')
+        self.assertEqual(native.nextval('counter'), 1)
+        self.assertEqual(native.nextval('invoice'), 100)
+        self.assertEqual(native.currval('invoice'), 100)
+        self.assertEqual(list(native.nextval_many('invoice', 3)),
+                         [110, 120, 130])
+        native.setval('counter', 5)
+        self.assertEqual(native.nextval('counter'), 6)
+        self.assertEqual(native.all(), [
+            ('counter', 1, 1, 6), ('invoice', 100, 10, 130)])
+        native.drop('counter')
+        native.drop('invoice')
+        self.assertRaises(SequenceDoesNotExist, native.nextval, 'counter')
+        self.assertRaises(SequenceDoesNotExist, native.drop, 'counter')
+
+    def test_sequenceengine_command(self):
+        with self.assertRaisesRegex(CommandError, 'are the same'):
+            call_command('sequenceengine', 'table', 'table')
+        if connection.vendor not in ('mysql', 'postgresql'):
+            with self.assertRaisesRegex(CommandError, 'no native'):
+                call_command('sequenceengine', 'table', 'native')
+            return
+
+        sequence.create('counter')
+        sequence.create('invoice', start=100, increment=10)
+        sequence.nextval('counter')
+        call_command('sequenceengine', 'table', 'native', verbosity=0)
+        self.assertEqual(sequence.all(), [])
+        native = apps.get_app_config('sequence').get_engine_backend('native')
+        self.assertEqual(native.nextval('counter'), 2)
+        call_command('sequenceengine', 'native', 'table', verbosity=0)
+        self.assertEqual(native.all(), [])
+        self.assertEqual(sequence.all(), [
+            ('counter', 1, 1, 2), ('invoice', 100, 10, None)])
+
+
+class BlockSequenceTest(TransactionTestCase):
+    def get_sequence(self, **block_sizes):
+        backend = apps.get_app_config('sequence').get_backend()
+        return BlockSequence(backend, block_sizes)
+
+    def test_block(self):
+        seq = self.get_sequence(counter=10)
+        seq.create('counter')
+        seq.create('other')
+        self.assertEqual([seq.nextval('counter') for i in range(3)],
+                         [1, 2, 3])
+        self.assertEqual(seq.currval('counter'), 3)
+        self.assertEqual(seq.backend.currval('counter'), 10)
+
+        # Unlisted sequences are not cached.
+        self.assertEqual(seq.nextval('other'), 1)
+        self.assertEqual(seq.backend.currval('other'), 1)
+
+    def test_block_refill(self):
+        seq = self.get_sequence(invoice=2)
+        seq.create('invoice', start=100, increment=10)
+        self.assertEqual([seq.nextval('invoice') for i in range(5)],
+                         [100, 110, 120, 130, 140])
+        self.assertEqual(seq.backend.currval('invoice'), 150)
+
+    def test_block_concurrent(self):
+        # Two "processes" get disjoint blocks.
+        seq1 = self.get_sequence(counter=10)
+        seq2 = self.get_sequence(counter=10)
+        seq1.create('counter')
+        self.assertEqual(seq1.nextval('counter'), 1)
+        self.assertEqual(seq2.nextval('counter'), 11)
+        self.assertEqual(seq1.nextval('counter'), 2)
+        self.assertEqual(seq2.nextval('counter'), 12)
+
+    def test_block_setval(self):
+        seq = self.get_sequence(counter=10)
+        seq.create('counter')
+        self.assertEqual(seq.nextval('counter'), 1)
+        seq.setval('counter', 100)
+        self.assertEqual(seq.currval('counter'), 100)
+        self.assertEqual(seq.nextval('counter'), 101)
+
+    def test_block_in_transaction(self):
+        seq = self.get_sequence(counter=10)
+        seq.create('counter')
+        self.assertEqual(seq.nextval('counter'), 1)
+        with transaction.atomic():
+            # The remainder of the block is used.
+            self.assertEqual(
+                [seq.nextval('counter') for i in range(9)], list(range(2, 11)))
+            # After that, we do not reserve a new block.
+            self.assertEqual(seq.nextval('counter'), 11)
+            self.assertEqual(seq.backend.currval('counter'), 11)
+
+
+class MemorySequenceTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'sequences')
+
+    def tearDown(self):
+        memory.get_store(self.path).close()
+        self.tmpdir.cleanup()
+
+    def test_sequences(self):
+        seq = memory.Sequence(self.path)
+        seq.create('counter')
+        seq.create('invoice', start=100, increment=10)
+        self.assertRaises(SequenceError, seq.create, 'counter')
+        self.assertRaises(SequenceError, seq.currval, 'counter')
+        self.assertRaises(SequenceDoesNotExist, seq.nextval, 'other')
+        self.assertRaises(SequenceError, seq.nextval, '1337')
+        self.assertEqual(seq.nextval('counter'), 1)
+        self.assertEqual(seq.nextval('counter'), 2)
+        self.assertEqual(seq.nextval('invoice'), 100)
+        self.assertEqual(list(seq.nextval_many('invoice', 3)),
+                         [110, 120, 130])
+        seq.setval('counter', 5)
+        self.assertEqual(seq.currval('counter'), 5)
+        self.assertEqual(seq.all(), [
+            ('counter', 1, 1, 5), ('invoice', 100, 10, 130)])
+        seq.drop('counter')
+        self.assertRaises(SequenceDoesNotExist, seq.drop, 'counter')
+
+        # All instances in a process share the data.
+        self.assertEqual(memory.Sequence(self.path).nextval('invoice'), 140)
+
+    def test_persistence(self):
+        seq = memory.Sequence(self.path)
+        for i in range(100):
+            seq.create('seq%d' % (i,), start=i)
+        for i in range(0, 100, 3):
+            seq.drop('seq%d' % (i,))
+        seq.nextval('seq1')
+        seq.nextval('seq1')
+        expected = seq.all()
+        seq.store.close()
+
+        seq = memory.Sequence(self.path)
+        self.assertEqual(seq.all(), expected)
+        self.assertEqual(seq.nextval('seq1'), 3)
+
+    def test_in_use(self):
+        memory.Sequence(self.path)
+        self.assertRaises(SequenceError, memory.Store, self.path)
+
+    def test_threads(self):
+        seq = memory.Sequence(self.path)
+        seq.create('counter')
+        values = []
+
+        def worker():
+            values.extend(seq.nextval('counter') for i in range(1000))
+
+        threads = [Thread(target=worker) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(values), list(range(1, 8001)))